@@ -0,0 +1,128 @@
+import time
+
+import frappe
+from frappe.utils import cint
+
+from frappe_mpsa_payments.frappe_mpsa_payments.api.m_pesa_api import submit_c2b_payment_register
+from frappe_mpsa_payments.frappe_mpsa_payments.api.payment_entry import (
+    create_and_reconcile_payment_reconciliation,
+)
+from frappe_mpsa_payments.utils.metrics import increment_metric
+from frappe_mpsa_payments.utils.site_config import C2B_AUTO_MATCH, C2B_AUTO_MATCH_BATCH_SIZE
+from frappe_mpsa_payments.utils.utils import acquire_redis_lock, release_redis_lock
+
+AUTO_MATCH_KEY = "mpesa_c2b_auto_match"
+AUTO_MATCH_LOCK_LEASE = 10 * 60
+DEFAULT_AUTO_MATCH_BATCH_SIZE = 200
+
+
+def match_c2b_payments(batch_size=None):
+    """Post pending registers whose BillRefNumber / InvoiceNumber name an invoice or a customer.
+
+    Runs from the scheduler when `mpesa_c2b_auto_match` is set. A register is matched when
+    its references point at a single customer, and at most one unpaid Sales Invoice of that
+    customer in the register's company. It is then submitted, which creates its Payment
+    Entry, and reconciled against the invoice if there is one. Registers pointing at more
+    than one customer or invoice are marked Ambiguous and left in draft for review.
+    """
+    if not frappe.conf.get(C2B_AUTO_MATCH):
+        return
+
+    lock = acquire_redis_lock(AUTO_MATCH_KEY, AUTO_MATCH_LOCK_LEASE)
+    if not lock:
+        return
+
+    batch_size = cint(batch_size or frappe.conf.get(C2B_AUTO_MATCH_BATCH_SIZE)) or DEFAULT_AUTO_MATCH_BATCH_SIZE
+    # stop well inside the lease, the next run picks up what is left
+    deadline = time.monotonic() + AUTO_MATCH_LOCK_LEASE / 2
+    try:
+        while time.monotonic() < deadline:
+            registers = frappe.get_all(
+                "Mpesa C2B Payment Register",
+                filters={"auto_match_status": "Pending", "docstatus": 0},
+                fields=["name", "company", "billrefnumber", "invoicenumber"],
+                order_by="creation asc",
+                limit=batch_size,
+            )
+            if not registers:
+                break
+
+            matches = resolve_matches(registers)
+            for register in registers:
+                apply_match(register, matches[register.name])
+            frappe.db.commit()
+
+            if len(registers) < batch_size:
+                break
+    finally:
+        release_redis_lock(AUTO_MATCH_KEY, lock)
+
+
+def get_references(register):
+    return {ref.strip() for ref in (register.billrefnumber, register.invoicenumber) if ref and ref.strip()}
+
+
+def resolve_matches(registers):
+    """Resolve a batch of registers with one Sales Invoice and one Customer lookup by name.
+
+    Returns, per register, ("Matched", customer, invoice or None), ("Ambiguous", None, None)
+    or ("Unmatched", None, None).
+    """
+    references = list({ref for register in registers for ref in get_references(register)})
+
+    # names compare case-insensitively, as they do in the database
+    invoices, customers = {}, {}
+    if references:
+        for invoice in frappe.get_all(
+            "Sales Invoice",
+            filters={"name": ["in", references], "docstatus": 1, "outstanding_amount": [">", 0]},
+            fields=["name", "customer", "company"],
+        ):
+            invoices[invoice.name.lower()] = invoice
+        for customer in frappe.get_all(
+            "Customer", filters={"name": ["in", references], "disabled": 0}, pluck="name"
+        ):
+            customers[customer.lower()] = customer
+
+    matches = {}
+    for register in registers:
+        matched_customers, matched_invoices = set(), set()
+        for ref in get_references(register):
+            invoice = invoices.get(ref.lower())
+            if invoice and invoice.company == register.company:
+                matched_customers.add(invoice.customer)
+                matched_invoices.add(invoice.name)
+            if ref.lower() in customers:
+                matched_customers.add(customers[ref.lower()])
+
+        if not register.company or not matched_customers:
+            matches[register.name] = ("Unmatched", None, None)
+        elif len(matched_customers) > 1 or len(matched_invoices) > 1:
+            matches[register.name] = ("Ambiguous", None, None)
+        else:
+            invoice = next(iter(matched_invoices), None)
+            matches[register.name] = ("Matched", matched_customers.pop(), invoice)
+    return matches
+
+
+def apply_match(register, match):
+    status, customer, invoice = match
+    if status == "Matched":
+        try:
+            frappe.db.savepoint(AUTO_MATCH_KEY)
+            doc = submit_c2b_payment_register(register.name, customer, 1)
+            if invoice:
+                create_and_reconcile_payment_reconciliation(
+                    invoice, customer, register.company, [doc.payment_entry], commit=False
+                )
+        except Exception:
+            frappe.db.rollback(save_point=AUTO_MATCH_KEY)
+            frappe.log_error(title=f"Mpesa C2B auto match failed for {register.name}")
+            status = "Failed"
+        finally:
+            frappe.clear_messages()
+
+    frappe.db.set_value(
+        "Mpesa C2B Payment Register", register.name, "auto_match_status", status, update_modified=False
+    )
+    increment_metric(f"c2b_auto_match_{status.lower()}")
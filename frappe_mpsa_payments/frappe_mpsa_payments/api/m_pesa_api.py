@@ -1,41 +1,161 @@
 
 from __future__ import unicode_literals
-import frappe, requests
+import frappe
 from frappe import _
+from frappe.utils import cint, create_batch
+from frappe.realtime import get_doctype_room
+from frappe.utils.background_jobs import get_redis_conn
 from requests.auth import HTTPBasicAuth
 import json
+import time
+from datetime import datetime, timedelta
+from functools import partial
 
+from frappe_mpsa_payments.frappe_mpsa_payments.connectors.session import get_session
+from frappe_mpsa_payments.utils.metrics import increment_metric
+from frappe_mpsa_payments.utils.site_config import (
+    C2B_ASYNC_INGEST,
+    C2B_INGEST_BATCH_SIZE,
+    C2B_SEEN_TTL,
+)
+from frappe_mpsa_payments.utils.utils import (
+    ACCESS_TOKEN_REQUEST_TIMEOUT,
+    acquire_redis_lock,
+    get_access_token,
+    release_redis_lock,
+    save_access_token,
+)
 
-def get_token(app_key, app_secret, base_url):
-    authenticate_uri = "/oauth/v1/generate?grant_type=client_credentials"
-    authenticate_url = "{0}{1}".format(base_url, authenticate_uri)
 
-    r = requests.get(authenticate_url, auth=HTTPBasicAuth(app_key, app_secret))
+def get_token(app_key, app_secret, base_url, setting=None, env=None):
+    def fetch():
+        authenticate_uri = "/oauth/v1/generate?grant_type=client_credentials"
+        authenticate_url = "{0}{1}".format(base_url, authenticate_uri)
 
-    return r.json()["access_token"]
+        r = get_session().get(
+            authenticate_url,
+            auth=HTTPBasicAuth(app_key, app_secret),
+            timeout=ACCESS_TOKEN_REQUEST_TIMEOUT,
+        )
+        response = r.json()
+
+        fetch_time = datetime.now()
+        token = {
+            "access_token": response["access_token"],
+            "expires_in": fetch_time + timedelta(seconds=int(response.get("expires_in") or 0)),
+            "fetched_time": fetch_time,
+        }
+        if setting:
+            save_access_token(
+                token=token["access_token"],
+                expiry_time=token["expires_in"],
+                fetch_time=fetch_time,
+                associated_setting=setting,
+                env=env,
+            )
+        return token
+
+    if setting:
+        return get_access_token(setting, env, fetch)["access_token"]
+
+    return fetch()["access_token"]
+
+
+# Safaricom callback key -> Mpesa C2B Payment Register fieldname
+C2B_CALLBACK_FIELDS = {
+    "TransactionType": "transactiontype",
+    "TransID": "transid",
+    "TransTime": "transtime",
+    "TransAmount": "transamount",
+    "BusinessShortCode": "businessshortcode",
+    "BillRefNumber": "billrefnumber",
+    "InvoiceNumber": "invoicenumber",
+    "OrgAccountBalance": "orgaccountbalance",
+    "ThirdPartyTransID": "thirdpartytransid",
+    "MSISDN": "msisdn",
+    "FirstName": "firstname",
+    "MiddleName": "middlename",
+    "LastName": "lastname",
+}
+
+C2B_INGEST_QUEUE = "mpesa_c2b_ingest"
+DEFAULT_C2B_INGEST_BATCH_SIZE = 500
+# a drain stops taking new batches at half the lease, so the lock never runs out under it
+C2B_INGEST_LOCK_LEASE = 5 * 60
+C2B_SEEN_KEY = "mpesa_c2b_seen"
+DEFAULT_C2B_SEEN_TTL = 48 * 60 * 60
+
+DEFAULT_DRAFT_C2B_PAYMENTS_LIMIT = 20
+MAX_DRAFT_C2B_PAYMENTS_LIMIT = 500
+DRAFT_C2B_PAYMENT_FIELDS = (
+    "name",
+    "company",
+    "msisdn",
+    "full_name",
+    "posting_date",
+    "posting_time",
+    "transamount",
+)
+MIN_MSISDN_SEARCH_DIGITS = 3
+# InnoDB's default innodb_ft_min_token_size, shorter words are not in the FULLTEXT index
+MIN_FULLTEXT_WORD_LENGTH = 3
+
+C2B_NOTIFY_QUEUE = "mpesa_c2b_notify"
+C2B_NOTIFY_EVENT = "mpesa_c2b_payments"
+C2B_NOTIFY_SCHEDULED_TTL = 60
+
+BULK_PAYMENT_KEY = "mpesa_bulk_payment"
+BULK_PAYMENT_EVENT = "mpesa_bulk_payment_progress"
+DEFAULT_BULK_PAYMENT_CHUNK_SIZE = 100
+BULK_PAYMENT_STATUS_TTL = 24 * 60 * 60
+
+C2B_PAYMENTS_VERSION_KEY = "mpesa_c2b_payments_version"
+DEFAULT_C2B_PAYMENT_CHANGES_LIMIT = 100
+C2B_PAYMENT_CHANGE_FIELDS = DRAFT_C2B_PAYMENT_FIELDS + ("docstatus", "modified")
+
+DEFAULT_DRAFT_POS_INVOICES_LIMIT = 20
+MAX_DRAFT_POS_INVOICES_LIMIT = 500
+DRAFT_POS_INVOICE_FIELDS = (
+    "name",
+    "customer",
+    "customer_name",
+    "company",
+    "posting_date",
+    "due_date",
+    "currency",
+    "grand_total",
+    "outstanding_amount",
+    "status",
+)
 
 
 @frappe.whitelist(allow_guest=True)
 def confirmation(**kwargs):
+    context = {"ResultCode": 0, "ResultDesc": "Accepted"}
     try:
         args = frappe._dict(kwargs)
-        doc = frappe.new_doc("Mpesa C2B Payment Register")
-        doc.transactiontype = args.get("TransactionType")
-        doc.transid = args.get("TransID")
-        doc.transtime = args.get("TransTime")
-        doc.transamount = args.get("TransAmount")
-        doc.businessshortcode = args.get("BusinessShortCode")
-        doc.billrefnumber = args.get("BillRefNumber")
-        doc.invoicenumber = args.get("InvoiceNumber")
-        doc.orgaccountbalance = args.get("OrgAccountBalance")
-        doc.thirdpartytransid = args.get("ThirdPartyTransID")
-        doc.msisdn = args.get("MSISDN")
-        doc.firstname = args.get("FirstName")
-        doc.middlename = args.get("MiddleName")
-        doc.lastname = args.get("LastName")
-        doc.insert(ignore_permissions=True)
-        frappe.db.commit()
-        context = {"ResultCode": 0, "ResultDesc": "Accepted"}
+        transid = args.get("TransID")
+
+        # Safaricom retries slow acks, answer repeats from the cache before touching the db
+        if transid and not claim_c2b_transid(transid):
+            increment_metric("c2b_duplicate_callbacks")
+            return dict(context)
+
+        try:
+            validate_c2b_payload(args)
+            if frappe.conf.get(C2B_ASYNC_INGEST):
+                enqueue_c2b_payment(args)
+            else:
+                insert_c2b_payment(args)
+                frappe.db.commit()
+        except (frappe.DuplicateEntryError, frappe.UniqueValidationError):
+            frappe.db.rollback()
+            increment_metric("c2b_duplicate_callbacks")
+        except Exception:
+            if transid:
+                release_c2b_transid(transid)
+            raise
+
         return dict(context)
     except Exception as e:
         frappe.log_error(frappe.get_traceback(), str(e)[:140])
@@ -43,6 +163,104 @@ def confirmation(**kwargs):
         return dict(context)
 
 
+def claim_c2b_transid(transid):
+    """Mark a TransID as seen, returns False if it had already been seen within the TTL."""
+    cache = frappe.cache()
+    ttl = cint(frappe.conf.get(C2B_SEEN_TTL)) or DEFAULT_C2B_SEEN_TTL
+    return bool(cache.set(cache.make_key(f"{C2B_SEEN_KEY}|{transid}"), 1, nx=True, ex=ttl))
+
+
+def release_c2b_transid(transid):
+    """Forget a TransID whose callback failed, so that Safaricom's retry is processed."""
+    cache = frappe.cache()
+    cache.delete(cache.make_key(f"{C2B_SEEN_KEY}|{transid}"))
+
+
+def insert_c2b_payment(args):
+    doc = frappe.new_doc("Mpesa C2B Payment Register")
+    for key, fieldname in C2B_CALLBACK_FIELDS.items():
+        doc.set(fieldname, args.get(key))
+    doc.insert(ignore_permissions=True)
+    return doc
+
+
+def validate_c2b_payload(args):
+    """Reject payloads that would fail on insert or be stored with a zero amount."""
+    if not args.get("TransID"):
+        frappe.throw(_("TransID is required"))
+    if not args.get("BusinessShortCode"):
+        frappe.throw(_("BusinessShortCode is required"))
+    try:
+        float(args.get("TransAmount"))
+    except (TypeError, ValueError):
+        frappe.throw(_("Invalid TransAmount: {0}").format(args.get("TransAmount")))
+
+
+def get_c2b_ingest_queue_key():
+    return f"{frappe.local.site}:{C2B_INGEST_QUEUE}"
+
+
+def enqueue_c2b_payment(args):
+    """Append the callback to the site's ingest list on the (non-evicting) queue Redis
+    and make sure a consumer is scheduled to drain it."""
+    payload = {key: args.get(key) for key in C2B_CALLBACK_FIELDS}
+    get_redis_conn().rpush(get_c2b_ingest_queue_key(), json.dumps(payload))
+
+    frappe.enqueue(
+        "frappe_mpsa_payments.frappe_mpsa_payments.api.m_pesa_api.process_c2b_ingest_queue",
+        queue="short",
+        job_id=f"{C2B_INGEST_QUEUE}::{frappe.local.site}",
+        deduplicate=True,
+    )
+
+
+def process_c2b_ingest_queue(batch_size=None):
+    """Drain queued C2B callbacks into Mpesa C2B Payment Register, one commit per batch.
+
+    Runs as a deduplicated background job and from the scheduler. Both hold the site's
+    ingest lock while draining, so a single consumer reads the head of the list while
+    callbacks keep being appended to the tail, and entries are only trimmed off the list
+    after their batch has been committed. A run that finds the lock taken returns, the
+    consumer holding it drains what is queued.
+    """
+    lock = acquire_redis_lock(C2B_INGEST_QUEUE, C2B_INGEST_LOCK_LEASE)
+    if not lock:
+        return
+
+    conn = get_redis_conn()
+    key = get_c2b_ingest_queue_key()
+    batch_size = cint(batch_size or frappe.conf.get(C2B_INGEST_BATCH_SIZE)) or (
+        DEFAULT_C2B_INGEST_BATCH_SIZE
+    )
+    deadline = time.monotonic() + C2B_INGEST_LOCK_LEASE / 2
+
+    try:
+        while time.monotonic() < deadline:
+            batch = conn.lrange(key, 0, batch_size - 1)
+            if not batch:
+                break
+
+            for raw in batch:
+                payload = frappe._dict(json.loads(raw))
+                try:
+                    frappe.db.savepoint(C2B_INGEST_QUEUE)
+                    insert_c2b_payment(payload)
+                except (frappe.DuplicateEntryError, frappe.UniqueValidationError):
+                    frappe.db.rollback(save_point=C2B_INGEST_QUEUE)
+                    increment_metric("c2b_duplicate_callbacks")
+                except Exception:
+                    frappe.db.rollback(save_point=C2B_INGEST_QUEUE)
+                    frappe.log_error(
+                        title="Mpesa C2B Ingest Error",
+                        message=f"{frappe.get_traceback()}\n\nPayload: {raw}",
+                    )
+
+            frappe.db.commit()
+            conn.ltrim(key, len(batch), -1)
+    finally:
+        release_redis_lock(C2B_INGEST_QUEUE, lock)
+
+
 @frappe.whitelist(allow_guest=True)
 def validation(**kwargs):
     context = {"ResultCode": 0, "ResultDesc": "Accepted"}
@@ -63,63 +281,245 @@ def get_mpesa_mode_of_payment(company):
     return modes_of_payment
 
 @frappe.whitelist(allow_guest=True)
-def get_mpesa_draft_c2b_payments(search_term):
-    fields = [
-        "name",
-        "company",
-        "msisdn",
-        "full_name",
-        "posting_date",
-        "posting_time",
-        "transamount",
-    ]
+def get_mpesa_draft_c2b_payments(search_term=None, limit=DEFAULT_DRAFT_C2B_PAYMENTS_LIMIT, cursor=None):
+    """Return draft registers matching a phone number or name, newest first.
 
-    filters = {"docstatus": 0}
-    order_by="posting_date desc, posting_time desc"
+    Digits are matched against the end of the MSISDN (through the reversed MSISDN index),
+    words against the full name (FULLTEXT prefix search on MariaDB). Pass the name of the
+    last row returned as `cursor` to fetch the next page.
+    """
+    limit = min(cint(limit) or DEFAULT_DRAFT_C2B_PAYMENTS_LIMIT, MAX_DRAFT_C2B_PAYMENTS_LIMIT)
+    values = {"limit": limit}
+    conditions = ["docstatus = 0"]
 
-    if search_term:
-        payments_by_msisdn = frappe.get_all(
-            "Mpesa C2B Payment Register",
-            filters={"msisdn": ["like", f"%{search_term}%"], "docstatus": 0},
-            fields=fields,
-            order_by=order_by
-        )
-        payments_by_full_name = frappe.get_all(
-            "Mpesa C2B Payment Register",
-            filters={"full_name": ["like", f"%{search_term}%"], "docstatus": 0},
-            fields=fields,
-            order_by=order_by
+    if cursor:
+        last_row = frappe.db.get_value(
+            "Mpesa C2B Payment Register", cursor, ["posting_date", "posting_time"], as_dict=True
         )
+        if last_row:
+            conditions.append(
+                "(posting_date, posting_time, name) < (%(cursor_date)s, %(cursor_time)s, %(cursor)s)"
+            )
+            values.update(cursor=cursor, cursor_date=last_row.posting_date, cursor_time=last_row.posting_time)
+
+    search_conditions = get_c2b_search_conditions(search_term, values)
+    if search_term and not search_conditions:
+        return []
+
+    fields = ", ".join(DRAFT_C2B_PAYMENT_FIELDS)
+    order_by = "posting_date desc, posting_time desc, name desc"
+    selects = [
+        f"""(select {fields} from `tabMpesa C2B Payment Register`
+            where {" and ".join(conditions + [search_condition])}
+            order by {order_by} limit %(limit)s)"""
+        for search_condition in search_conditions or ["1 = 1"]
+    ]
+
+    # each branch is served by its own index, the union drops rows that match more than one
+    return frappe.db.sql(
+        f"""select * from ({" union ".join(selects)}) as payments
+        order by {order_by} limit %(limit)s""",
+        values,
+        as_dict=True,
+    )
+
+
+def get_c2b_search_conditions(search_term, values):
+    search_term = (search_term or "").strip()
+    if not search_term:
+        return []
+
+    conditions = []
+
+    digits = "".join(c for c in search_term if c.isdigit())
+    if digits.startswith("254"):
+        digits = digits[3:]
+    digits = digits.lstrip("0")
+    if len(digits) >= MIN_MSISDN_SEARCH_DIGITS:
+        conditions.append("msisdn_reversed like %(msisdn_suffix)s")
+        values["msisdn_suffix"] = digits[::-1] + "%"
+
+    words = "".join(c if c.isalnum() else " " for c in search_term).split()
+    words = [word for word in words if not word.isdigit()]
+    if words:
+        if frappe.db.db_type == "mariadb" and all(len(word) >= MIN_FULLTEXT_WORD_LENGTH for word in words):
+            conditions.append("match(full_name) against (%(full_name_query)s in boolean mode)")
+            values["full_name_query"] = " ".join(f"+{word}*" for word in words)
+        else:
+            conditions.append("full_name like %(full_name_prefix)s")
+            values["full_name_prefix"] = " ".join(words) + "%"
+
+    return conditions
+
+
+@frappe.whitelist()
+def get_c2b_payment_changes(since=None, company=None, limit=DEFAULT_C2B_PAYMENT_CHANGES_LIMIT):
+    """Return registers inserted, submitted or cancelled after the `since` cursor.
+
+    Poll with the `cursor` of the previous response, starting without one. The response
+    carries an ETag built from a version counter that every register change bumps, so a
+    poll sending it back as If-None-Match gets a 304 from Redis alone until a change.
+    """
+    frappe.has_permission("Mpesa C2B Payment Register", throw=True)
+
+    limit = min(cint(limit) or DEFAULT_C2B_PAYMENT_CHANGES_LIMIT, MAX_DRAFT_C2B_PAYMENTS_LIMIT)
+    # read before the query, a change committed while it runs is picked up by the next poll
+    etag = f'"{get_c2b_payments_version()}:{since or ""}:{company or ""}:{limit}"'
+    frappe.flags.mpesa_etag = etag
+
+    if frappe.get_request_header("If-None-Match") == etag:
+        frappe.local.response["http_status_code"] = 304
+        return
+
+    values = {"limit": limit + 1}
+    conditions = []
+    if since:
+        modified, _, name = since.partition("|")
+        conditions.append("(modified > %(modified)s or (modified = %(modified)s and name > %(name)s))")
+        values.update(modified=modified, name=name)
+    if company:
+        conditions.append("company = %(company)s")
+        values["company"] = company
+
+    payments = frappe.db.sql(
+        f"""select {", ".join(C2B_PAYMENT_CHANGE_FIELDS)}
+        from `tabMpesa C2B Payment Register`
+        {"where " + " and ".join(conditions) if conditions else ""}
+        order by modified asc, name asc
+        limit %(limit)s""",
+        values,
+        as_dict=True,
+    )
 
-        # Merge results from both queries
-        payments = payments_by_full_name + payments_by_msisdn
-    else:
-        # If search_term or status is not provided, return all payments with the given status
-        payments = frappe.get_all(
-            "Mpesa C2B Payment Register", filters=filters, fields=fields,order_by=order_by
+    has_more = len(payments) > limit
+    payments = payments[:limit]
+    if payments:
+        since = f"{payments[-1].modified}|{payments[-1].name}"
+
+    return {"payments": payments, "cursor": since, "has_more": has_more}
+
+
+def get_c2b_payments_version():
+    cache = frappe.cache()
+    return cint(cache.get(cache.make_key(C2B_PAYMENTS_VERSION_KEY)))
+
+
+def bump_c2b_payments_version():
+    cache = frappe.cache()
+    cache.incr(cache.make_key(C2B_PAYMENTS_VERSION_KEY))
+
+
+def on_c2b_payment_change():
+    """Bump the version once the change is committed, so pollers never miss it."""
+    frappe.db.after_commit.add(bump_c2b_payments_version)
+
+
+def on_c2b_payment_insert(doc):
+    frappe.db.after_commit.add(
+        partial(queue_c2b_payment_notification, doc.name, doc.company, doc.businessshortcode)
+    )
+
+
+def get_c2b_notify_queue_key():
+    return f"{frappe.local.site}:{C2B_NOTIFY_QUEUE}"
+
+
+def queue_c2b_payment_notification(name, company, shortcode):
+    """Buffer a new register for the next realtime notification.
+
+    The first register buffered after a flush schedules the next one, the registers
+    arriving while that job waits in the queue are sent along in the same messages.
+    """
+    conn = get_redis_conn()
+    key = get_c2b_notify_queue_key()
+    conn.rpush(key, json.dumps({"name": name, "company": company, "shortcode": shortcode}))
+
+    # expires in case the job is lost, the scheduler flushes what it left behind
+    if conn.set(f"{key}:scheduled", 1, nx=True, ex=C2B_NOTIFY_SCHEDULED_TTL):
+        frappe.enqueue(
+            "frappe_mpsa_payments.frappe_mpsa_payments.api.m_pesa_api.flush_c2b_payment_notifications",
+            queue="short",
         )
-    
-    return payments
-    
+
+
+def flush_c2b_payment_notifications():
+    """Publish the buffered registers as one `mpesa_c2b_payments` event per company and shortcode.
+
+    Each event goes to the realtime room of its Company, so only users who can read the
+    company receive it. Registers without a company go to the register doctype's room.
+    """
+    conn = get_redis_conn()
+    key = get_c2b_notify_queue_key()
+    # registers queued from here on schedule the next flush
+    conn.delete(f"{key}:scheduled")
+    pipeline = conn.pipeline()
+    pipeline.lrange(key, 0, -1)
+    pipeline.delete(key)
+    entries, _ = pipeline.execute()
+
+    grouped = {}
+    for raw in entries:
+        entry = json.loads(raw)
+        grouped.setdefault((entry["company"], entry["shortcode"]), []).append(entry["name"])
+
+    for (company, shortcode), names in grouped.items():
+        message = {"company": company, "shortcode": shortcode, "payments": names}
+        if company:
+            frappe.publish_realtime(C2B_NOTIFY_EVENT, message=message, doctype="Company", docname=company)
+        else:
+            frappe.publish_realtime(
+                C2B_NOTIFY_EVENT, message=message, room=get_doctype_room("Mpesa C2B Payment Register")
+            )
+
+
+@frappe.whitelist()
+def get_c2b_payments(names):
+    """Fetch the registers referenced by an `mpesa_c2b_payments` event."""
+    names = frappe.parse_json(names)
+    if not names:
+        return []
+
+    return frappe.get_list(
+        "Mpesa C2B Payment Register",
+        filters={"name": ["in", names]},
+        fields=list(DRAFT_C2B_PAYMENT_FIELDS),
+        order_by="posting_date desc, posting_time desc, name desc",
+    )
+
+
 @frappe.whitelist(allow_guest=True)
-def get_draft_pos_invoice(search_term=None):
+def get_draft_pos_invoice(search_term=None, limit=DEFAULT_DRAFT_POS_INVOICES_LIMIT, cursor=None):
+    """List unpaid submitted invoices for the POS picker, newest first.
+
+    Only the columns the picker shows are returned. Pass the name of the last invoice
+    returned as `cursor` to fetch the next page.
+    """
     from frappe.query_builder import DocType
-    from frappe.query_builder.functions import Concat
     from frappe import qb
 
     SalesInvoice = DocType("Sales Invoice")
-    fields = ["*"]
     status_filters = ["Overdue", "Partially Paid", "Unpaid", "Overdue and Discounted", "Partially Paid and Discounted"]
+    limit = min(cint(limit) or DEFAULT_DRAFT_POS_INVOICES_LIMIT, MAX_DRAFT_POS_INVOICES_LIMIT)
 
     # Create the base query
     query = (
         qb.from_(SalesInvoice)
-        .select(*fields)
+        .select(*[SalesInvoice[field] for field in DRAFT_POS_INVOICE_FIELDS])
         .where(SalesInvoice.docstatus == 1)
         .where(SalesInvoice.status.isin(status_filters))
         .orderby(SalesInvoice.posting_date, order=qb.desc)
+        .orderby(SalesInvoice.name, order=qb.desc)
+        .limit(limit)
     )
 
+    if cursor:
+        cursor_date = frappe.db.get_value("Sales Invoice", cursor, "posting_date")
+        if cursor_date:
+            query = query.where(
+                (SalesInvoice.posting_date < cursor_date)
+                | ((SalesInvoice.posting_date == cursor_date) & (SalesInvoice.name < cursor))
+            )
+
     if search_term:
         search_filter = (
             (SalesInvoice.customer.like(f"%{search_term}%")) |
@@ -180,7 +580,141 @@ def get_payment_method(pos_profile):
     return None
 
 def get_mode_of_payment(mpesa_doc):
-    business_short_code=mpesa_doc.businessshortcode
-    mode_of_payment = frappe.get_value("Mpesa C2B Payment Register URL", business_short_code, "mode_of_payment")
-    return mode_of_payment
+    # imported here, the Register URL controller imports get_token from this module
+    from frappe_mpsa_payments.frappe_mpsa_payments.doctype.mpesa_c2b_payment_register_url.mpesa_c2b_payment_register_url import (
+        get_shortcode_details,
+    )
+
+    shortcode_details = get_shortcode_details(mpesa_doc.businessshortcode)
+    if shortcode_details:
+        return shortcode_details["mode_of_payment"]
+    return mpesa_doc.mode_of_payment
     
+
+
+@frappe.whitelist()
+def submit_bulk_mpesa_payments(payments, submit_payment=1):
+    """Queue payment entries for many registers, `payments` being a list of [register, customer] pairs.
+
+    Returns the id to follow the job with, through `get_bulk_mpesa_payment_status` or the
+    `mpesa_bulk_payment_progress` realtime event.
+    """
+    frappe.has_permission("Mpesa C2B Payment Register", "submit", throw=True)
+
+    payments = [
+        (d.get("mpesa_payment"), d.get("customer")) if isinstance(d, dict) else tuple(d)
+        for d in frappe.parse_json(payments) or []
+    ]
+    if not payments:
+        frappe.throw(_("No payments to process"))
+
+    bulk_id = frappe.generate_hash(length=12)
+    set_bulk_mpesa_payment_status(
+        bulk_id, {"status": "Queued", "owner": frappe.session.user, "total": len(payments), "results": []}
+    )
+    frappe.enqueue(
+        "frappe_mpsa_payments.frappe_mpsa_payments.api.m_pesa_api.process_bulk_mpesa_payments",
+        queue="long",
+        timeout=60 * 60,
+        job_id=f"{BULK_PAYMENT_KEY}::{bulk_id}",
+        bulk_id=bulk_id,
+        payments=payments,
+        submit_payment=cint(submit_payment),
+    )
+    return {"bulk_id": bulk_id}
+
+
+@frappe.whitelist()
+def get_bulk_mpesa_payment_status(bulk_id):
+    status = frappe.cache().get_value(f"{BULK_PAYMENT_KEY}|{bulk_id}", expires=True)
+    if not status or (status["owner"] != frappe.session.user and "System Manager" not in frappe.get_roles()):
+        frappe.throw(_("Bulk payment {0} not found").format(bulk_id), frappe.DoesNotExistError)
+    return status
+
+
+def set_bulk_mpesa_payment_status(bulk_id, status):
+    frappe.cache().set_value(f"{BULK_PAYMENT_KEY}|{bulk_id}", status, expires_in_sec=BULK_PAYMENT_STATUS_TTL)
+
+
+def process_bulk_mpesa_payments(bulk_id, payments, submit_payment=1, chunk_size=DEFAULT_BULK_PAYMENT_CHUNK_SIZE):
+    """Submit registers and create their payment entries, committing once per chunk.
+
+    A failing row is rolled back to its savepoint and reported, the rest of its chunk
+    goes through. Mode of payment and accounts come from the shortcode map and the
+    payment context caches, so they are only resolved once for the whole job.
+    """
+    # the job runs as the user who queued it, the status may have expired while it waited
+    status = frappe.cache().get_value(f"{BULK_PAYMENT_KEY}|{bulk_id}", expires=True) or {
+        "owner": frappe.session.user,
+        "total": len(payments),
+        "results": [],
+    }
+    status.update(status="Running", processed=0)
+    set_bulk_mpesa_payment_status(bulk_id, status)
+
+    try:
+        process_bulk_mpesa_payment_chunks(bulk_id, status, payments, submit_payment, chunk_size)
+        status["status"] = "Completed"
+    except Exception as e:
+        # chunks committed so far stay, their results are kept
+        frappe.db.rollback()
+        status.update(status="Failed", error=str(e))
+        raise
+    finally:
+        set_bulk_mpesa_payment_status(bulk_id, status)
+        frappe.publish_realtime(
+            BULK_PAYMENT_EVENT,
+            message={"bulk_id": bulk_id, "total": status["total"], "processed": status["processed"], "done": True},
+            user=status["owner"],
+        )
+    return status
+
+
+def process_bulk_mpesa_payment_chunks(bulk_id, status, payments, submit_payment, chunk_size):
+    for chunk in create_batch(payments, chunk_size):
+        registers = {
+            d.name: d
+            for d in frappe.get_all(
+                "Mpesa C2B Payment Register",
+                filters={"name": ["in", [mpesa_payment for mpesa_payment, _customer in chunk]]},
+                fields=["name", "docstatus"],
+            )
+        }
+
+        for mpesa_payment, customer in chunk:
+            result = {"mpesa_payment": mpesa_payment, "customer": customer}
+            register = registers.get(mpesa_payment)
+            if not register:
+                result.update(status="Failed", error=_("Register not found"))
+            elif register.docstatus != 0:
+                result.update(status="Failed", error=_("Register is already submitted or cancelled"))
+            else:
+                try:
+                    frappe.db.savepoint(BULK_PAYMENT_KEY)
+                    doc = submit_c2b_payment_register(mpesa_payment, customer, submit_payment)
+                    result.update(status="Success", payment_entry=doc.payment_entry)
+                except Exception as e:
+                    frappe.db.rollback(save_point=BULK_PAYMENT_KEY)
+                    result.update(status="Failed", error=str(e))
+                finally:
+                    frappe.clear_messages()
+            status["results"].append(result)
+
+        frappe.db.commit()
+        status["processed"] += len(chunk)
+        set_bulk_mpesa_payment_status(bulk_id, status)
+        frappe.publish_realtime(
+            BULK_PAYMENT_EVENT,
+            message={"bulk_id": bulk_id, "total": status["total"], "processed": status["processed"]},
+            user=status["owner"],
+        )
+
+
+def submit_c2b_payment_register(mpesa_payment, customer, submit_payment):
+    """Like process_mpesa_payment, without its extra save, commit and reload."""
+    doc = frappe.get_doc("Mpesa C2B Payment Register", mpesa_payment)
+    doc.customer = customer
+    doc.mode_of_payment = get_mode_of_payment(doc)
+    doc.submit_payment = submit_payment
+    doc.submit()
+    return doc
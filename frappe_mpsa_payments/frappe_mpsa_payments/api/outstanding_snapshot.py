@@ -0,0 +1,200 @@
+import json
+from functools import partial
+
+import frappe
+from frappe import qb
+from frappe.utils import cint
+
+from erpnext.accounts.utils import QueryPaymentLedger
+
+from frappe_mpsa_payments.utils.metrics import increment_metric
+from frappe_mpsa_payments.utils.site_config import OUTSTANDING_SNAPSHOT_TTL
+from frappe_mpsa_payments.utils.utils import acquire_redis_lock, release_redis_lock
+
+SNAPSHOT_KEY = "mpesa_outstanding_snapshot"
+STALE_VOUCHERS_KEY = "mpesa_outstanding_stale"
+# only a safety net, snapshots are kept current through the stale voucher sets
+DEFAULT_OUTSTANDING_SNAPSHOT_TTL = 60 * 60
+# Seconds a refresh may hold a snapshot, a few ledger queries at most
+OUTSTANDING_SNAPSHOT_LOCK_LEASE = 30
+
+# read and clear a set in one step, so that vouchers marked meanwhile are kept for the next read
+POP_ALL_SCRIPT = """
+local members = redis.call("smembers", KEYS[1])
+redis.call("del", KEYS[1])
+return members
+"""
+
+
+def get_snapshot_key(company, customer, account):
+	return f"{SNAPSHOT_KEY}|{company}|{customer}|{account}"
+
+
+def get_stale_vouchers_key(company, customer):
+	return f"{STALE_VOUCHERS_KEY}|{company}|{customer}"
+
+
+def get_cached_voucher_outstandings(company, customer, account, common_filter):
+	"""
+	Return the customer's voucher outstandings, as QueryPaymentLedger.get_voucher_outstandings
+	would for `common_filter`, from a snapshot kept in Redis.
+
+	The snapshot is built once from the full ledger. Afterwards only the vouchers that
+	Payment Ledger Entries were submitted against since the last read are queried again.
+	Refreshes hold a lock, so that two readers cannot each refresh some vouchers and
+	overwrite the other's; a reader that finds it taken queries the ledger instead.
+	"""
+	cache = frappe.cache()
+	key = get_snapshot_key(company, customer, account)
+	snapshot = cache.get_value(key, expires=True)
+	stale_count = cache.execute_command("SCARD", cache.make_key(get_stale_vouchers_key(company, customer)))
+	if snapshot is not None and not stale_count:
+		increment_metric("outstanding_snapshot_hits")
+		return list(snapshot.values())
+
+	lock_name = f"{key}|lock"
+	lock = acquire_redis_lock(lock_name, OUTSTANDING_SNAPSHOT_LOCK_LEASE)
+	if not lock:
+		increment_metric("outstanding_snapshot_bypasses")
+		return query_voucher_outstandings(common_filter)
+
+	try:
+		return refresh_snapshot(company, customer, key, common_filter)
+	finally:
+		release_redis_lock(lock_name, lock)
+
+
+def refresh_snapshot(company, customer, key, common_filter):
+	cache = frappe.cache()
+	# taken before the snapshot is read, vouchers marked from here on are refreshed next time
+	stale_vouchers = pop_stale_vouchers(company, customer)
+	try:
+		snapshot = cache.get_value(key, expires=True)
+		if snapshot is None:
+			increment_metric("outstanding_snapshot_misses")
+			snapshot = {get_voucher_key(d): d for d in query_voucher_outstandings(common_filter)}
+		elif stale_vouchers:
+			increment_metric("outstanding_snapshot_refreshes")
+			for voucher in stale_vouchers:
+				snapshot.pop(voucher, None)
+			vouchers = [
+				{"voucher_type": voucher_type, "voucher_no": voucher_no} for voucher_type, voucher_no in stale_vouchers
+			]
+			for d in query_voucher_outstandings(common_filter, vouchers):
+				snapshot[get_voucher_key(d)] = d
+		else:
+			increment_metric("outstanding_snapshot_hits")
+			return list(snapshot.values())
+
+		cache.set_value(key, snapshot, expires_in_sec=get_snapshot_ttl())
+	except Exception:
+		# the next read refreshes them instead
+		mark_vouchers_stale(company, customer, stale_vouchers)
+		raise
+	return list(snapshot.values())
+
+
+def get_snapshot_ttl():
+	return cint(frappe.conf.get(OUTSTANDING_SNAPSHOT_TTL)) or DEFAULT_OUTSTANDING_SNAPSHOT_TTL
+
+
+def get_customer_ledger_filter(customer, account):
+	"""The Payment Ledger filter get_outstanding_invoices uses for a customer, which snapshots are built with."""
+	ple = qb.DocType("Payment Ledger Entry")
+	root_type, account_type = frappe.get_cached_value("Account", account, ["root_type", "account_type"])
+	party_account_type = account_type or ("Receivable" if root_type == "Asset" else "Payable")
+	return [
+		ple.account_type == party_account_type,
+		ple.account.isin([account]),
+		ple.party_type == "Customer",
+		ple.party == customer,
+	]
+
+
+def query_voucher_outstandings(common_filter, vouchers=None):
+	return QueryPaymentLedger().get_voucher_outstandings(
+		vouchers=vouchers,
+		common_filter=list(common_filter),
+		get_invoices=True,
+		accounting_dimensions=[],
+	)
+
+
+def get_voucher_key(d):
+	return (d.voucher_type, d.voucher_no)
+
+
+def pop_stale_vouchers(company, customer):
+	cache = frappe.cache()
+	members = cache.eval(POP_ALL_SCRIPT, 1, cache.make_key(get_stale_vouchers_key(company, customer)))
+	return {tuple(json.loads(member)) for member in members or []}
+
+
+def mark_voucher_stale(company, customer, voucher_type, voucher_no):
+	mark_vouchers_stale(company, customer, [(voucher_type, voucher_no)])
+
+
+def mark_vouchers_stale(company, customer, vouchers):
+	if not vouchers:
+		return
+
+	cache = frappe.cache()
+	key = cache.make_key(get_stale_vouchers_key(company, customer))
+	pipeline = cache.pipeline()
+	pipeline.sadd(key, *(json.dumps(list(voucher)) for voucher in vouchers))
+	# any snapshot older than the marks has expired by then, leaving nothing to refresh
+	pipeline.expire(key, get_snapshot_ttl())
+	pipeline.execute()
+
+
+def on_payment_ledger_entry_change(doc, method=None):
+	"""Mark the voucher a customer's Payment Ledger Entry is posted against, once committed."""
+	if doc.party_type != "Customer" or not doc.party:
+		return
+
+	frappe.db.after_commit.add(
+		partial(
+			mark_voucher_stale,
+			doc.company,
+			doc.party,
+			doc.against_voucher_type or doc.voucher_type,
+			doc.against_voucher_no or doc.voucher_no,
+		)
+	)
+
+
+@frappe.whitelist()
+def check_outstanding_snapshot(company, customer):
+	"""
+	Compare the customer's cached outstandings with a full recomputation from the ledger.
+
+	A snapshot that drifted is dropped, so that the next read rebuilds it.
+
+	Returns:
+		dict: Vouchers missing from, unexpected in or differing in the snapshot.
+	"""
+	frappe.only_for("System Manager")
+
+	from erpnext.accounts.party import get_party_account
+
+	account = get_party_account("Customer", customer, company)
+	common_filter = get_customer_ledger_filter(customer, account)
+
+	cached = {get_voucher_key(d): d for d in get_cached_voucher_outstandings(company, customer, account, common_filter)}
+	actual = {get_voucher_key(d): d for d in query_voucher_outstandings(common_filter)}
+
+	fields = ("outstanding_in_account_currency", "invoice_amount_in_account_currency", "due_date")
+	result = {
+		"missing": sorted(actual.keys() - cached.keys()),
+		"unexpected": sorted(cached.keys() - actual.keys()),
+		"different": sorted(
+			key
+			for key in actual.keys() & cached.keys()
+			if any(actual[key].get(field) != cached[key].get(field) for field in fields)
+		),
+	}
+
+	if any(result.values()):
+		increment_metric("outstanding_snapshot_mismatches")
+		frappe.cache().delete_value(get_snapshot_key(company, customer, account))
+	return result
@@ -8,11 +8,14 @@ from erpnext.accounts.doctype.journal_entry.journal_entry import (
 	get_default_bank_cash_account,
 )
 from erpnext.setup.utils import get_exchange_rate
-from erpnext.accounts.doctype.bank_account.bank_account import get_party_bank_account
 from frappe_mpsa_payments.frappe_mpsa_payments.api.m_pesa_api import submit_mpesa_payment
+from frappe_mpsa_payments.frappe_mpsa_payments.api.outstanding_snapshot import get_cached_voucher_outstandings
+from frappe_mpsa_payments.utils.site_config import PAYMENT_CONTEXT_TTL
+from frappe_mpsa_payments.utils.utils import acquire_redis_lock, release_redis_lock
 from erpnext.accounts.utils import get_outstanding_invoices as _get_outstanding_invoices
 import ast
 
+from functools import partial
 from json import loads
 from typing import TYPE_CHECKING, Optional
 
@@ -32,17 +35,28 @@ from frappe.utils import (
 	flt,
 	formatdate,
 	get_datetime,
+	get_link_to_form,
 	get_number_format_info,
 	getdate,
 	now,
 	nowdate,
 )
 from erpnext.accounts.utils import QueryPaymentLedger
+from erpnext.accounts.doctype.process_payment_reconciliation.process_payment_reconciliation import (
+	is_any_doc_running,
+)
 from pypika import Order
 from pypika.terms import ExistsCriterion
 
 import erpnext
 
+SUM_BATCH_SIZE = 1000
+PAYMENT_CONTEXT_KEY = "mpesa_payment_context"
+DEFAULT_PAYMENT_CONTEXT_TTL = 300
+RECONCILIATION_LOCK_KEY = "mpesa_reconciliation"
+# long enough for a customer with many pairs, short enough to recover from a killed worker
+RECONCILIATION_LOCK_LEASE = 30 * 60
+
 
 def create_payment_entry(
 	company,
@@ -77,6 +91,9 @@ def create_payment_entry(
 	# TODO : need to have a better way to handle currency
 	date = nowdate() if not posting_date else posting_date
 	party_type = "Customer"
+	context = get_payment_context(company, mode_of_payment)
+
+	# per customer, it falls back to the account the customer already posts to
 	party_account = get_party_account(party_type, customer, company)
 	party_account_currency = get_account_currency(party_account)
 	if party_account_currency != currency:
@@ -87,9 +104,8 @@ def create_payment_entry(
 		)
 	payment_type = "Receive"
 
-	bank = get_bank_cash_account(company, mode_of_payment)
-	company_currency = frappe.get_value("Company", company, "default_currency")
-	conversion_rate = get_exchange_rate(currency, company_currency, date, "for_selling")
+	bank = context.bank
+	conversion_rate = get_exchange_rate(currency, context.company_currency, date, "for_selling")
 	paid_amount, received_amount = set_paid_amount_and_received_amount(
 		party_account_currency, bank, amount, payment_type, None, conversion_rate
 	)
@@ -97,7 +113,7 @@ def create_payment_entry(
 	pe = frappe.new_doc("Payment Entry")
 	pe.payment_type = payment_type
 	pe.company = company
-	pe.cost_center = cost_center or erpnext.get_default_cost_center(company)
+	pe.cost_center = cost_center or context.cost_center
 	pe.posting_date = date
 	pe.mode_of_payment = mode_of_payment
 	pe.party_type = party_type
@@ -113,11 +129,12 @@ def create_payment_entry(
 	)
 	pe.paid_amount = paid_amount
 	pe.received_amount = received_amount
-	pe.letter_head = frappe.get_value("Company", company, "default_letter_head")
+	pe.letter_head = context.letter_head
 	pe.reference_date = reference_date
 	pe.reference_no = reference_no
 	if pe.party_type in ["Customer", "Supplier"]:
-		bank_account = get_party_bank_account(pe.party_type, pe.party)
+		# same as get_party_bank_account, read off the cached customer
+		bank_account = frappe.get_cached_value(party_type, customer, "default_bank_account")
 		pe.set("bank_account", bank_account)
 		pe.set_bank_account_data()
 
@@ -132,6 +149,58 @@ def create_payment_entry(
 	return pe
 
 
+def get_payment_context(company, mode_of_payment):
+	"""
+	Retrieve the bank account and company defaults used to create M-Pesa payment entries.
+
+	They are cached in Redis per (company, mode of payment) for `mpesa_payment_context_ttl`
+	seconds, and cleared as soon as a Company, Account or Mode of Payment changes.
+
+	Args:
+		company (str): Company the payment entries are created for.
+		mode_of_payment (str): Mode of payment of the payment entries.
+
+	Returns:
+		dict: Bank account, company currency, letter head and cost center.
+	"""
+	cache = frappe.cache()
+	key = f"{PAYMENT_CONTEXT_KEY}|{company}|{mode_of_payment}"
+	context = cache.get_value(key, expires=True)
+	if context is None:
+		context = build_payment_context(company, mode_of_payment)
+		ttl = cint(frappe.conf.get(PAYMENT_CONTEXT_TTL)) or DEFAULT_PAYMENT_CONTEXT_TTL
+		cache.set_value(key, context, expires_in_sec=ttl)
+	return context
+
+
+def build_payment_context(company, mode_of_payment):
+	bank = get_bank_cash_account(company, mode_of_payment)
+	company_currency, letter_head = frappe.get_cached_value(
+		"Company", company, ["default_currency", "default_letter_head"]
+	)
+
+	return frappe._dict(
+		{
+			# the balance returned along with the account is left out, it would go stale
+			"bank": frappe._dict({"account": bank.account, "account_currency": bank.account_currency})
+			if bank
+			else None,
+			"company_currency": company_currency,
+			"letter_head": letter_head,
+			"cost_center": erpnext.get_default_cost_center(company),
+		}
+	)
+
+
+def clear_payment_contexts(doc=None, method=None):
+	"""Drop every cached payment context, hooked to changes of the documents they are built from.
+
+	The contexts are dropped once the change is committed, so that a request running meanwhile
+	cannot cache them again from the old values.
+	"""
+	frappe.db.after_commit.add(partial(frappe.cache().delete_keys, PAYMENT_CONTEXT_KEY))
+
+
 def get_bank_cash_account(company, mode_of_payment, bank_account=None):
 	"""
 	Retrieve the default bank or cash account based on the company and mode of payment.
@@ -309,15 +378,100 @@ def get_outstanding_invoices(
 
 	held_invoices = get_held_invoices("Customer", customer)
 
+	# repeat calls for a customer without extra filters are served from the outstanding snapshot
+	use_snapshot = account[0] and not any(
+		(
+			common_filter,
+			posting_date,
+			min_outstanding,
+			max_outstanding,
+			accounting_dimensions,
+			vouchers,
+			limit,
+			voucher_no,
+		)
+	)
+
 	common_filter = common_filter or []
 	common_filter.append(ple.account_type == party_account_type)
 	common_filter.append(ple.account.isin(account))
 	common_filter.append(ple.party_type == "Customer")
 	common_filter.append(ple.party == customer)
 
-	ple_query = QueryPaymentLedger()
-	invoice_list = ple_query.get_voucher_outstandings(
-		vouchers=vouchers,
+	if use_snapshot:
+		invoice_list = get_cached_voucher_outstandings(company, customer, account[0], common_filter)
+	else:
+		ple_query = QueryPaymentLedger()
+		invoice_list = ple_query.get_voucher_outstandings(
+			vouchers=vouchers,
+			common_filter=common_filter,
+			posting_date=posting_date,
+			min_outstanding=min_outstanding,
+			max_outstanding=max_outstanding,
+			get_invoices=True,
+			accounting_dimensions=accounting_dimensions or [],
+			limit=limit,
+			voucher_no=voucher_no,
+		)
+
+	for d in invoice_list:
+		if d.voucher_type != "Purchase Invoice" or d.voucher_no not in held_invoices:
+			outstanding_invoice = get_outstanding_invoice(d, precision, min_outstanding, max_outstanding)
+			if outstanding_invoice:
+				outstanding_invoices.append(outstanding_invoice)
+
+	outstanding_invoices = sorted(outstanding_invoices, key=lambda k: k["due_date"] or getdate(nowdate()))
+	return outstanding_invoices
+
+
+@frappe.whitelist()
+def get_outstanding_invoices_for_customers(
+	company,
+	customers,
+	invoice_type=None,
+	posting_date=None,
+	min_outstanding=None,
+	max_outstanding=None,
+	accounting_dimensions=None,
+	limit=None,
+):
+	"""
+	Retrieve the outstanding invoices of many customers with one Payment Ledger query.
+
+	Args:
+		company (str): Company for which invoices are being retrieved.
+		customers (list): Customers for whom invoices are being retrieved.
+		invoice_type (str, optional): Doctype whose precision applies to outstanding amounts. Defaults to Sales Invoice.
+		posting_date, min_outstanding, max_outstanding, accounting_dimensions: As for get_outstanding_invoices.
+		limit (int, optional): Maximum number of ledger vouchers fetched, across all customers.
+
+	Returns:
+		dict: Outstanding invoices per customer, each list shaped like get_outstanding_invoices.
+	"""
+	customers = list(dict.fromkeys(frappe.parse_json(customers) or []))
+	if not customers:
+		return {}
+
+	ple = qb.DocType("Payment Ledger Entry")
+	precision = frappe.get_precision(invoice_type or "Sales Invoice", "outstanding_amount") or 2
+	party_accounts = get_party_accounts(customers, company)
+
+	account_types = set()
+	for account in set(party_accounts.values()):
+		details = frappe.get_cached_value("Account", account, ["root_type", "account_type"])
+		if not details:
+			continue
+		root_type, account_type = details
+		account_types.add(account_type or ("Receivable" if root_type == "Asset" else "Payable"))
+
+	common_filter = [
+		ple.account_type.isin(account_types or [erpnext.get_party_account_type("Customer")]),
+		ple.account.isin(list(set(party_accounts.values())) or [""]),
+		ple.party_type == "Customer",
+		ple.party.isin(customers),
+	]
+
+	invoice_list = QueryPaymentLedger().get_voucher_outstandings(
 		common_filter=common_filter,
 		posting_date=posting_date,
 		min_outstanding=min_outstanding,
@@ -325,40 +479,114 @@ def get_outstanding_invoices(
 		get_invoices=True,
 		accounting_dimensions=accounting_dimensions or [],
 		limit=limit,
-		voucher_no=voucher_no,
 	)
 
+	outstanding_invoices = {customer: [] for customer in customers}
 	for d in invoice_list:
-		payment_amount = d.invoice_amount_in_account_currency - d.outstanding_in_account_currency
-		outstanding_amount = d.outstanding_in_account_currency
-		if outstanding_amount > 0.5 / (10**precision):
-			if (
-				min_outstanding
-				and max_outstanding
-				and (outstanding_amount < min_outstanding or outstanding_amount > max_outstanding)
-			):
-				continue
-
-			if d.voucher_type != "Purchase Invoice" or d.voucher_no not in held_invoices:
-				outstanding_invoices.append(
-					frappe._dict(
-						{
-							"voucher_no": d.voucher_no,
-							"voucher_type": d.voucher_type,
-							"posting_date": d.posting_date,
-							"invoice_amount": flt(d.invoice_amount_in_account_currency),
-							"payment_amount": payment_amount,
-							"outstanding_amount": outstanding_amount,
-							"due_date": d.due_date,
-							"currency": d.currency,
-							"account": d.account,
-						}
-					)
-				)
-
-	outstanding_invoices = sorted(outstanding_invoices, key=lambda k: k["due_date"] or getdate(nowdate()))
+		# a customer's rows only count on that customer's own party account
+		if party_accounts.get(d.party) != d.account:
+			continue
+		outstanding_invoice = get_outstanding_invoice(d, precision, min_outstanding, max_outstanding)
+		if outstanding_invoice:
+			outstanding_invoices[d.party].append(outstanding_invoice)
+
+	for customer, invoices in outstanding_invoices.items():
+		invoices.sort(key=lambda k: k["due_date"] or getdate(nowdate()))
 	return outstanding_invoices
 
+
+def get_party_accounts(customers, company):
+	"""
+	Resolve the receivable account of many customers at once: the customer's own account,
+	else its customer group's, else the company default.
+
+	get_party_account also prefers the account a customer already has GL entries in when
+	their currencies differ, so those customers, and the ones left without an account, are
+	resolved through get_party_account itself.
+	"""
+	party_accounts = dict(
+		frappe.get_all(
+			"Party Account",
+			filters={"parenttype": "Customer", "parent": ["in", customers], "company": company},
+			fields=["parent", "account"],
+			as_list=True,
+		)
+	)
+
+	customer_groups = dict(
+		frappe.get_all(
+			"Customer",
+			filters={"name": ["in", [c for c in customers if c not in party_accounts]]},
+			fields=["name", "customer_group"],
+			as_list=True,
+		)
+	)
+	group_accounts = dict(
+		frappe.get_all(
+			"Party Account",
+			filters={
+				"parenttype": "Customer Group",
+				"parent": ["in", list(set(customer_groups.values())) or [""]],
+				"company": company,
+			},
+			fields=["parent", "account"],
+			as_list=True,
+		)
+	)
+	default_account = frappe.get_cached_value("Company", company, "default_receivable_account")
+
+	for customer, customer_group in customer_groups.items():
+		account = group_accounts.get(customer_group) or default_account
+		if account:
+			party_accounts[customer] = account
+
+	gle_currencies = frappe.get_all(
+		"GL Entry",
+		filters={"company": company, "party_type": "Customer", "party": ["in", customers], "docstatus": 1},
+		fields=["party", "account_currency"],
+		distinct=True,
+	)
+	exceptions = {c for c in customers if c not in party_accounts}
+	exceptions.update(
+		d.party
+		for d in gle_currencies
+		if d.party in party_accounts and get_account_currency(party_accounts[d.party]) != d.account_currency
+	)
+
+	for customer in exceptions:
+		account = get_party_account("Customer", customer, company)
+		if account:
+			party_accounts[customer] = account
+		else:
+			party_accounts.pop(customer, None)
+	return party_accounts
+
+
+def get_outstanding_invoice(d, precision, min_outstanding=None, max_outstanding=None):
+	payment_amount = d.invoice_amount_in_account_currency - d.outstanding_in_account_currency
+	outstanding_amount = d.outstanding_in_account_currency
+	if outstanding_amount > 0.5 / (10**precision):
+		if (
+			min_outstanding
+			and max_outstanding
+			and (outstanding_amount < min_outstanding or outstanding_amount > max_outstanding)
+		):
+			return
+
+		return frappe._dict(
+			{
+				"voucher_no": d.voucher_no,
+				"voucher_type": d.voucher_type,
+				"posting_date": d.posting_date,
+				"invoice_amount": flt(d.invoice_amount_in_account_currency),
+				"payment_amount": payment_amount,
+				"outstanding_amount": outstanding_amount,
+				"due_date": d.due_date,
+				"currency": d.currency,
+				"account": d.account,
+			}
+		)
+
 def get_held_invoices(party_type, party):
 	"""
 	Returns a list of names Purchase Invoices for the given party that are on hold
@@ -424,33 +652,43 @@ def get_total_amount_selected_mpesa_payments(selected_mpesa_payments):
 	Calculate the total amount of selected mpesa payments.
 
 	Args:
-		selected_mpesa_payments (list): List of selected mpesa payments.
+		selected_mpesa_payments (list): List of selected mpesa payments, names or dicts with a name.
 
 	Returns:
 		float: Total amount of selected mpesa payments.
 	"""
-	total=0
-	for mpesa_payment in selected_mpesa_payments:
-		doc=frappe.get_doc("Mpesa C2B Payment Register",mpesa_payment)
-		total+=flt(doc.get("transamount"))
-	
+	names = [d.get("name") if isinstance(d, dict) else d for d in selected_mpesa_payments or []]
+	register = qb.DocType("Mpesa C2B Payment Register")
+
+	total = 0
+	# one aggregate per batch keeps the IN list bounded for very large selections
+	for batch in create_batch(list(set(filter(None, names))), SUM_BATCH_SIZE):
+		amount = (
+			qb.from_(register).select(Sum(register.transamount)).where(register.name.isin(batch)).run()
+		)
+		total += flt(amount[0][0])
+
 	return total
 
 def get_total_amount_selected_payments(invoice):
 	"""
-	Calculate the total amount of selected payments.
+	Calculate the total amount of the payments on a POS Invoice.
 
 	Args:
-		selected_payments (list): List of selected payments.
+		invoice (str): POS Invoice whose payments are summed.
 
 	Returns:
-		float: Total amount of selected payments.
+		float: Total amount of the invoice payments.
 	"""
-	total = 0
-	doc=frappe.get_doc("POS Invoice",invoice)
-	for payment in doc.payments:
-		total += flt(payment.get("amount"))
-	return total
+	payment = qb.DocType("Sales Invoice Payment")
+	amount = (
+		qb.from_(payment)
+		.select(Sum(payment.amount))
+		.where(payment.parenttype == "POS Invoice")
+		.where(payment.parent == invoice)
+		.run()
+	)
+	return flt(amount[0][0])
 
 
 
@@ -482,20 +720,37 @@ def get_available_pos_profiles(company, currency):
 	)
 	return pos_profiles_list
 
-def create_and_reconcile_payment_reconciliation(invoice_name, customer, company, payment_entries):
-	invoice = frappe.get_doc("Sales Invoice", invoice_name)
-	currency = invoice.get("currency")
-	
-	reconcile_doc = frappe.new_doc("Payment Reconciliation")
-	reconcile_doc.party_type = "Customer"
-	reconcile_doc.party = customer
-	reconcile_doc.company = company
-	reconcile_doc.receivable_payable_account = get_party_account("Customer", customer, company)
-	reconcile_doc.get_unreconciled_entries()
+def create_and_reconcile_payment_reconciliation(invoice_name, customer, company, payment_entries, commit=True):
+	"""
+	Reconcile a Sales Invoice against the given payment entries.
+
+	Only the invoice and the payment entries are loaded into the Payment Reconciliation,
+	instead of every unreconciled entry of the customer through get_unreconciled_entries.
+
+	Args:
+		invoice_name (str): Sales Invoice to reconcile.
+		customer (str): Customer of the invoice and the payment entries.
+		company (str): Company of the invoice and the payment entries.
+		payment_entries (list): Names of the payment entries to allocate against the invoice.
+		commit (bool, optional): Whether to commit once reconciled. Defaults to True.
+
+	Returns:
+		PaymentReconciliation: The reconciliation, with its allocation table.
+	"""
+	lock_customer_reconciliation(customer)
+	reconcile_doc = new_payment_reconciliation(customer, company)
+	validate_no_reconciliation_running(reconcile_doc)
+
+	invoice = frappe.db.get_value(
+		"Sales Invoice",
+		invoice_name,
+		["name", "posting_date", "grand_total", "outstanding_amount", "currency"],
+		as_dict=True,
+	)
 
 	args = {
 		"invoices": [],
-		"payments": [],
+		"payments": get_reconciliation_payments(payment_entries),
 	}
 
 	args["invoices"].append(
@@ -509,25 +764,218 @@ def create_and_reconcile_payment_reconciliation(invoice_name, customer, company,
 			"exchange_rate": 0,
 		}
 	)
-	
-	for payment_entry in payment_entries:
-		payment_entry_doc = frappe.get_doc("Payment Entry", payment_entry)
-		args["payments"].append(
+
+	# the tables get_unreconciled_entries would fill, limited to the entries at hand
+	reconcile_doc.set("invoices", args["invoices"])
+	reconcile_doc.set("payments", args["payments"])
+	reconcile_doc.allocate_entries(args)
+
+	# reconcile() would reload every unreconciled entry of the customer once done
+	reconcile_doc.validate_allocation()
+	reconcile_doc.reconcile_allocations()
+
+	if commit:
+		frappe.db.commit()
+	return reconcile_doc
+
+
+@frappe.whitelist()
+def allocate_payments_to_outstanding_invoices(customer, company, payment_entries, commit=True):
+	"""
+	Allocate payment entries across the customer's outstanding invoices, earliest due date first.
+
+	The invoices come from get_outstanding_invoices, already sorted by due date, and the
+	payments are taken oldest first. Both lists are walked once, carrying what is left of
+	an invoice or a payment over to the next pair, and everything is posted by a single
+	Payment Reconciliation.
+
+	Args:
+		customer (str): Customer of the invoices and the payment entries.
+		company (str): Company of the invoices and the payment entries.
+		payment_entries (list): Names of the payment entries to allocate.
+		commit (bool, optional): Whether to commit once reconciled. Defaults to True.
+
+	Returns:
+		PaymentReconciliation: The reconciliation, with its allocation table.
+	"""
+	frappe.has_permission("Payment Reconciliation", "write", throw=True)
+
+	payment_entries = frappe.parse_json(payment_entries)
+	lock_customer_reconciliation(customer)
+	reconcile_doc = new_payment_reconciliation(customer, company)
+	validate_no_reconciliation_running(reconcile_doc)
+
+	invoices = [
+		frappe._dict(
 			{
-				"reference_type": "Payment Entry",
-				"reference_name": payment_entry_doc.get("name"),
-				"posting_date": payment_entry_doc.get("posting_date"),
-				"amount": payment_entry_doc.get("unallocated_amount"),
-				"unallocated_amount": payment_entry_doc.get("unallocated_amount"),
-				"difference_amount": 0,
-				"currency": payment_entry_doc.get("currency"),
+				"invoice_type": d.voucher_type,
+				"invoice_number": d.voucher_no,
+				"invoice_date": d.posting_date,
+				"amount": d.invoice_amount,
+				"outstanding_amount": d.outstanding_amount,
+				"currency": d.currency,
 				"exchange_rate": 0,
 			}
 		)
+		for d in get_outstanding_invoices(company, customer)
+	]
+	payments = [frappe._dict(d) for d in get_reconciliation_payments(payment_entries)]
 
-	reconcile_doc.allocate_entries(args)
-	reconcile_doc.reconcile()
-	frappe.db.commit()
+	reconcile_doc.set("invoices", invoices)
+	reconcile_doc.set("payments", payments)
+	reconcile_doc.set("allocation", allocate_in_order(reconcile_doc, invoices, payments))
+	if not reconcile_doc.allocation:
+		return reconcile_doc
+
+	reconcile_doc.validate_allocation()
+	reconcile_doc.reconcile_allocations()
+
+	if cint(commit):
+		frappe.db.commit()
+	return reconcile_doc
+
+
+def allocate_in_order(reconcile_doc, invoices, payments):
+	"""
+	Pair payments with invoices in list order, the way allocate_entries does, but with one
+	pointer per list instead of rescanning the invoices for every payment. Gain or loss is
+	dated as the Exchange Gain / Loss Posting Date of Accounts Settings says, as there.
+	"""
+	precision = frappe.get_precision("Payment Reconciliation Allocation", "allocated_amount") or 2
+	exchange_rates = reconcile_doc.get_invoice_exchange_map(invoices, payments)
+	exchange_gain_loss_account = frappe.get_cached_value("Company", reconcile_doc.company, "exchange_gain_loss_account")
+	gain_loss_posting_date = frappe.db.get_single_value(
+		"Accounts Settings", "exchange_gain_loss_posting_date", cache=True
+	)
+
+	for pay in payments:
+		pay.unreconciled_amount = pay.amount
+	for inv in invoices:
+		inv.exchange_rate = exchange_rates.get(inv.invoice_number)
+
+	allocation = []
+	i = j = 0
+	while i < len(invoices) and j < len(payments):
+		inv, pay = invoices[i], payments[j]
+		allocated_amount = flt(min(inv.outstanding_amount, pay.amount), precision)
+
+		if allocated_amount > 0:
+			entry = reconcile_doc.get_allocated_entry(pay, inv, allocated_amount)
+			entry.difference_amount = reconcile_doc.get_difference_amount(pay, inv, allocated_amount)
+			entry.difference_account = exchange_gain_loss_account
+			entry.exchange_rate = inv.exchange_rate
+			if gain_loss_posting_date == "Invoice":
+				entry.gain_loss_posting_date = inv.invoice_date
+			elif gain_loss_posting_date == "Reconciliation Date":
+				entry.gain_loss_posting_date = nowdate()
+			else:
+				entry.gain_loss_posting_date = pay.posting_date
+			allocation.append(entry)
+
+		inv.outstanding_amount = flt(inv.outstanding_amount - allocated_amount, precision)
+		pay.amount = flt(pay.amount - allocated_amount, precision)
+		if inv.outstanding_amount <= 0:
+			i += 1
+		if pay.amount <= 0:
+			j += 1
+
+	return allocation
+
+
+def new_payment_reconciliation(customer, company):
+	reconcile_doc = frappe.new_doc("Payment Reconciliation")
+	reconcile_doc.party_type = "Customer"
+	reconcile_doc.party = customer
+	reconcile_doc.company = company
+	reconcile_doc.receivable_payable_account = get_party_account("Customer", customer, company)
+	return reconcile_doc
+
+
+def lock_customer_reconciliation(customer):
+	"""
+	Take the lock every reconciliation of the customer goes through, until the transaction
+	commits or rolls back. Throws if another process holds it, a process already holding
+	it, like a reconciliation run job, goes straight through.
+	"""
+	if customer in get_held_reconciliation_locks():
+		return
+
+	if not acquire_reconciliation_lock(customer):
+		frappe.throw(
+			_("Customer {0} is being reconciled by another process, try again in a moment").format(customer)
+		)
+
+	release = partial(release_reconciliation_lock, customer)
+	frappe.db.after_commit.add(release)
+	frappe.db.after_rollback.add(release)
+
+
+def acquire_reconciliation_lock(customer):
+	"""Take the customer's reconciliation lock for this process, returning its token or None."""
+	token = acquire_redis_lock(f"{RECONCILIATION_LOCK_KEY}|{customer}", RECONCILIATION_LOCK_LEASE)
+	if token:
+		get_held_reconciliation_locks()[customer] = token
+	return token
+
+
+def release_reconciliation_lock(customer):
+	token = get_held_reconciliation_locks().pop(customer, None)
+	if token:
+		release_redis_lock(f"{RECONCILIATION_LOCK_KEY}|{customer}", token)
+
+
+def get_held_reconciliation_locks():
+	if frappe.flags.mpesa_reconciliation_locks is None:
+		frappe.flags.mpesa_reconciliation_locks = {}
+	return frappe.flags.mpesa_reconciliation_locks
+
+
+def validate_no_reconciliation_running(reconcile_doc):
+	"""
+	The guard Payment Reconciliation.reconcile() runs before allocating, kept for the paths
+	that call validate_allocation and reconcile_allocations directly: with auto reconciliation
+	on, a Process Payment Reconciliation job running for the same party must finish first.
+	"""
+	if not frappe.db.get_single_value("Accounts Settings", "auto_reconcile_payments"):
+		return
+
+	running_doc = is_any_doc_running(
+		dict(
+			company=reconcile_doc.company,
+			party_type=reconcile_doc.party_type,
+			party=reconcile_doc.party,
+			receivable_payable_account=reconcile_doc.receivable_payable_account,
+		)
+	)
+	if running_doc:
+		frappe.throw(
+			_("A Reconciliation Job: {0} is running for the same filters. Cannot reconcile now").format(
+				get_link_to_form("Auto Reconcile", running_doc)
+			)
+		)
+
+
+def get_reconciliation_payments(payment_entries):
+	"""Payment rows, as get_unreconciled_entries would list them, for the given payment entries."""
+	payment_entry_list = frappe.get_all(
+		"Payment Entry",
+		filters={"name": ["in", payment_entries]},
+		fields=["name", "posting_date", "unallocated_amount", "paid_from_account_currency as currency"],
+		order_by="posting_date asc, name asc",
+	)
+	return [
+		{
+			"reference_type": "Payment Entry",
+			"reference_name": payment_entry.get("name"),
+			"posting_date": payment_entry.get("posting_date"),
+			"amount": payment_entry.get("unallocated_amount"),
+			"unallocated_amount": payment_entry.get("unallocated_amount"),
+			"difference_amount": 0,
+			"currency": payment_entry.get("currency"),
+			"exchange_rate": 0,
+		}
+		for payment_entry in payment_entry_list
+	]
 
 @frappe.whitelist()
 def process_mpesa_c2b_reconciliation():
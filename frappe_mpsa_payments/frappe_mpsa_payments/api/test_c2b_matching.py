@@ -0,0 +1,39 @@
+from unittest.mock import patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from frappe_mpsa_payments.frappe_mpsa_payments.api.c2b_matching import resolve_matches
+
+
+def get_all(doctype, filters=None, fields=None, pluck=None):
+    if doctype == "Sales Invoice":
+        return [
+            frappe._dict(name="ACC-SINV-0001", customer="CUST-A", company="Test Company"),
+            frappe._dict(name="ACC-SINV-0002", customer="CUST-B", company="Test Company"),
+            frappe._dict(name="ACC-SINV-0003", customer="CUST-A", company="Other Company"),
+        ]
+    return ["CUST-A", "CUST-B"]
+
+
+class TestC2BMatching(FrappeTestCase):
+    @patch("frappe.get_all", side_effect=get_all)
+    def test_resolve_matches(self, mock_get_all):
+        registers = [
+            frappe._dict(name="INV", company="Test Company", billrefnumber=" acc-sinv-0001 ", invoicenumber=""),
+            frappe._dict(name="INV_AND_CUST", company="Test Company", billrefnumber="ACC-SINV-0001", invoicenumber="cust-a"),
+            frappe._dict(name="CUST", company="Test Company", billrefnumber="CUST-B", invoicenumber=None),
+            frappe._dict(name="TWO_CUSTOMERS", company="Test Company", billrefnumber="ACC-SINV-0001", invoicenumber="CUST-B"),
+            frappe._dict(name="OTHER_COMPANY", company="Test Company", billrefnumber="ACC-SINV-0003", invoicenumber=""),
+            frappe._dict(name="NO_COMPANY", company=None, billrefnumber="CUST-A", invoicenumber=""),
+        ]
+
+        matches = resolve_matches(registers)
+
+        self.assertEqual(mock_get_all.call_count, 2)
+        self.assertEqual(matches["INV"], ("Matched", "CUST-A", "ACC-SINV-0001"))
+        self.assertEqual(matches["INV_AND_CUST"], ("Matched", "CUST-A", "ACC-SINV-0001"))
+        self.assertEqual(matches["CUST"], ("Matched", "CUST-B", None))
+        self.assertEqual(matches["TWO_CUSTOMERS"][0], "Ambiguous")
+        self.assertEqual(matches["OTHER_COMPANY"][0], "Unmatched")
+        self.assertEqual(matches["NO_COMPANY"][0], "Unmatched")
@@ -1,21 +1,36 @@
 import unittest
 from unittest.mock import patch, Mock
 import json
+import random
+
+import frappe
 from frappe.tests.utils import FrappeTestCase
 
-from frappe_mpsa_payments.api.m_pesa_api import (
+from frappe_mpsa_payments.frappe_mpsa_payments.api.m_pesa_api import (
     get_token,
     confirmation,
     validation,
     get_mpesa_mode_of_payment,
-    get_mpesa_draft_payments,
+    get_mpesa_draft_c2b_payments,
     submit_mpesa_payment,
+    process_c2b_ingest_queue,
+    insert_c2b_payment,
+    get_c2b_payment_changes,
+    get_c2b_payments,
+    queue_c2b_payment_notification,
+    flush_c2b_payment_notifications,
+    submit_bulk_mpesa_payments,
+    process_bulk_mpesa_payments,
+    get_bulk_mpesa_payment_status,
+    enqueue_c2b_payment,
+    C2B_INGEST_QUEUE,
 )
+from frappe_mpsa_payments.utils.utils import acquire_redis_lock, release_redis_lock
 
 
 class TestMPesaAPI(FrappeTestCase):
     
-    @patch("requests.get")
+    @patch("requests.Session.get")
     def test_get_token(self, mock_get):
         mock_response = Mock()
         mock_response.json.return_value = {"access_token": "dummy_token"}
@@ -29,11 +44,24 @@ class TestMPesaAPI(FrappeTestCase):
 
         self.assertEqual(token, "dummy_token")
 
+    @patch("requests.Session.get")
+    def test_get_token_is_cached_per_setting(self, mock_get):
+        mock_response = Mock()
+        mock_response.json.return_value = {"access_token": "cached_token", "expires_in": "3599"}
+        mock_get.return_value = mock_response
+
+        setting = frappe.generate_hash(length=8)
+        for _ in range(3):
+            token = get_token("dummy_key", "dummy_secret", "https://example.com", setting, "sandbox")
+            self.assertEqual(token, "cached_token")
+
+        self.assertEqual(mock_get.call_count, 1)
+
     def test_confirmation(self):
         # Test accepted case
         args = {
             "TransactionType": "Payment",
-            "TransID": "123456",
+            "TransID": frappe.generate_hash(length=10).upper(),
             "TransTime": "2024-05-01T12:00:00",
             "TransAmount": 100.0,
             "BusinessShortCode": "123456",
@@ -50,12 +78,67 @@ class TestMPesaAPI(FrappeTestCase):
         self.assertEqual(result["ResultCode"], 0)
         self.assertEqual(result["ResultDesc"], "Accepted")
 
+        # Safaricom retries of the same TransID are accepted without a second insert
+        result = confirmation(**args)
+        self.assertEqual(result["ResultCode"], 0)
+        self.assertEqual(result["ResultDesc"], "Accepted")
+        self.assertEqual(
+            frappe.db.count("Mpesa C2B Payment Register", {"transid": args["TransID"]}), 1
+        )
+
         # Test rejected case
+        args["TransID"] = frappe.generate_hash(length=10).upper()
         args["TransAmount"] = "invalid_amount"
         result = confirmation(**args)
         self.assertEqual(result["ResultCode"], 1)
         self.assertEqual(result["ResultDesc"], "Rejected")
 
+    @patch("frappe.enqueue")
+    def test_confirmation_async_ingest(self, mock_enqueue):
+        transid = frappe.generate_hash(length=10).upper()
+        args = {
+            "TransactionType": "Pay Bill",
+            "TransID": transid,
+            "TransTime": "20240501120000",
+            "TransAmount": 100.0,
+            "BusinessShortCode": "123456",
+            "MSISDN": "254708374149",
+            "FirstName": "John",
+        }
+        with patch.dict(frappe.local.conf, {"mpesa_c2b_async_ingest": 1}):
+            result = confirmation(**args)
+
+            # acknowledged without touching the register
+            self.assertEqual(result["ResultCode"], 0)
+            self.assertTrue(mock_enqueue.called)
+            self.assertFalse(frappe.db.exists("Mpesa C2B Payment Register", {"transid": transid}))
+
+            process_c2b_ingest_queue()
+            self.assertTrue(frappe.db.exists("Mpesa C2B Payment Register", {"transid": transid}))
+
+            # payloads that cannot be inserted are rejected up front, not queued
+            args["TransAmount"] = "invalid_amount"
+            result = confirmation(**args)
+            self.assertEqual(result["ResultCode"], 1)
+
+    @patch("frappe.enqueue")
+    def test_c2b_ingest_queue_is_drained_by_one_consumer(self, mock_enqueue):
+        transid = frappe.generate_hash(length=10).upper()
+        enqueue_c2b_payment(
+            frappe._dict({"TransID": transid, "TransAmount": 100.0, "BusinessShortCode": "123456"})
+        )
+
+        # another consumer is draining, this run leaves the queue to it
+        token = acquire_redis_lock(C2B_INGEST_QUEUE, 60)
+        try:
+            process_c2b_ingest_queue()
+            self.assertFalse(frappe.db.exists("Mpesa C2B Payment Register", {"transid": transid}))
+        finally:
+            release_redis_lock(C2B_INGEST_QUEUE, token)
+
+        process_c2b_ingest_queue()
+        self.assertTrue(frappe.db.exists("Mpesa C2B Payment Register", {"transid": transid}))
+
     def test_validation(self):
         # Test validation always returns accepted
         result = validation()
@@ -64,7 +147,7 @@ class TestMPesaAPI(FrappeTestCase):
 
     @patch("frappe.get_all")
     def test_get_mpesa_mode_of_payment(self, mock_get_all):
-        mock_get_all.return_value = [{"mode_of_payment": "Cash"}]
+        mock_get_all.return_value = [frappe._dict({"mode_of_payment": "Cash"})]
 
         company = "Test Company"
 
@@ -72,18 +155,133 @@ class TestMPesaAPI(FrappeTestCase):
 
         self.assertEqual(modes_of_payment, ["Cash"])
 
-    @patch("frappe.get_all")
-    def test_get_mpesa_draft_payments(self, mock_get_all):
-        mock_get_all.return_value = [{"name": "MP001", "amount": 100.0}]
+    def test_get_mpesa_draft_c2b_payments_by_phone_number(self):
+        phone = f"7{random.randint(10000000, 99999999)}"
+        for _ in range(3):
+            insert_c2b_payment(
+                frappe._dict(
+                    {
+                        "TransID": frappe.generate_hash(length=10).upper(),
+                        "TransAmount": 100.0,
+                        "BusinessShortCode": "123456",
+                        "MSISDN": f"254{phone}",
+                        "FirstName": "Search",
+                    }
+                )
+            )
 
-        company = "Test Company"
-        mode_of_payment = "Cash"
+        for search_term in (f"0{phone}", f"+254{phone}", phone[-6:]):
+            payments = get_mpesa_draft_c2b_payments(search_term)
+            self.assertEqual(len(payments), 3)
+            self.assertEqual(len({payment.name for payment in payments}), 3)
+
+        first_page = get_mpesa_draft_c2b_payments(f"0{phone}", limit=2)
+        next_page = get_mpesa_draft_c2b_payments(f"0{phone}", limit=2, cursor=first_page[-1].name)
+        self.assertEqual(len(first_page), 2)
+        self.assertEqual(len(next_page), 1)
+        self.assertNotIn(next_page[0].name, [payment.name for payment in first_page])
+
+    def test_get_c2b_payment_changes(self):
+        cursor = get_c2b_payment_changes()["cursor"]
+        while True:
+            changes = get_c2b_payment_changes(since=cursor)
+            cursor = changes["cursor"]
+            if not changes["has_more"]:
+                break
+
+        register = insert_c2b_payment(
+            frappe._dict(
+                {"TransID": frappe.generate_hash(length=10).upper(), "TransAmount": 100.0, "BusinessShortCode": "123456"}
+            )
+        )
+        changes = get_c2b_payment_changes(since=cursor)
+        self.assertEqual([payment.name for payment in changes["payments"]], [register.name])
+
+        changes = get_c2b_payment_changes(since=changes["cursor"])
+        self.assertEqual(changes["payments"], [])
+
+    def test_get_c2b_payment_changes_not_modified(self):
+        get_c2b_payment_changes()
+        etag = frappe.flags.mpesa_etag
+
+        with patch("frappe.get_request_header", return_value=etag):
+            self.assertIsNone(get_c2b_payment_changes())
+        self.assertEqual(frappe.local.response.pop("http_status_code"), 304)
+
+    @patch("frappe.publish_realtime")
+    @patch("frappe.enqueue")
+    def test_c2b_payment_notifications_are_coalesced(self, mock_enqueue, mock_publish_realtime):
+        # start from an empty buffer, callbacks committed by other tests may have filled it
+        flush_c2b_payment_notifications()
+        mock_publish_realtime.reset_mock()
+
+        for i in range(200):
+            queue_c2b_payment_notification(f"MPC2B-NOTIFY{i:03d}", "Test Company", "123456")
+        queue_c2b_payment_notification("MPC2B-NOTIFY200", "Test Company", "654321")
+        queue_c2b_payment_notification("MPC2B-NOTIFY201", None, "000000")
+
+        self.assertEqual(mock_enqueue.call_count, 1)
+
+        flush_c2b_payment_notifications()
+
+        self.assertEqual(mock_publish_realtime.call_count, 3)
+        calls = {call.kwargs["message"]["shortcode"]: call.kwargs for call in mock_publish_realtime.call_args_list}
+        self.assertEqual(len(calls["123456"]["message"]["payments"]), 200)
+        self.assertEqual(calls["654321"]["message"]["payments"], ["MPC2B-NOTIFY200"])
+        # delivered to the company's room, never to the whole site
+        self.assertEqual((calls["123456"]["doctype"], calls["123456"]["docname"]), ("Company", "Test Company"))
+        self.assertEqual(calls["000000"]["room"], "doctype:Mpesa C2B Payment Register")
+
+        # the next register schedules the next flush
+        queue_c2b_payment_notification("MPC2B-NOTIFY202", "Test Company", "123456")
+        self.assertEqual(mock_enqueue.call_count, 2)
+        flush_c2b_payment_notifications()
+
+    def test_c2b_payment_endpoints_need_read_permission(self):
+        frappe.set_user("Guest")
+        try:
+            self.assertRaises(frappe.PermissionError, get_c2b_payment_changes)
+            self.assertRaises(frappe.PermissionError, get_c2b_payments, ["MPC2B-MISSING"])
+        finally:
+            frappe.set_user("Administrator")
+
+    @patch("frappe.enqueue")
+    def test_bulk_mpesa_payments_report_failed_rows(self, mock_enqueue):
+        register = insert_c2b_payment(
+            frappe._dict(
+                {"TransID": frappe.generate_hash(length=10).upper(), "TransAmount": 100.0, "BusinessShortCode": "123456"}
+            )
+        )
+        payments = [[register.name, "_Test Customer Missing"], ["MPC2B-MISSING", "_Test Customer Missing"]]
+
+        bulk_id = submit_bulk_mpesa_payments(payments)["bulk_id"]
+        self.assertEqual(mock_enqueue.call_args.kwargs["payments"], [tuple(d) for d in payments])
+
+        process_bulk_mpesa_payments(bulk_id, mock_enqueue.call_args.kwargs["payments"])
+
+        status = get_bulk_mpesa_payment_status(bulk_id)
+        self.assertEqual(status["status"], "Completed")
+        self.assertEqual(status["processed"], 2)
+        self.assertEqual([result["status"] for result in status["results"]], ["Failed", "Failed"])
+        self.assertEqual(frappe.db.get_value("Mpesa C2B Payment Register", register.name, "docstatus"), 0)
+
+    @patch("frappe.db.rollback")
+    @patch(
+        "frappe_mpsa_payments.frappe_mpsa_payments.api.m_pesa_api.process_bulk_mpesa_payment_chunks",
+        side_effect=frappe.QueryTimeoutError,
+    )
+    def test_bulk_mpesa_payments_fail_without_a_status(self, mock_process_chunks, mock_rollback):
+        # the status set on submit has expired by the time the job runs
+        bulk_id = frappe.generate_hash(length=12)
 
-        payments = get_mpesa_draft_payments(company, mode_of_payment)
+        self.assertRaises(
+            frappe.QueryTimeoutError, process_bulk_mpesa_payments, bulk_id, [("MPC2B-MISSING", "_Test Customer")]
+        )
 
-        self.assertEqual(len(payments), 1)
-        self.assertEqual(payments[0]["name"], "MP001")
-        self.assertEqual(payments[0]["amount"], 100.0)
+        status = get_bulk_mpesa_payment_status(bulk_id)
+        self.assertEqual(status["status"], "Failed")
+        self.assertEqual(status["owner"], frappe.session.user)
+        mock_rollback.assert_called_once()
 
     @patch("frappe.get_doc")
     @patch("frappe.get_all")
@@ -96,5 +294,6 @@ class TestMPesaAPI(FrappeTestCase):
 
         payment_entry = submit_mpesa_payment(mpesa_payment, customer)
 
-        self.assertEqual(payment_entry, "PE001")
+        mock_get_doc.assert_called_with("Payment Entry", "PE001")
+        self.assertEqual(payment_entry, mock_get_doc.return_value)
 
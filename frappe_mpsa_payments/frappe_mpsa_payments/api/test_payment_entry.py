@@ -1,12 +1,34 @@
+from unittest.mock import Mock, patch
+
 import frappe
 from frappe.tests.utils import FrappeTestCase
 from frappe_mpsa_payments.frappe_mpsa_payments.api.payment_entry import (
     get_outstanding_invoices,
+    get_outstanding_invoices_for_customers,
+    get_party_accounts,
     get_unallocated_payments,
     process_pos_payment,
     get_available_pos_profiles,
     set_paid_amount_and_received_amount,
+    get_total_amount_selected_mpesa_payments,
+    get_total_amount_selected_payments,
+    get_payment_context,
+    allocate_in_order,
+    create_and_reconcile_payment_reconciliation,
+    PAYMENT_CONTEXT_KEY,
+    RECONCILIATION_LOCK_KEY,
+)
+from frappe_mpsa_payments.frappe_mpsa_payments.api.m_pesa_api import insert_c2b_payment
+from frappe_mpsa_payments.frappe_mpsa_payments.api.outstanding_snapshot import (
+    check_outstanding_snapshot,
+    get_cached_voucher_outstandings,
+    get_customer_ledger_filter,
+    get_snapshot_key,
+    get_stale_vouchers_key,
+    mark_voucher_stale,
+    pop_stale_vouchers,
 )
+from frappe_mpsa_payments.utils.utils import acquire_redis_lock, release_redis_lock
 
 class TestPaymentFunctions(FrappeTestCase):
     def test_get_outstanding_invoices(self):
@@ -20,6 +42,42 @@ class TestPaymentFunctions(FrappeTestCase):
         # Assert the result
         self.assertTrue(isinstance(invoices, list))
 
+    def test_get_outstanding_invoices_for_customers(self):
+        company = "Test Company Maniac"
+        customers = ["Test Customer", "Test Customer 2"]
+
+        invoices = get_outstanding_invoices_for_customers(company, customers)
+
+        self.assertEqual(list(invoices), customers)
+        for customer in customers:
+            self.assertTrue(isinstance(invoices[customer], list))
+
+    def test_party_accounts_match_get_party_account(self):
+        from erpnext.accounts.doctype.sales_invoice.test_sales_invoice import create_sales_invoice
+        from erpnext.accounts.party import get_party_account
+        from erpnext.accounts.utils import get_account_currency
+
+        # no account of its own, only USD GL entries to fall back to
+        customer = frappe.get_doc(
+            {
+                "doctype": "Customer",
+                "customer_name": f"_Test Customer {frappe.generate_hash(length=6)}",
+                "customer_group": "_Test Customer Group",
+                "territory": "_Test Territory",
+            }
+        ).insert()
+        create_sales_invoice(
+            customer=customer.name, debit_to="_Test Receivable USD - _TC", currency="USD", conversion_rate=50
+        )
+        customers = [customer.name, "_Test Customer USD", "_Test Customer"]
+
+        party_accounts = get_party_accounts(customers, "_Test Company")
+
+        self.assertEqual(
+            party_accounts, {c: get_party_account("Customer", c, "_Test Company") for c in customers}
+        )
+        self.assertEqual(get_account_currency(party_accounts[customer.name]), "USD")
+
     def test_get_unallocated_payments(self):
         customer = "Test Customer"
         company = "Test Company Maniac"
@@ -83,3 +141,159 @@ class TestPaymentFunctions(FrappeTestCase):
 
         self.assertEqual(paid_amount, 100.00)
         self.assertEqual(received_amount, 100.00)
+
+    def test_get_total_amount_selected_mpesa_payments(self):
+        names = [
+            insert_c2b_payment(
+                frappe._dict({"TransID": f"TOTAL{i:04d}", "TransAmount": 10.0, "BusinessShortCode": "123456"})
+            ).name
+            for i in range(50)
+        ]
+
+        with self.assertQueryCount(1):
+            self.assertEqual(get_total_amount_selected_mpesa_payments(names[:1]), 10.0)
+
+        with self.assertQueryCount(1):
+            self.assertEqual(get_total_amount_selected_mpesa_payments(names), 500.0)
+
+        self.assertEqual(get_total_amount_selected_mpesa_payments([{"name": name} for name in names]), 500.0)
+
+    def test_get_total_amount_selected_payments(self):
+        with self.assertQueryCount(1):
+            self.assertEqual(get_total_amount_selected_payments("_Test POS Invoice Missing"), 0)
+
+    def test_payment_context_is_cleared_on_mode_of_payment_change(self):
+        key = f"{PAYMENT_CONTEXT_KEY}|_Test Company|Cash"
+        frappe.cache().set_value(key, frappe._dict({"letter_head": "_Test Letter Head"}), expires_in_sec=60)
+        self.assertEqual(get_payment_context("_Test Company", "Cash").letter_head, "_Test Letter Head")
+
+        frappe.get_doc("Mode of Payment", "Cash").save()
+        # still cached until the change is committed
+        self.assertIsNotNone(frappe.cache().get_value(key, expires=True))
+
+        frappe.db.after_commit.run()
+        self.assertIsNone(frappe.cache().get_value(key, expires=True))
+
+    def test_outstanding_snapshot_matches_ledger(self):
+        # first check builds the snapshot, the second one reads it back
+        for _ in range(2):
+            result = check_outstanding_snapshot("_Test Company", "_Test Customer")
+            self.assertEqual(result, {"missing": [], "unexpected": [], "different": []})
+
+    def test_stale_vouchers_are_popped_once(self):
+        mark_voucher_stale("_Test Company", "_Test Customer", "Sales Invoice", "SINV-STALE-0001")
+        cache = frappe.cache()
+        self.assertGreater(cache.ttl(cache.make_key(get_stale_vouchers_key("_Test Company", "_Test Customer"))), 0)
+
+        self.assertEqual(
+            pop_stale_vouchers("_Test Company", "_Test Customer"), {("Sales Invoice", "SINV-STALE-0001")}
+        )
+        self.assertEqual(pop_stale_vouchers("_Test Company", "_Test Customer"), set())
+
+    def test_snapshot_being_refreshed_is_bypassed(self):
+        account = "Debtors - _TC"
+        mark_voucher_stale("_Test Company", "_Test Customer", "Sales Invoice", "SINV-STALE-0002")
+        lock = f"{get_snapshot_key('_Test Company', '_Test Customer', account)}|lock"
+        token = acquire_redis_lock(lock, 60)
+        try:
+            get_cached_voucher_outstandings(
+                "_Test Company", "_Test Customer", account, get_customer_ledger_filter("_Test Customer", account)
+            )
+        finally:
+            release_redis_lock(lock, token)
+
+        # left for the request holding the lock
+        self.assertEqual(
+            pop_stale_vouchers("_Test Company", "_Test Customer"), {("Sales Invoice", "SINV-STALE-0002")}
+        )
+
+    def test_allocate_in_order_carries_remainders_over(self):
+        reconcile_doc = Mock(company="_Test Company")
+        reconcile_doc.get_invoice_exchange_map.return_value = {}
+        reconcile_doc.get_difference_amount.return_value = 0
+        reconcile_doc.get_allocated_entry.side_effect = lambda pay, inv, amount: frappe._dict(
+            payment=pay.reference_name, invoice=inv.invoice_number, allocated_amount=amount
+        )
+        invoices = [
+            frappe._dict(invoice_number=name, outstanding_amount=amount)
+            for name, amount in (("INV-1", 100), ("INV-2", 50), ("INV-3", 80))
+        ]
+        payments = [
+            frappe._dict(reference_name=name, amount=amount, posting_date=None)
+            for name, amount in (("PE-1", 120), ("PE-2", 90))
+        ]
+
+        allocation = allocate_in_order(reconcile_doc, invoices, payments)
+
+        self.assertEqual(
+            [(d.payment, d.invoice, d.allocated_amount) for d in allocation],
+            [("PE-1", "INV-1", 100), ("PE-1", "INV-2", 20), ("PE-2", "INV-2", 30), ("PE-2", "INV-3", 60)],
+        )
+        self.assertEqual(invoices[2].outstanding_amount, 20)
+
+    @patch("frappe.db.get_single_value", return_value="Invoice")
+    def test_allocate_in_order_dates_gain_loss_as_configured(self, mock_get_single_value):
+        reconcile_doc = Mock(company="_Test Company")
+        reconcile_doc.get_invoice_exchange_map.return_value = {}
+        reconcile_doc.get_difference_amount.return_value = 0
+        reconcile_doc.get_allocated_entry.return_value = frappe._dict()
+        invoices = [frappe._dict(invoice_number="INV-1", invoice_date="2024-01-01", outstanding_amount=100)]
+        payments = [frappe._dict(reference_name="PE-1", amount=100, posting_date="2024-02-01")]
+
+        allocation = allocate_in_order(reconcile_doc, invoices, payments)
+
+        self.assertEqual(allocation[0].gain_loss_posting_date, "2024-01-01")
+
+    def test_create_and_reconcile_payment_reconciliation(self):
+        from erpnext.accounts.doctype.payment_entry.test_payment_entry import (
+            create_payment_entry as create_test_payment_entry,
+        )
+        from erpnext.accounts.doctype.sales_invoice.test_sales_invoice import create_sales_invoice
+
+        invoice = create_sales_invoice(qty=1, rate=300)
+        payment_entry = create_test_payment_entry(
+            payment_type="Receive",
+            party_type="Customer",
+            party=invoice.customer,
+            paid_from=invoice.debit_to,
+            paid_to="_Test Cash - _TC",
+            paid_amount=300,
+            submit=1,
+        )
+
+        reconcile_doc = create_and_reconcile_payment_reconciliation(
+            invoice.name, invoice.customer, invoice.company, [payment_entry.name], commit=False
+        )
+
+        self.assertEqual(
+            [(d.reference_name, d.invoice_number, d.allocated_amount) for d in reconcile_doc.allocation],
+            [(payment_entry.name, invoice.name, 300)],
+        )
+        self.assertEqual(frappe.db.get_value("Sales Invoice", invoice.name, "outstanding_amount"), 0)
+
+    @patch(
+        "frappe_mpsa_payments.frappe_mpsa_payments.api.payment_entry.is_any_doc_running",
+        return_value="ACC-PPR-0001",
+    )
+    def test_reconciliation_waits_for_a_running_reconciliation_job(self, mock_is_any_doc_running):
+        auto_reconcile = frappe.db.get_single_value("Accounts Settings", "auto_reconcile_payments")
+        frappe.db.set_single_value("Accounts Settings", "auto_reconcile_payments", 1)
+        try:
+            with self.assertRaises(frappe.ValidationError):
+                create_and_reconcile_payment_reconciliation(
+                    "_Test Sales Invoice Missing", "_Test Customer", "_Test Company", [], commit=False
+                )
+        finally:
+            frappe.db.set_single_value("Accounts Settings", "auto_reconcile_payments", auto_reconcile)
+
+    def test_reconciliation_needs_the_customer_lock(self):
+        # another process reconciling the customer
+        lock = f"{RECONCILIATION_LOCK_KEY}|_Test Customer"
+        token = acquire_redis_lock(lock, 60)
+        try:
+            with self.assertRaises(frappe.ValidationError):
+                create_and_reconcile_payment_reconciliation(
+                    "_Test Sales Invoice Missing", "_Test Customer", "_Test Company", [], commit=False
+                )
+        finally:
+            release_redis_lock(lock, token)
@@ -0,0 +1,69 @@
+"""Payment entries per second, one process_mpesa_payment call per register vs the bulk job.
+
+Seeds draft registers for an existing company, customer and mode of payment (the mode of
+payment needs a default account for the company) and posts them both ways. The
+registers and their Payment Entries are cancelled and deleted at the end:
+
+    bench --site <site> execute \
+        frappe_mpsa_payments.frappe_mpsa_payments.benchmarks.bulk_payments.run \
+        --kwargs "{'company': '_Test Company', 'customer': '_Test Customer', 'mode_of_payment': 'Cash'}"
+"""
+
+import time
+
+import frappe
+
+from ..api.m_pesa_api import (
+    insert_c2b_payment,
+    process_bulk_mpesa_payments,
+    process_mpesa_payment,
+    set_bulk_mpesa_payment_status,
+)
+from .c2b_ingest import get_callback_payload
+from .utils import delete_c2b_payments, new_prefix
+
+
+def run(company, customer, mode_of_payment, sizes=(1000, 10000), sequential_rows=1000):
+    prefix = new_prefix()
+    results = {}
+
+    try:
+        names = _seed(f"{prefix}S", sequential_rows, company, mode_of_payment)
+        start = time.perf_counter()
+        for name in names:
+            process_mpesa_payment(name, customer, submit_payment=True)
+        results["sequential"] = {"rows": sequential_rows, "rows_per_sec": _rate(sequential_rows, start)}
+
+        for size in sizes:
+            names = _seed(f"{prefix}B{size}", size, company, mode_of_payment)
+            bulk_id = frappe.generate_hash(length=12)
+            set_bulk_mpesa_payment_status(
+                bulk_id, {"status": "Queued", "owner": frappe.session.user, "total": size, "results": []}
+            )
+
+            start = time.perf_counter()
+            status = process_bulk_mpesa_payments(bulk_id, [(name, customer) for name in names])
+            results[f"bulk_{size}"] = {
+                "rows": size,
+                "rows_per_sec": _rate(size, start),
+                "failed": sum(1 for result in status["results"] if result["status"] != "Success"),
+            }
+    finally:
+        frappe.db.rollback()
+        delete_c2b_payments(prefix)
+
+    return results
+
+
+def _seed(prefix, rows, company, mode_of_payment):
+    names = []
+    for i in range(rows):
+        doc = insert_c2b_payment(frappe._dict(get_callback_payload(f"{prefix}{i:07d}", shortcode="000000")))
+        doc.db_set({"company": company, "mode_of_payment": mode_of_payment})
+        names.append(doc.name)
+    frappe.db.commit()
+    return names
+
+
+def _rate(rows, start):
+    return round(rows / (time.perf_counter() - start), 1)
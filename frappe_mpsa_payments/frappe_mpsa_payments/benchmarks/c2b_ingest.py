@@ -0,0 +1,71 @@
+"""Callbacks/second for the C2B `confirmation` endpoint, inline inserts vs queued ingest.
+
+Run against a test site, with background workers stopped so the queue is only drained here:
+
+    bench --site <site> execute \
+        frappe_mpsa_payments.frappe_mpsa_payments.benchmarks.c2b_ingest.run \
+        --kwargs "{'callbacks': 2000}"
+"""
+
+import time
+
+import frappe
+
+from frappe_mpsa_payments.utils.site_config import C2B_ASYNC_INGEST
+
+from ..api.m_pesa_api import confirmation, process_c2b_ingest_queue
+from .utils import new_prefix
+
+
+def run(callbacks=1000, shortcode="174379"):
+    prefix = new_prefix()
+    async_ingest = frappe.conf.get(C2B_ASYNC_INGEST)
+
+    try:
+        frappe.conf[C2B_ASYNC_INGEST] = 0
+        inline = _time_callbacks(f"{prefix}S", callbacks, shortcode)
+
+        frappe.conf[C2B_ASYNC_INGEST] = 1
+        queued = _time_callbacks(f"{prefix}Q", callbacks, shortcode)
+
+        start = time.perf_counter()
+        process_c2b_ingest_queue()
+        drain = time.perf_counter() - start
+    finally:
+        frappe.conf[C2B_ASYNC_INGEST] = async_ingest
+        frappe.db.delete("Mpesa C2B Payment Register", {"transid": ["like", f"{prefix}%"]})
+        frappe.db.commit()
+
+    return {
+        "callbacks": callbacks,
+        "inline_callbacks_per_sec": round(callbacks / inline, 1),
+        "queued_callbacks_per_sec": round(callbacks / queued, 1),
+        "queued_drain_rows_per_sec": round(callbacks / drain, 1),
+    }
+
+
+def _time_callbacks(prefix, callbacks, shortcode):
+    start = time.perf_counter()
+    for i in range(callbacks):
+        response = confirmation(**get_callback_payload(f"{prefix}{i:07d}", shortcode))
+        if response["ResultCode"] != 0:
+            frappe.throw(f"Callback {i} rejected")
+    return time.perf_counter() - start
+
+
+def get_callback_payload(transid, shortcode="174379", amount=100.0, msisdn="254708374149"):
+    return {
+        "TransactionType": "Pay Bill",
+        "TransID": transid,
+        "TransTime": "20240501120000",
+        "TransAmount": amount,
+        "BusinessShortCode": shortcode,
+        "BillRefNumber": "",
+        "InvoiceNumber": "",
+        "OrgAccountBalance": "",
+        "ThirdPartyTransID": "",
+        "MSISDN": msisdn,
+        "FirstName": "John",
+        "MiddleName": "",
+        "LastName": "Doe",
+    }
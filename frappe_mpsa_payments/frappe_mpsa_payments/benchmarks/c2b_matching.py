@@ -0,0 +1,60 @@
+"""Registers matched per second by the BillRefNumber matcher.
+
+Seeds draft registers whose BillRefNumber is the customer code, plus one register per
+unpaid Sales Invoice of the customer given in `invoices` (those are matched and
+reconciled), and times match_c2b_payments draining them. Compare `rows_per_sec` with the
+peak callback rate. The registers and their Payment Entries are cancelled and deleted
+at the end, which also undoes the reconciliations:
+
+    bench --site <site> execute \
+        frappe_mpsa_payments.frappe_mpsa_payments.benchmarks.c2b_matching.run \
+        --kwargs "{'company': '_Test Company', 'customer': '_Test Customer', 'mode_of_payment': 'Cash'}"
+"""
+
+import time
+
+import frappe
+
+from ..api.c2b_matching import match_c2b_payments
+from ..api.m_pesa_api import insert_c2b_payment
+from frappe_mpsa_payments.utils.site_config import C2B_AUTO_MATCH
+from .c2b_ingest import get_callback_payload
+from .utils import delete_c2b_payments, new_prefix
+
+
+def run(company, customer, mode_of_payment, rows=1000, invoices=(), batch_size=None):
+    prefix = new_prefix()
+    references = [customer] * rows + list(invoices)
+    auto_match = frappe.conf.get(C2B_AUTO_MATCH)
+
+    try:
+        names = []
+        for i, reference in enumerate(references):
+            payload = get_callback_payload(f"{prefix}{i:07d}", shortcode="000000")
+            payload["BillRefNumber"] = reference
+            doc = insert_c2b_payment(frappe._dict(payload))
+            doc.db_set({"company": company, "mode_of_payment": mode_of_payment, "auto_match_status": "Pending"})
+            names.append(doc.name)
+        frappe.db.commit()
+
+        frappe.conf[C2B_AUTO_MATCH] = 1
+        start = time.perf_counter()
+        match_c2b_payments(batch_size)
+        elapsed = time.perf_counter() - start
+
+        statuses = frappe.get_all(
+            "Mpesa C2B Payment Register",
+            filters={"name": ["in", names]},
+            fields=["auto_match_status", "count(name) as count"],
+            group_by="auto_match_status",
+            as_list=True,
+        )
+        return {
+            "rows": len(names),
+            "rows_per_sec": round(len(names) / elapsed, 1),
+            "statuses": dict(statuses),
+        }
+    finally:
+        frappe.conf[C2B_AUTO_MATCH] = auto_match
+        frappe.db.rollback()
+        delete_c2b_payments(prefix)
@@ -0,0 +1,79 @@
+"""Concurrent register inserts under the naming series vs Trans ID based names.
+
+Each worker thread opens its own db connection and inserts + commits registers one by
+one, the way gunicorn workers handle bursts of confirmation callbacks. InnoDB row lock
+waits are read from the server status before and after each run.
+
+    bench --site <site> execute \
+        frappe_mpsa_payments.frappe_mpsa_payments.benchmarks.c2b_naming.run \
+        --kwargs "{'workers': 8, 'inserts_per_worker': 250}"
+"""
+
+import threading
+import time
+
+import frappe
+
+from frappe_mpsa_payments.utils.site_config import C2B_NAMING
+
+from ..api.m_pesa_api import insert_c2b_payment
+from .c2b_ingest import get_callback_payload
+from .utils import new_prefix
+
+
+def run(workers=8, inserts_per_worker=250):
+    site, sites_path = frappe.local.site, frappe.local.sites_path
+    prefix = new_prefix()
+
+    results = {}
+    try:
+        for naming in ("series", "transid"):
+            results[naming] = _run_concurrent(
+                site, sites_path, f"{prefix}{naming[0].upper()}", naming, workers, inserts_per_worker
+            )
+    finally:
+        frappe.db.delete("Mpesa C2B Payment Register", {"transid": ["like", f"{prefix}%"]})
+        frappe.db.commit()
+
+    return results
+
+
+def _run_concurrent(site, sites_path, prefix, naming, workers, inserts_per_worker):
+    waits_before = _get_row_lock_status()
+    errors = []
+
+    def insert_registers(worker):
+        frappe.init(site=site, sites_path=sites_path)
+        frappe.connect()
+        frappe.local.conf[C2B_NAMING] = naming
+        try:
+            for i in range(inserts_per_worker):
+                insert_c2b_payment(frappe._dict(get_callback_payload(f"{prefix}{worker:03d}{i:06d}")))
+                frappe.db.commit()
+        except Exception as e:
+            errors.append(str(e))
+        finally:
+            frappe.destroy()
+
+    threads = [threading.Thread(target=insert_registers, args=(w,)) for w in range(workers)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    waits_after = _get_row_lock_status()
+    inserts = workers * inserts_per_worker
+    return {
+        "inserts": inserts,
+        "errors": len(errors),
+        "inserts_per_sec": round(inserts / elapsed, 1),
+        "row_lock_waits": waits_after["Innodb_row_lock_waits"] - waits_before["Innodb_row_lock_waits"],
+        "row_lock_time_ms": waits_after["Innodb_row_lock_time"] - waits_before["Innodb_row_lock_time"],
+    }
+
+
+def _get_row_lock_status():
+    rows = frappe.db.sql("show global status where Variable_name in ('Innodb_row_lock_waits', 'Innodb_row_lock_time')")
+    return {name: int(value) for name, value in rows}
@@ -0,0 +1,104 @@
+"""Draft C2B payment search, the two `LIKE '%term%'` scans vs the indexed union query.
+
+Seeds `rows` draft registers with bulk inserts (so the seeding itself skips the controller),
+then times both searches for phone number suffixes and name prefixes. Run it on a throwaway
+site, a million rows take a while to seed:
+
+    bench --site <site> execute \
+        frappe_mpsa_payments.frappe_mpsa_payments.benchmarks.c2b_search.run \
+        --kwargs "{'rows': 1000000}"
+"""
+
+import random
+import time
+
+import frappe
+from frappe.utils import add_days, getdate
+
+from ..api.m_pesa_api import get_mpesa_draft_c2b_payments
+from .utils import bulk_seed, new_prefix
+
+FIRST_NAMES = ("John", "Mary", "Peter", "Grace", "James", "Faith", "David", "Mercy", "Brian", "Joyce")
+LAST_NAMES = ("Otieno", "Wanjiku", "Kamau", "Achieng", "Mutua", "Njeri", "Kiprop", "Auma", "Mwangi", "Chebet")
+
+
+def run(rows=1000000, searches=50, chunk_size=10000):
+    prefix = new_prefix()
+
+    try:
+        _seed(prefix, rows, chunk_size)
+        frappe.db.commit()
+
+        terms = [f"{random.randint(0, 999999):06d}" for _ in range(searches // 2)]
+        terms += [random.choice(LAST_NAMES)[:4] for _ in range(searches - len(terms))]
+
+        return {
+            "rows": rows,
+            "searches": searches,
+            "like_scans_ms": _time_searches(_legacy_search, terms),
+            "indexed_ms": _time_searches(get_mpesa_draft_c2b_payments, terms),
+        }
+    finally:
+        frappe.db.delete("Mpesa C2B Payment Register", {"transid": ["like", f"{prefix}%"]})
+        frappe.db.commit()
+
+
+def _seed(prefix, rows, chunk_size):
+    fields = [
+        "transid",
+        "transamount",
+        "businessshortcode",
+        "msisdn",
+        "msisdn_reversed",
+        "firstname",
+        "lastname",
+        "full_name",
+        "posting_date",
+        "posting_time",
+        "currency",
+    ]
+    today = getdate()
+
+    def make_rows():
+        for i in range(rows):
+            msisdn = f"2547{random.randint(0, 99999999):08d}"
+            firstname, lastname = random.choice(FIRST_NAMES), random.choice(LAST_NAMES)
+            yield (
+                f"{prefix}-{i:08d}",
+                f"{prefix}{i:08d}",
+                random.randint(10, 10000),
+                "174379",
+                msisdn,
+                msisdn[::-1],
+                firstname,
+                lastname,
+                f"{firstname} {lastname}",
+                add_days(today, -random.randint(0, 365)),
+                f"{random.randint(0, 23):02d}:{random.randint(0, 59):02d}:00",
+                "KES",
+            )
+
+    bulk_seed("Mpesa C2B Payment Register", fields, make_rows(), chunk_size=chunk_size)
+
+
+def _time_searches(search, terms):
+    start = time.perf_counter()
+    for term in terms:
+        search(term)
+    return round((time.perf_counter() - start) * 1000 / len(terms), 2)
+
+
+def _legacy_search(search_term):
+    fields = ["name", "company", "msisdn", "full_name", "posting_date", "posting_time", "transamount"]
+    order_by = "posting_date desc, posting_time desc"
+    return frappe.get_all(
+        "Mpesa C2B Payment Register",
+        filters={"full_name": ["like", f"%{search_term}%"], "docstatus": 0},
+        fields=fields,
+        order_by=order_by,
+    ) + frappe.get_all(
+        "Mpesa C2B Payment Register",
+        filters={"msisdn": ["like", f"%{search_term}%"], "docstatus": 0},
+        fields=fields,
+        order_by=order_by,
+    )
@@ -0,0 +1,108 @@
+"""Requests/second of the sync MpesaConnector vs AsyncMpesaConnector against a local fake Daraja.
+
+The fake server answers every STK push after `latency` seconds, standing in for the round
+trip to Safaricom.
+
+    bench --site <site> execute \
+        frappe_mpsa_payments.frappe_mpsa_payments.benchmarks.daraja_client.run \
+        --kwargs "{'requests': 500, 'concurrency': 100}"
+"""
+
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import frappe
+
+from ..doctype.mpesa_settings.async_mpesa_connector import AsyncMpesaConnector
+from ..doctype.mpesa_settings.mpesa_connector import MpesaConnector
+
+
+def run(requests=500, concurrency=100, latency=0.05):
+    FakeDarajaHandler.latency = latency
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeDarajaHandler)
+    server.daemon_threads = True
+    server_url = f"http://127.0.0.1:{server.server_port}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    try:
+        connector = MpesaConnector(app_key="key", app_secret="secret", sandbox_url=server_url)
+        start = time.perf_counter()
+        for _ in range(requests):
+            connector.stk_push(**get_stk_push_args())
+        sync_elapsed = time.perf_counter() - start
+
+        async_elapsed = asyncio.run(_run_async(server_url, requests, concurrency))
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "latency_sec": latency,
+        "sync_requests_per_sec": round(requests / sync_elapsed, 1),
+        "async_requests_per_sec": round(requests / async_elapsed, 1),
+    }
+
+
+async def _run_async(server_url, requests, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with AsyncMpesaConnector(
+        app_key="key", app_secret="secret", sandbox_url=server_url, max_connections=concurrency
+    ) as connector:
+
+        async def stk_push():
+            async with semaphore:
+                return await connector.stk_push(**get_stk_push_args())
+
+        start = time.perf_counter()
+        await asyncio.gather(*(stk_push() for _ in range(requests)))
+        return time.perf_counter() - start
+
+
+def get_stk_push_args():
+    return {
+        "business_shortcode": "174379",
+        "passcode": "passkey",
+        "amount": 10,
+        "callback_url": "https://example.com/callback",
+        "reference_code": "174379",
+        "phone_number": "254708374149",
+        "description": "POS Payment",
+    }
+
+
+class FakeDarajaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    latency = 0.05
+
+    def do_GET(self):
+        self._respond({"access_token": "fake-token", "expires_in": "3599"})
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        time.sleep(self.latency)
+        self._respond(
+            {
+                "MerchantRequestID": "29115-34620561-1",
+                "CheckoutRequestID": f"ws_CO_{frappe.generate_hash(length=12)}",
+                "ResponseCode": "0",
+                "ResponseDescription": "Success. Request accepted for processing",
+                "CustomerMessage": "Success. Request accepted for processing",
+            }
+        )
+
+    def _respond(self, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
@@ -0,0 +1,102 @@
+"""Unpaid invoice listing for the POS picker, `select *` without limit vs the projected page.
+
+Seeds submitted, unpaid Sales Invoices with bulk inserts up to each size in `sizes` and
+records response size and latency of both listings at every step. The seeded rows are
+bare invoice headers, only meant for this measurement, so run it on a throwaway site:
+
+    bench --site <site> execute \
+        frappe_mpsa_payments.frappe_mpsa_payments.benchmarks.pos_invoices.run \
+        --kwargs "{'company': '_Test Company', 'customer': '_Test Customer'}"
+"""
+
+import random
+import time
+
+import frappe
+from frappe.utils import add_days, getdate
+
+from ..api.m_pesa_api import get_draft_pos_invoice
+from .utils import bulk_seed, new_prefix
+
+
+def run(company, customer, sizes=(10000, 100000, 1000000), chunk_size=10000):
+    prefix = new_prefix()
+    currency = frappe.get_cached_value("Company", company, "default_currency")
+
+    results = []
+    seeded = 0
+    try:
+        for size in sizes:
+            _seed(prefix, seeded, size, company, customer, currency, chunk_size)
+            seeded = size
+            frappe.db.commit()
+
+            results.append(
+                {
+                    "invoices": size,
+                    "select_all": _measure(_legacy_listing),
+                    "projected_page": _measure(get_draft_pos_invoice),
+                }
+            )
+    finally:
+        frappe.db.delete("Sales Invoice", {"name": ["like", f"{prefix}-%"]})
+        frappe.db.commit()
+
+    return results
+
+
+def _seed(prefix, start, end, company, customer, currency, chunk_size):
+    fields = [
+        "status",
+        "company",
+        "customer",
+        "customer_name",
+        "posting_date",
+        "due_date",
+        "currency",
+        "grand_total",
+        "outstanding_amount",
+    ]
+    today = getdate()
+
+    def make_rows():
+        for i in range(start, end):
+            posting_date = add_days(today, -random.randint(0, 730))
+            grand_total = random.randint(100, 100000)
+            yield (
+                f"{prefix}-{i:08d}",
+                random.choice(("Unpaid", "Overdue", "Partially Paid")),
+                company,
+                customer,
+                customer,
+                posting_date,
+                add_days(posting_date, 30),
+                currency,
+                grand_total,
+                grand_total,
+            )
+
+    bulk_seed("Sales Invoice", fields, make_rows(), docstatus=1, chunk_size=chunk_size)
+
+
+def _measure(listing):
+    frappe.response.pop("message", None)
+    start = time.perf_counter()
+    listing()
+    elapsed = time.perf_counter() - start
+    return {
+        "ms": round(elapsed * 1000, 1),
+        "rows": len(frappe.response.get("message")),
+        "response_bytes": len(frappe.as_json(frappe.response.get("message"), indent=None)),
+    }
+
+
+def _legacy_listing():
+    status_filters = ["Overdue", "Partially Paid", "Unpaid", "Overdue and Discounted", "Partially Paid and Discounted"]
+    frappe.response["message"] = frappe.db.sql(
+        """select * from `tabSales Invoice`
+        where docstatus = 1 and status in %(status_filters)s
+        order by posting_date desc""",
+        {"status_filters": status_filters},
+        as_dict=True,
+    )
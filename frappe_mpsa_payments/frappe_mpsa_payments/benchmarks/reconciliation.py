@@ -0,0 +1,102 @@
+"""POS reconciliation of one invoice for a customer with many open ledger entries.
+
+Seeds `open_entries` open Payment Ledger Entries for the invoice's customer, then times the
+step the targeted path skips (Payment Reconciliation.get_unreconciled_entries) and the
+targeted reconciliation of `invoice` against `payment_entry`. Everything is rolled back at
+the end, so the invoice and payment entry can be reused:
+
+    bench --site <site> execute \
+        frappe_mpsa_payments.frappe_mpsa_payments.benchmarks.reconciliation.run \
+        --kwargs "{'invoice': 'ACC-SINV-2024-00001', 'payment_entry': 'ACC-PAY-2024-00001'}"
+"""
+
+import time
+
+import frappe
+from frappe.utils import add_days, getdate
+
+from erpnext.accounts.party import get_party_account
+
+from ..api.payment_entry import create_and_reconcile_payment_reconciliation
+from .utils import bulk_seed, new_prefix
+
+
+def run(invoice, payment_entry, open_entries=10000, chunk_size=5000):
+    customer, company, currency = frappe.db.get_value(
+        "Sales Invoice", invoice, ["customer", "company", "currency"]
+    )
+    account = get_party_account("Customer", customer, company)
+
+    try:
+        _seed(customer, company, account, currency, open_entries, chunk_size)
+
+        reconcile_doc = frappe.new_doc("Payment Reconciliation")
+        reconcile_doc.party_type = "Customer"
+        reconcile_doc.party = customer
+        reconcile_doc.company = company
+        reconcile_doc.receivable_payable_account = account
+        start = time.perf_counter()
+        reconcile_doc.get_unreconciled_entries()
+        load = time.perf_counter() - start
+
+        start = time.perf_counter()
+        reconciled = create_and_reconcile_payment_reconciliation(
+            invoice, customer, company, [payment_entry], commit=False
+        )
+        targeted = time.perf_counter() - start
+    finally:
+        frappe.db.rollback()
+
+    return {
+        "open_entries": open_entries,
+        "get_unreconciled_entries_ms": round(load * 1000, 1),
+        "targeted_reconciliation_ms": round(targeted * 1000, 1),
+        "allocated": [row.allocated_amount for row in reconciled.allocation],
+    }
+
+
+def _seed(customer, company, account, currency, open_entries, chunk_size):
+    prefix = new_prefix()
+    fields = [
+        "posting_date",
+        "due_date",
+        "company",
+        "account_type",
+        "account",
+        "party_type",
+        "party",
+        "voucher_type",
+        "voucher_no",
+        "against_voucher_type",
+        "against_voucher_no",
+        "account_currency",
+        "amount",
+        "amount_in_account_currency",
+        "delinked",
+    ]
+    today = getdate()
+
+    def make_rows():
+        for i in range(open_entries):
+            voucher_no = f"{prefix}-{i:07d}"
+            posting_date = add_days(today, -(i % 365))
+            yield (
+                voucher_no,
+                posting_date,
+                posting_date,
+                company,
+                "Receivable",
+                account,
+                "Customer",
+                customer,
+                "Sales Invoice",
+                voucher_no,
+                "Sales Invoice",
+                voucher_no,
+                currency,
+                100,
+                100,
+                0,
+            )
+
+    bulk_seed("Payment Ledger Entry", fields, make_rows(), docstatus=1, chunk_size=chunk_size)
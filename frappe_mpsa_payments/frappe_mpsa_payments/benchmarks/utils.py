@@ -0,0 +1,50 @@
+from itertools import islice
+
+import frappe
+from frappe.utils import create_batch, now_datetime
+
+STANDARD_FIELDS = ("creation", "modified", "owner", "modified_by", "docstatus")
+
+
+def new_prefix():
+    """Prefix for the names and Trans IDs of a benchmark run, used to delete its rows afterwards."""
+    return f"BENCH{frappe.generate_hash(length=5).upper()}"
+
+
+def bulk_seed(doctype, fields, rows, docstatus=0, chunk_size=10000):
+    """Insert `rows`, tuples of a name followed by the values of `fields`, skipping the controller.
+
+    The standard columns are filled in, rows are inserted `chunk_size` at a time.
+    """
+    now = now_datetime()
+    standard_values = (now, now, "Administrator", "Administrator", docstatus)
+    columns = ["name", *STANDARD_FIELDS, *fields]
+
+    rows = iter(rows)
+    while chunk := list(islice(rows, chunk_size)):
+        frappe.db.bulk_insert(doctype, columns, [(row[0], *standard_values, *row[1:]) for row in chunk])
+
+
+def delete_c2b_payments(prefix):
+    """Cancel and delete the registers of a run along with their Payment Entries, then commit.
+
+    Cancelling a Payment Entry also undoes its reconciliation against invoices.
+    """
+    registers = frappe.get_all(
+        "Mpesa C2B Payment Register",
+        filters={"transid": ["like", f"{prefix}%"]},
+        fields=["name", "docstatus", "payment_entry"],
+    )
+    for batch in create_batch(registers, 1000):
+        for register in batch:
+            if register.docstatus == 1:
+                frappe.get_doc("Mpesa C2B Payment Register", register.name).cancel()
+            frappe.delete_doc("Mpesa C2B Payment Register", register.name, force=True, ignore_permissions=True)
+
+            if register.payment_entry and frappe.db.exists("Payment Entry", register.payment_entry):
+                payment_entry = frappe.get_doc("Payment Entry", register.payment_entry)
+                if payment_entry.docstatus == 1:
+                    payment_entry.cancel()
+                frappe.delete_doc("Payment Entry", payment_entry.name, force=True, ignore_permissions=True)
+
+        frappe.db.commit()
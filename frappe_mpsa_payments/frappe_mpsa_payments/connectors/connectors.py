@@ -2,12 +2,12 @@ from abc import ABC, abstractmethod
 from datetime import datetime, timedelta
 from enum import Enum
 
-import requests
 from requests.auth import HTTPBasicAuth
 
 import frappe
 
-from ...utils.utils import save_access_token
+from ...utils.utils import ACCESS_TOKEN_REQUEST_TIMEOUT, get_access_token, save_access_token
+from .session import get_session
 
 
 class URLS(Enum):
@@ -58,13 +58,22 @@ class BaseConnector(AbstractConnector):
             self.base_url = URLS.PRODUCTION.value
 
     def authenticate(self, setting: str) -> dict[str, str | datetime] | None:
+        token = get_access_token(
+            setting, self.env, lambda: self.fetch_access_token(setting)
+        )
+        self.authentication_token = token["access_token"]
+        self.expires_in = token["expires_in"]
+        return token
+
+    def fetch_access_token(self, setting: str) -> dict[str, str | datetime] | None:
+        """Request a new access token from Daraja and share it through the token cache."""
         authenticate_uri = "/oauth/v1/generate?grant_type=client_credentials"
         authenticate_url = f"{self.base_url}{authenticate_uri}"
 
-        r = requests.get(
+        r = get_session().get(
             authenticate_url,
             auth=HTTPBasicAuth(self.app_key, self.app_secret),
-            timeout=120,
+            timeout=ACCESS_TOKEN_REQUEST_TIMEOUT,
         )
 
         if r.status_code < 400:
@@ -83,6 +92,7 @@ class BaseConnector(AbstractConnector):
                 expiry_time=self.expires_in,
                 fetch_time=fetch_time,
                 associated_setting=setting,
+                env=self.env,
             )
 
             return {
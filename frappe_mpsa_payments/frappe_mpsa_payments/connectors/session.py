@@ -0,0 +1,61 @@
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import frappe
+
+from ...utils.site_config import HTTP_CONNECT_TIMEOUT, HTTP_POOL_SIZE, HTTP_READ_TIMEOUT
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_CONNECT_TIMEOUT = 5
+DEFAULT_READ_TIMEOUT = 30
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+class DarajaSession(requests.Session):
+    """Keep-alive session that applies the site's timeouts to calls that don't pass one."""
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", get_timeouts())
+        return super().request(method, url, **kwargs)
+
+
+def get_session() -> DarajaSession:
+    """Return the process-wide session used for every call to Daraja.
+
+    Connections (and their TLS sessions) are pooled per host and reused across requests
+    and threads. A forked worker builds its own session instead of sharing the parent's
+    sockets.
+    """
+    global _session, _session_pid
+
+    if _session is None or _session_pid != os.getpid():
+        with _session_lock:
+            if _session is None or _session_pid != os.getpid():
+                _session = build_session()
+                _session_pid = os.getpid()
+
+    return _session
+
+
+def build_session() -> DarajaSession:
+    pool_size = frappe.conf.get(HTTP_POOL_SIZE) or DEFAULT_POOL_SIZE
+    adapter = HTTPAdapter(pool_connections=2, pool_maxsize=int(pool_size))
+
+    session = DarajaSession()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_timeouts() -> tuple[float, float]:
+    """(connect, read) timeouts in seconds, from site config."""
+    return (
+        float(frappe.conf.get(HTTP_CONNECT_TIMEOUT) or DEFAULT_CONNECT_TIMEOUT),
+        float(frappe.conf.get(HTTP_READ_TIMEOUT) or DEFAULT_READ_TIMEOUT),
+    )
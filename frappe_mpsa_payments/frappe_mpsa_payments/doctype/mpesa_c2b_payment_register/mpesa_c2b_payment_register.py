@@ -4,9 +4,28 @@
 import frappe
 from frappe import _
 from frappe.model.document import Document
+from frappe_mpsa_payments.frappe_mpsa_payments.api.m_pesa_api import (
+    on_c2b_payment_change,
+    on_c2b_payment_insert,
+)
 from frappe_mpsa_payments.frappe_mpsa_payments.api.payment_entry import create_payment_entry
+from frappe_mpsa_payments.frappe_mpsa_payments.doctype.mpesa_c2b_payment_register_url.mpesa_c2b_payment_register_url import (
+    get_shortcode_details,
+)
+from frappe_mpsa_payments.frappe_mpsa_payments.doctype.mpesa_customer_phone.mpesa_customer_phone import (
+    get_customer_by_phone,
+)
+from frappe_mpsa_payments.utils.site_config import C2B_AUTO_MATCH, C2B_NAMING
+
+FULL_NAME_FULLTEXT_INDEX = "full_name_fulltext"
 
 class MpesaC2BPaymentRegister(Document):
+    def autoname(self):
+        # Naming off the Trans ID keeps concurrent callback inserts off the shared
+        # naming series counter row. Unset, the "MPC2B.-.YY.-.MM.-.######" series is used.
+        if frappe.conf.get(C2B_NAMING) == "transid" and self.transid:
+            self.name = f"MPC2B-{self.transid.strip().upper()}"
+
     def before_insert(self):
         self.set_missing_values()
 
@@ -20,17 +39,32 @@ class MpesaC2BPaymentRegister(Document):
         if self.lastname:
             self.full_name += " " + self.lastname
 
-        register_url_list = frappe.get_all(
-            "Mpesa C2B Payment Register URL",
-            filters={
-                "business_shortcode": self.businessshortcode,
-                "register_status": "Success",
-            },
-            fields=["company", "mode_of_payment"],
-        )
-        if len(register_url_list) > 0:
-            self.company = register_url_list[0].company
-            self.mode_of_payment = register_url_list[0].mode_of_payment
+        # indexed in reverse so that phone number suffix searches are index prefix scans
+        self.msisdn_reversed = (self.msisdn or "").strip()[::-1] or None
+
+        shortcode_details = get_shortcode_details(self.businessshortcode)
+        if shortcode_details:
+            self.company = shortcode_details["company"]
+            self.mode_of_payment = shortcode_details["mode_of_payment"]
+
+        if not self.customer:
+            self.customer = get_customer_by_phone(self.msisdn)
+
+        # picked up by the BillRefNumber matcher (api/c2b_matching.py)
+        if frappe.conf.get(C2B_AUTO_MATCH) and (self.billrefnumber or self.invoicenumber):
+            self.auto_match_status = "Pending"
+
+    def after_insert(self):
+        on_c2b_payment_insert(self)
+
+    def on_update(self):
+        on_c2b_payment_change()
+
+    def on_submit(self):
+        on_c2b_payment_change()
+
+    def on_cancel(self):
+        on_c2b_payment_change()
 
     def before_submit(self):
         if not self.transamount:
@@ -60,4 +94,14 @@ class MpesaC2BPaymentRegister(Document):
             self.submit_payment,
         )
         return payment_entry.name
-    
+
+
+def on_doctype_update():
+    frappe.db.add_index("Mpesa C2B Payment Register", ["docstatus", "posting_date", "posting_time"])
+
+    if frappe.db.db_type == "mariadb" and not frappe.db.has_index(
+        "tabMpesa C2B Payment Register", FULL_NAME_FULLTEXT_INDEX
+    ):
+        frappe.db.sql_ddl(
+            f"alter table `tabMpesa C2B Payment Register` add fulltext index `{FULL_NAME_FULLTEXT_INDEX}` (full_name)"
+        )
@@ -1,9 +1,37 @@
 # Copyright (c) 2024, Navari Limited and Contributors
 # See license.txt
 
-# import frappe
+from unittest.mock import patch
+
+import frappe
 from frappe.tests.utils import FrappeTestCase
 
+from frappe_mpsa_payments.frappe_mpsa_payments.api.m_pesa_api import insert_c2b_payment
+from frappe_mpsa_payments.utils.site_config import C2B_NAMING
+
+NAMING_SERIES_PATTERN = r"^MPC2B-\d{2}-\d{2}-\d{6}$"
+
+
+def make_register(transid):
+	return insert_c2b_payment(
+		frappe._dict({"TransID": transid, "TransAmount": 100.0, "BusinessShortCode": "123456"})
+	)
+
 
 class TestMpesaC2BPaymentRegister(FrappeTestCase):
-	pass
+	def test_naming_series_by_default(self):
+		register = make_register(frappe.generate_hash(length=10))
+		self.assertRegex(register.name, NAMING_SERIES_PATTERN)
+
+	def test_transid_naming(self):
+		transid = frappe.generate_hash(length=10)
+		with patch.dict(frappe.local.conf, {C2B_NAMING: "transid"}):
+			register = make_register(f" {transid} ")
+
+		self.assertEqual(register.name, f"MPC2B-{transid.upper()}")
+
+	def test_transid_naming_falls_back_to_the_series(self):
+		with patch.dict(frappe.local.conf, {C2B_NAMING: "transid"}):
+			register = make_register(None)
+
+		self.assertRegex(register.name, NAMING_SERIES_PATTERN)
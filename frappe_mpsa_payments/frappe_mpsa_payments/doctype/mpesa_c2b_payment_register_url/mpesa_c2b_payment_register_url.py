@@ -2,22 +2,35 @@
 # For license information, please see license.txt
 
 from __future__ import unicode_literals
+from functools import partial
+
 import frappe, requests
 from frappe.model.document import Document
 from frappe.utils import get_request_site_address
 from frappe_mpsa_payments.frappe_mpsa_payments.api.m_pesa_api import get_token
+from frappe_mpsa_payments.frappe_mpsa_payments.connectors.session import get_session
+from frappe_mpsa_payments.frappe_mpsa_payments.doctype.mpesa_settings.mpesa_settings_cache import (
+    get_mpesa_settings,
+)
+
+SHORTCODE_MAP_KEY = "mpesa_c2b_shortcode_map"
+# only a safety net, the map is cleared whenever a Register URL changes
+SHORTCODE_MAP_TTL = 60 * 60
+
 
 class MpesaC2BPaymentRegisterURL(Document):
+    def on_update(self):
+        clear_shortcode_map()
+
+    def on_trash(self):
+        clear_shortcode_map()
+
     def validate(self):
         sandbox_url = "https://sandbox.safaricom.co.ke"
         live_url = "https://api.safaricom.co.ke"
-        mpesa_settings = frappe.get_doc("Mpesa Settings", self.mpesa_settings)
-        env = "production" if not mpesa_settings.sandbox else "sandbox"
-        business_shortcode = (
-            mpesa_settings.business_shortcode
-            if env == "production"
-            else mpesa_settings.till_number
-        )
+        mpesa_settings = get_mpesa_settings(self.mpesa_settings)
+        env = mpesa_settings.env
+        business_shortcode = mpesa_settings.shortcode
         if env == "sandbox":
             base_url = sandbox_url
         else:
@@ -25,8 +38,10 @@ class MpesaC2BPaymentRegisterURL(Document):
 
         token = get_token(
             app_key=mpesa_settings.consumer_key,
-            app_secret=mpesa_settings.get_password("consumer_secret"),
+            app_secret=mpesa_settings.consumer_secret,
             base_url=base_url,
+            setting=mpesa_settings.name,
+            env=env,
         )
 
         site_url = get_request_site_address(True)
@@ -52,7 +67,7 @@ class MpesaC2BPaymentRegisterURL(Document):
         }
 
         try:
-            r = requests.post(register_url, headers=headers, json=payload)
+            r = get_session().post(register_url, headers=headers, json=payload)
             r.raise_for_status()  # Raise an HTTPError for bad responses
             res = r.json()
             if res.get("ResponseDescription") == "Success":
@@ -73,3 +88,45 @@ class MpesaC2BPaymentRegisterURL(Document):
         except requests.exceptions.RequestException as err:
             # Handle other exceptions
             frappe.msgprint(f"Request Exception: {err}")
+
+
+def get_shortcode_details(business_shortcode):
+    """Return the company and mode of payment registered for a business shortcode, if any."""
+    return get_shortcode_map().get(str(business_shortcode or "").strip())
+
+
+def get_shortcode_map():
+    """Map every successfully registered business shortcode to its company and mode of payment.
+
+    The map is built once and kept in Redis until a Register URL record change is
+    committed, so callback inserts don't query for it.
+    """
+    cache = frappe.cache()
+    shortcode_map = cache.get_value(SHORTCODE_MAP_KEY)
+    if shortcode_map is None:
+        shortcode_map = build_shortcode_map()
+        cache.set_value(SHORTCODE_MAP_KEY, shortcode_map, expires_in_sec=SHORTCODE_MAP_TTL)
+    return shortcode_map
+
+
+def build_shortcode_map():
+    register_urls = frappe.get_all(
+        "Mpesa C2B Payment Register URL",
+        filters={"register_status": "Success"},
+        fields=["business_shortcode", "company", "mode_of_payment"],
+        order_by="creation asc",
+    )
+
+    shortcode_map = {}
+    for register_url in register_urls:
+        if register_url.business_shortcode:
+            shortcode_map.setdefault(
+                register_url.business_shortcode.strip(),
+                {"company": register_url.company, "mode_of_payment": register_url.mode_of_payment},
+            )
+    return shortcode_map
+
+
+def clear_shortcode_map():
+    # cleared any earlier, a callback could rebuild the map from the old rows
+    frappe.db.after_commit.add(partial(frappe.cache().delete_value, SHORTCODE_MAP_KEY))
@@ -4,10 +4,10 @@
 import frappe
 import unittest
 from unittest.mock import patch, Mock
+from frappe.tests.utils import FrappeTestCase
 from frappe.utils import get_request_site_address
 from frappe_mpsa_payments.frappe_mpsa_payments.api.m_pesa_api import get_token
-from frappe_mpsa_payments.frappe_mpsa_payments.doctype.mpesa_settings.test_mpesa_settings import TestMpesaSettings
-from frappe_mpsa_payments.frappe_mpsa_payments.doctype.mpesa_c2b_payment_register_url.mpesa_c2b_payment_register_url import MpesaC2BPaymentRegisterURL
+from frappe_mpsa_payments.frappe_mpsa_payments.doctype.mpesa_c2b_payment_register_url.mpesa_c2b_payment_register_url import MpesaC2BPaymentRegisterURL, get_shortcode_details
 
 
 def create_mpesa_setting_doc():
@@ -38,7 +38,7 @@ def create_mpesa_c2b_payment_register_url_doc():
 		mpesa_c2b_payment_register_url.company = "Pharma Express du 30 juin"
 		mpesa_c2b_payment_register_url.save()
 	
-class TestMpesaC2BPaymentRegisterURL(TestMpesaSettings):
+class TestMpesaC2BPaymentRegisterURL(FrappeTestCase):
 	def setUp(self):
 		create_mpesa_setting_doc()
 		create_mpesa_c2b_payment_register_url_doc()
@@ -49,7 +49,7 @@ class TestMpesaC2BPaymentRegisterURL(TestMpesaSettings):
 		if mpesa_settings_doc:
 			frappe.delete_doc("Mpesa C2B Payment Register URL", "Test Mpesa Settings")
 
-	@patch('requests.post')
+	@patch('requests.Session.post')
 	def test_validate_success(self, mock_post):
 		mock_post.return_value = Mock(status_code=200)
 		mock_post.return_value.json.return_value = {
@@ -60,7 +60,7 @@ class TestMpesaC2BPaymentRegisterURL(TestMpesaSettings):
 
 		self.assertEqual(mpesa.register_status, "Success")
 
-	@patch('requests.post')
+	@patch('requests.Session.post')
 	def test_validate_failure(self, mock_post):
 		mock_post.return_value = Mock(status_code=200)
 		mock_post.return_value.json.return_value = {
@@ -71,7 +71,7 @@ class TestMpesaC2BPaymentRegisterURL(TestMpesaSettings):
 
 		self.assertEqual(mpesa.register_status, "Failed")
 
-	@patch('requests.post')
+	@patch('requests.Session.post')
 	def test_validate_http_error(self, mock_post):
 		mock_post.side_effect = Exception("HTTP Error")
 
@@ -81,7 +81,7 @@ class TestMpesaC2BPaymentRegisterURL(TestMpesaSettings):
 		self.assertEqual(mpesa.register_status, "Failed")
 		
 
-	@patch('requests.post')
+	@patch('requests.Session.post')
 	def test_validate_connection_error(self, mock_post):
 		mock_post.side_effect = ConnectionError("Connection Error")
 
@@ -91,3 +91,21 @@ class TestMpesaC2BPaymentRegisterURL(TestMpesaSettings):
 		self.assertEqual(mpesa.register_status, "Failed")
 
 	
+
+	@patch('requests.Session.post')
+	def test_shortcode_details_follow_register_url_changes(self, mock_post):
+		mock_post.return_value = Mock(status_code=200)
+		mock_post.return_value.json.return_value = {
+			"ResponseDescription": "Success"
+		}
+		mpesa=frappe.get_doc("Mpesa C2B Payment Register URL","Test Mpesa Settings")
+		mpesa.mode_of_payment = "Cash"
+		mpesa.save()
+		# the map is cleared once the change is committed
+		frappe.db.after_commit.run()
+		self.assertEqual(get_shortcode_details("123456")["mode_of_payment"], "Cash")
+
+		mpesa.mode_of_payment = "Wire Transfer"
+		mpesa.save()
+		frappe.db.after_commit.run()
+		self.assertEqual(get_shortcode_details("123456")["mode_of_payment"], "Wire Transfer")
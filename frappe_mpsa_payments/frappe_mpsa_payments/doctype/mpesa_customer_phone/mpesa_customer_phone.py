@@ -0,0 +1,91 @@
+# Copyright (c) 2026, Navari Limited and contributors
+# For license information, please see license.txt
+
+from functools import partial
+
+import frappe
+from frappe.model.document import Document
+
+from frappe_mpsa_payments.frappe_mpsa_payments.doctype.mpesa_settings.mpesa_settings import (
+    normalize_mobile_number,
+)
+
+CUSTOMER_PHONE_KEY = "mpesa_customer_phone"
+
+
+class MpesaCustomerPhone(Document):
+    pass
+
+
+def get_customer_by_phone(phone):
+    """Return the customer a phone number belongs to, None if it is unknown or shared.
+
+    Lookups go to a Redis hash keyed by the canonical number, the index table is only
+    queried the first time a number is seen after it changed.
+    """
+    phone = normalize_mobile_number(phone)
+    if not phone:
+        return None
+
+    return frappe.cache().hget(CUSTOMER_PHONE_KEY, phone, generator=partial(find_customer, phone)) or None
+
+
+def find_customer(phone):
+    customers = frappe.get_all(
+        "Mpesa Customer Phone", filters={"phone": phone}, pluck="customer", distinct=True
+    )
+    # a number shared by several customers is not attributed to any of them
+    return customers[0] if len(customers) == 1 else ""
+
+
+def sync_customer_phones(source_doctype, source_name, phones_by_customer):
+    """Replace the index rows of a Customer or Contact with its current phone numbers."""
+    filters = {"source_doctype": source_doctype, "source_name": source_name}
+    changed = set(frappe.get_all("Mpesa Customer Phone", filters=filters, pluck="phone"))
+    frappe.db.delete("Mpesa Customer Phone", filters)
+
+    for customer, phones in phones_by_customer.items():
+        for phone in {normalize_mobile_number(number) for number in phones} - {None}:
+            frappe.get_doc(
+                {
+                    "doctype": "Mpesa Customer Phone",
+                    "phone": phone,
+                    "customer": customer,
+                    "source_doctype": source_doctype,
+                    "source_name": source_name,
+                }
+            ).insert(ignore_permissions=True)
+            changed.add(phone)
+
+    clear_customer_phones(changed)
+
+
+def clear_customer_phones(phones):
+    if phones:
+        frappe.db.after_commit.add(partial(frappe.cache().hdel, CUSTOMER_PHONE_KEY, list(phones)))
+
+
+def on_customer_update(doc, method=None):
+    sync_customer_phones("Customer", doc.name, {doc.name: [doc.mobile_no]})
+
+
+def on_customer_trash(doc, method=None):
+    # contacts lose their links to the customer without being saved
+    phones = frappe.get_all("Mpesa Customer Phone", filters={"customer": doc.name}, pluck="phone")
+    frappe.db.delete("Mpesa Customer Phone", {"customer": doc.name})
+    clear_customer_phones(set(phones))
+
+
+def on_customer_rename(doc, method=None, old=None, new=None, merge=False):
+    # index rows follow the rename through their Customer link, cached names don't
+    frappe.db.after_commit.add(partial(frappe.cache().delete_value, CUSTOMER_PHONE_KEY))
+
+
+def on_contact_update(doc, method=None):
+    phones = [doc.mobile_no, doc.phone] + [row.phone for row in doc.phone_nos]
+    customers = {link.link_name for link in doc.links if link.link_doctype == "Customer"}
+    sync_customer_phones("Contact", doc.name, {customer: phones for customer in customers})
+
+
+def on_contact_trash(doc, method=None):
+    sync_customer_phones("Contact", doc.name, {})
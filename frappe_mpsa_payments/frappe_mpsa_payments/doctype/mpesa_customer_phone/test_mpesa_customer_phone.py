@@ -0,0 +1,39 @@
+# Copyright (c) 2026, Navari Limited and Contributors
+# See license.txt
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from frappe_mpsa_payments.frappe_mpsa_payments.doctype.mpesa_customer_phone.mpesa_customer_phone import (
+    CUSTOMER_PHONE_KEY,
+    get_customer_by_phone,
+    sync_customer_phones,
+)
+from frappe_mpsa_payments.frappe_mpsa_payments.doctype.mpesa_settings.mpesa_settings import (
+    normalize_mobile_number,
+)
+
+
+class TestMpesaCustomerPhone(FrappeTestCase):
+    def setUp(self):
+        frappe.cache().delete_value(CUSTOMER_PHONE_KEY)
+
+    def test_normalize_mobile_number(self):
+        for number in ("0712345678", "712345678", "+254 712 345 678", "254-712-345678"):
+            self.assertEqual(normalize_mobile_number(number), "254712345678")
+        self.assertEqual(normalize_mobile_number("0110345678"), "254110345678")
+
+        for number in (None, "", "2547 ***** 678", "020 1234567", "07123456789"):
+            self.assertIsNone(normalize_mobile_number(number))
+
+    def test_get_customer_by_phone(self):
+        sync_customer_phones("Customer", "_Test Customer", {"_Test Customer": ["0712000001", "0712000002"]})
+        sync_customer_phones("Customer", "_Test Customer 1", {"_Test Customer 1": ["+254712000002"]})
+
+        self.assertEqual(get_customer_by_phone("254712000001"), "_Test Customer")
+        # shared by two customers
+        self.assertIsNone(get_customer_by_phone("0712000002"))
+        self.assertIsNone(get_customer_by_phone("0712000003"))
+
+        sync_customer_phones("Customer", "_Test Customer", {})
+        self.assertFalse(frappe.db.exists("Mpesa Customer Phone", {"source_name": "_Test Customer"}))
@@ -0,0 +1,8 @@
+// Copyright (c) 2026, Navari Limited and contributors
+// For license information, please see license.txt
+
+// frappe.ui.form.on("Mpesa Reconciliation Run", {
+// 	refresh(frm) {
+
+// 	},
+// });
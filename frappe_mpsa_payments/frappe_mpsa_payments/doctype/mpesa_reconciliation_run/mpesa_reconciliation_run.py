@@ -0,0 +1,224 @@
+# Copyright (c) 2026, Navari Limited and contributors
+# For license information, please see license.txt
+
+import time
+
+import frappe
+from frappe import _
+from frappe.model.document import Document
+from frappe.utils import create_batch, now_datetime
+
+from frappe_mpsa_payments.frappe_mpsa_payments.api.payment_entry import (
+    RECONCILIATION_LOCK_KEY,
+    RECONCILIATION_LOCK_LEASE,
+    acquire_reconciliation_lock,
+    create_and_reconcile_payment_reconciliation,
+    release_reconciliation_lock,
+)
+
+# Seconds a job waits on a customer's lock before going back to the queue
+RECONCILIATION_LOCK_WAIT = 60
+RECONCILIATION_LOCK_POLL_INTERVAL = 1
+
+
+class MpesaReconciliationRun(Document):
+    pass
+
+
+@frappe.whitelist()
+def start_reconciliation_run(pairs):
+    """Reconcile many invoice / payment entry pairs in the background.
+
+    `pairs` is a list of [invoice, payment entry] (or dicts with `invoice` and
+    `payment_entry`). They are grouped per customer, and every customer is reconciled
+    by its own job, so customers are spread across the workers of the long queue.
+
+    Returns the name of the Mpesa Reconciliation Run tracking the progress.
+    """
+    frappe.has_permission("Payment Reconciliation", "write", throw=True)
+
+    pairs = [
+        (d.get("invoice"), d.get("payment_entry")) if isinstance(d, dict) else tuple(d)
+        for d in frappe.parse_json(pairs) or []
+    ]
+    if not pairs:
+        frappe.throw(_("No invoice and payment entry pairs to reconcile"))
+
+    customers = {}
+    for batch in create_batch(list({invoice for invoice, _pe in pairs}), 1000):
+        customers.update(
+            frappe.get_all(
+                "Sales Invoice",
+                filters={"name": ["in", batch], "docstatus": 1},
+                fields=["name", "customer"],
+                as_list=True,
+            )
+        )
+
+    run = frappe.new_doc("Mpesa Reconciliation Run")
+    for invoice, payment_entry in pairs:
+        if invoice not in customers:
+            frappe.throw(_("Sales Invoice {0} not found or not submitted").format(invoice))
+        run.append(
+            "items", {"customer": customers[invoice], "invoice": invoice, "payment_entry": payment_entry}
+        )
+
+    run_customers = {item.customer for item in run.items}
+    run.total_pairs = len(run.items)
+    run.total_customers = len(run_customers)
+    run.insert(ignore_permissions=True)
+
+    for customer in run_customers:
+        enqueue_reconcile_customer(run.name, customer)
+
+    return run.name
+
+
+def enqueue_reconcile_customer(run, customer):
+    frappe.enqueue(
+        "frappe_mpsa_payments.frappe_mpsa_payments.doctype.mpesa_reconciliation_run.mpesa_reconciliation_run.reconcile_customer",
+        queue="long",
+        timeout=RECONCILIATION_LOCK_LEASE,
+        enqueue_after_commit=True,
+        run=run,
+        customer=customer,
+    )
+
+
+def reconcile_customer(run, customer):
+    """Reconcile the pending pairs of one customer in a run, holding the customer's lock.
+
+    If another job is reconciling the same customer, this one waits a bounded time for
+    the lock and is then put back in the queue instead of blocking a worker.
+    """
+    if not wait_for_lock(customer):
+        enqueue_reconcile_customer(run, customer)
+        return
+
+    reconciled = failed = 0
+    try:
+        reconciled, failed = reconcile_customer_items(run, customer)
+    except Exception as e:
+        # pairs left pending count as failed, so the run can still complete
+        frappe.db.rollback()
+        reconciled, failed = fail_pending_items(run, customer, str(e))
+        raise
+    finally:
+        release_reconciliation_lock(customer)
+        update_run_progress(run, reconciled, failed)
+        frappe.db.commit()
+
+
+def wait_for_lock(customer):
+    deadline = time.monotonic() + RECONCILIATION_LOCK_WAIT
+    while True:
+        lock = acquire_reconciliation_lock(customer)
+        if lock or time.monotonic() >= deadline:
+            return lock
+        time.sleep(RECONCILIATION_LOCK_POLL_INTERVAL)
+
+
+def fail_pending_items(run, customer, error):
+    """Mark the customer's pending pairs as failed, returning its reconciled and failed counts."""
+    filters = {"parent": run, "parenttype": "Mpesa Reconciliation Run", "customer": customer}
+    frappe.db.set_value(
+        "Mpesa Reconciliation Run Item",
+        {**filters, "status": "Pending"},
+        {"status": "Failed", "error": error},
+        update_modified=False,
+    )
+
+    counts = dict(
+        frappe.get_all(
+            "Mpesa Reconciliation Run Item",
+            filters=filters,
+            fields=["status", "count(name) as count"],
+            group_by="status",
+            as_list=True,
+        )
+    )
+    return counts.get("Reconciled", 0), counts.get("Failed", 0)
+
+
+def reconcile_customer_items(run, customer):
+    items = frappe.get_all(
+        "Mpesa Reconciliation Run Item",
+        filters={"parent": run, "parenttype": "Mpesa Reconciliation Run", "customer": customer, "status": "Pending"},
+        fields=["name", "invoice", "payment_entry"],
+        order_by="idx asc",
+    )
+
+    items_by_invoice = {}
+    for item in items:
+        items_by_invoice.setdefault(item.invoice, []).append(item)
+
+    companies = dict(
+        frappe.get_all(
+            "Sales Invoice",
+            filters={"name": ["in", list(items_by_invoice)]},
+            fields=["name", "company"],
+            as_list=True,
+        )
+    )
+
+    reconciled = failed = 0
+    for invoice, invoice_items in items_by_invoice.items():
+        try:
+            frappe.db.savepoint(RECONCILIATION_LOCK_KEY)
+            create_and_reconcile_payment_reconciliation(
+                invoice,
+                customer,
+                companies.get(invoice),
+                [item.payment_entry for item in invoice_items],
+                commit=False,
+            )
+            status, error = "Reconciled", None
+            reconciled += len(invoice_items)
+        except Exception as e:
+            frappe.db.rollback(save_point=RECONCILIATION_LOCK_KEY)
+            status, error = "Failed", str(e)
+            failed += len(invoice_items)
+        finally:
+            frappe.clear_messages()
+
+        for item in invoice_items:
+            frappe.db.set_value(
+                "Mpesa Reconciliation Run Item",
+                item.name,
+                {"status": status, "error": error},
+                update_modified=False,
+            )
+
+        # one commit per invoice, a failing invoice later on does not undo this one
+        frappe.db.commit()
+
+    return reconciled, failed
+
+
+def update_run_progress(run, reconciled, failed):
+    """Add a customer's results to the run, the last customer to finish completes it."""
+    frappe.db.sql(
+        """
+        update `tabMpesa Reconciliation Run`
+        set processed_customers = processed_customers + 1,
+            reconciled_pairs = reconciled_pairs + %(reconciled)s,
+            failed_pairs = failed_pairs + %(failed)s,
+            status = 'Running'
+        where name = %(run)s
+        """,
+        {"run": run, "reconciled": reconciled, "failed": failed},
+    )
+
+    # the row stays locked by the update above until commit, so only one job sees the end
+    progress = frappe.db.get_value(
+        "Mpesa Reconciliation Run", run, ["processed_customers", "total_customers", "failed_pairs"], as_dict=True
+    )
+    if progress.processed_customers >= progress.total_customers:
+        frappe.db.set_value(
+            "Mpesa Reconciliation Run",
+            run,
+            {
+                "status": "Completed with Errors" if progress.failed_pairs else "Completed",
+                "completed_on": now_datetime(),
+            },
+        )
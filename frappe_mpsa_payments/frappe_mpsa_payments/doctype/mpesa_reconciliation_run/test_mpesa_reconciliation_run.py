@@ -0,0 +1,80 @@
+# Copyright (c) 2026, Navari Limited and Contributors
+# See license.txt
+
+from unittest.mock import patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from frappe_mpsa_payments.frappe_mpsa_payments.doctype.mpesa_reconciliation_run.mpesa_reconciliation_run import (
+    reconcile_customer,
+    start_reconciliation_run,
+)
+from frappe_mpsa_payments.utils.utils import acquire_redis_lock, release_redis_lock
+
+
+class TestMpesaReconciliationRun(FrappeTestCase):
+    def make_run(self, customer="_Test Customer"):
+        run = frappe.get_doc(
+            {
+                "doctype": "Mpesa Reconciliation Run",
+                "total_pairs": 1,
+                "total_customers": 1,
+                "items": [{"customer": customer, "invoice": "_Test Missing Invoice", "payment_entry": "_Test Missing PE"}],
+            }
+        )
+        run.db_insert()
+        for item in run.items:
+            item.db_insert()
+        return run
+
+    @patch("frappe.enqueue")
+    def test_start_reconciliation_run_requires_pairs(self, mock_enqueue):
+        self.assertRaises(frappe.ValidationError, start_reconciliation_run, [])
+        mock_enqueue.assert_not_called()
+
+    def test_failed_pairs_are_recorded(self):
+        run = self.make_run()
+
+        reconcile_customer(run.name, "_Test Customer")
+
+        run.reload()
+        self.assertEqual(run.status, "Completed with Errors")
+        self.assertEqual(run.processed_customers, 1)
+        self.assertEqual(run.failed_pairs, 1)
+        self.assertEqual(run.items[0].status, "Failed")
+
+    # the job's rollback and commits would undo or keep the test's records
+    @patch("frappe.db.commit")
+    @patch("frappe.db.rollback")
+    @patch(
+        "frappe_mpsa_payments.frappe_mpsa_payments.doctype.mpesa_reconciliation_run.mpesa_reconciliation_run.reconcile_customer_items",
+        side_effect=frappe.ValidationError,
+    )
+    def test_failed_customer_completes_the_run(self, mock_reconcile, mock_rollback, mock_commit):
+        run = self.make_run()
+
+        self.assertRaises(frappe.ValidationError, reconcile_customer, run.name, "_Test Customer")
+
+        run.reload()
+        self.assertEqual(run.status, "Completed with Errors")
+        self.assertEqual(run.processed_customers, 1)
+        self.assertEqual(run.failed_pairs, 1)
+        self.assertEqual(run.items[0].status, "Failed")
+
+    @patch(
+        "frappe_mpsa_payments.frappe_mpsa_payments.doctype.mpesa_reconciliation_run.mpesa_reconciliation_run.RECONCILIATION_LOCK_WAIT",
+        0,
+    )
+    @patch("frappe.enqueue")
+    def test_locked_customer_is_requeued(self, mock_enqueue):
+        run = self.make_run()
+        lock = f"mpesa_reconciliation|{run.items[0].customer}"
+        token = acquire_redis_lock(lock, 60)
+        try:
+            reconcile_customer(run.name, "_Test Customer")
+        finally:
+            release_redis_lock(lock, token)
+
+        self.assertEqual(mock_enqueue.call_count, 1)
+        self.assertEqual(frappe.db.get_value("Mpesa Reconciliation Run", run.name, "processed_customers"), 0)
@@ -0,0 +1,127 @@
+import asyncio
+
+import httpx
+
+from ....utils.utils import get_access_token
+from ...connectors.session import get_timeouts
+from .mpesa_connector import AUTHENTICATE_URI, BALANCE_URI, STK_PUSH_URI, MpesaConnector
+
+DEFAULT_MAX_CONNECTIONS = 100
+
+
+class AsyncMpesaConnector(MpesaConnector):
+	"""asyncio counterpart of MpesaConnector for bulk jobs.
+
+	Payloads, headers and the token cache are shared with the sync connector, only the
+	transport differs, so a single worker can keep many Daraja requests in flight:
+
+	        async with AsyncMpesaConnector(env, app_key, app_secret, setting=name) as connector:
+	                responses = await asyncio.gather(*(connector.stk_push(...) for ... in ...))
+	"""
+
+	def __init__(
+		self,
+		env="sandbox",
+		app_key=None,
+		app_secret=None,
+		sandbox_url="https://sandbox.safaricom.co.ke",
+		live_url="https://api.safaricom.co.ke",
+		setting=None,
+		max_connections=DEFAULT_MAX_CONNECTIONS,
+	):
+		# unlike MpesaConnector, authentication is awaited when entering the context
+		self.env = env
+		self.app_key = app_key
+		self.app_secret = app_secret
+		self.setting = setting
+		self.authentication_token = None
+		if env == "sandbox":
+			self.base_url = sandbox_url
+		else:
+			self.base_url = live_url
+
+		connect_timeout, read_timeout = get_timeouts()
+		self.client = httpx.AsyncClient(
+			base_url=self.base_url,
+			limits=httpx.Limits(
+				max_connections=max_connections, max_keepalive_connections=max_connections
+			),
+			timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+		)
+
+	async def __aenter__(self):
+		await self.authenticate()
+		return self
+
+	async def __aexit__(self, *exc_info):
+		await self.aclose()
+
+	async def aclose(self):
+		await self.client.aclose()
+
+	async def authenticate(self):
+		"""Fetch the access token required by Mpesa.
+
+		The token cache read and, on a miss, the shared single-flight refresh (which may
+		wait on another worker's lock) both block, so they run in a thread, off the event loop.
+		"""
+		if self.setting:
+			token = await asyncio.to_thread(
+				get_access_token, self.setting, self.env, self.fetch_access_token
+			)
+		else:
+			token = await self.fetch_access_token_async()
+
+		self.authentication_token = token["access_token"]
+		return self.authentication_token
+
+	async def fetch_access_token_async(self):
+		"""Request a new access token from Mpesa, bypassing the access token cache."""
+		r = await self.client.get(AUTHENTICATE_URI, auth=(self.app_key, self.app_secret))
+		return self.parse_access_token(r.json())
+
+	async def get_balance(
+		self,
+		initiator=None,
+		security_credential=None,
+		party_a=None,
+		identifier_type=None,
+		remarks=None,
+		queue_timeout_url=None,
+		result_url=None,
+	):
+		"""Async version of MpesaConnector.get_balance."""
+		payload = self.get_balance_payload(
+			initiator,
+			security_credential,
+			party_a,
+			identifier_type,
+			remarks,
+			queue_timeout_url,
+			result_url,
+		)
+		r = await self.client.post(BALANCE_URI, headers=self.get_headers(), json=payload)
+		return r.json()
+
+	async def stk_push(
+		self,
+		business_shortcode=None,
+		passcode=None,
+		amount=None,
+		callback_url=None,
+		reference_code=None,
+		phone_number=None,
+		description=None,
+	):
+		"""Async version of MpesaConnector.stk_push."""
+		payload = self.get_stk_push_payload(
+			business_shortcode,
+			passcode,
+			amount,
+			callback_url,
+			reference_code,
+			phone_number,
+			description,
+		)
+		r = await self.client.post(STK_PUSH_URI, headers=self.get_headers(), json=payload)
+		return r.json()
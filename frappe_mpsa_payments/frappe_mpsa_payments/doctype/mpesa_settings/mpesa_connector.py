@@ -1,9 +1,15 @@
 import base64
 import datetime
 
-import requests
 from requests.auth import HTTPBasicAuth
 
+from ....utils.utils import ACCESS_TOKEN_REQUEST_TIMEOUT, get_access_token, save_access_token
+from ...connectors.session import get_session
+
+AUTHENTICATE_URI = "/oauth/v1/generate?grant_type=client_credentials"
+BALANCE_URI = "/mpesa/accountbalance/v1/query"
+STK_PUSH_URI = "/mpesa/stkpush/v1/processrequest"
+
 
 class MpesaConnector:
 	def __init__(
@@ -13,11 +19,17 @@ class MpesaConnector:
 		app_secret=None,
 		sandbox_url="https://sandbox.safaricom.co.ke",
 		live_url="https://api.safaricom.co.ke",
+		setting=None,
 	):
-		"""Setup configuration for Mpesa connector and generate new access token."""
+		"""Setup configuration for Mpesa connector and get an access token.
+
+		When the name of the Mpesa Settings record is passed as `setting`, the token is
+		shared with other workers through the access token cache.
+		"""
 		self.env = env
 		self.app_key = app_key
 		self.app_secret = app_secret
+		self.setting = setting
 		if env == "sandbox":
 			self.base_url = sandbox_url
 		else:
@@ -31,11 +43,23 @@ class MpesaConnector:
 		Returns:
 		        access_token (str): This token is to be used with the Bearer header for further API calls to Mpesa.
 		"""
-		authenticate_uri = "/oauth/v1/generate?grant_type=client_credentials"
-		authenticate_url = f"{self.base_url}{authenticate_uri}"
-		r = requests.get(authenticate_url, auth=HTTPBasicAuth(self.app_key, self.app_secret))
-		self.authentication_token = r.json()["access_token"]
-		return r.json()["access_token"]
+		if self.setting:
+			token = get_access_token(self.setting, self.env, self.fetch_access_token)
+		else:
+			token = self.fetch_access_token()
+
+		self.authentication_token = token["access_token"]
+		return self.authentication_token
+
+	def fetch_access_token(self):
+		"""Request a new access token from Mpesa, bypassing the access token cache."""
+		authenticate_url = f"{self.base_url}{AUTHENTICATE_URI}"
+		r = get_session().get(
+			authenticate_url,
+			auth=HTTPBasicAuth(self.app_key, self.app_secret),
+			timeout=ACCESS_TOKEN_REQUEST_TIMEOUT,
+		)
+		return self.parse_access_token(r.json())
 
 	def get_balance(
 		self,
@@ -66,22 +90,17 @@ class MpesaConnector:
 		        ResponseDescription (str): Response Description message
 		"""
 
-		payload = {
-			"Initiator": initiator,
-			"SecurityCredential": security_credential,
-			"CommandID": "AccountBalance",
-			"PartyA": party_a,
-			"IdentifierType": identifier_type,
-			"Remarks": remarks,
-			"QueueTimeOutURL": queue_timeout_url,
-			"ResultURL": result_url,
-		}
-		headers = {
-			"Authorization": f"Bearer {self.authentication_token}",
-			"Content-Type": "application/json",
-		}
-		saf_url = "{}{}".format(self.base_url, "/mpesa/accountbalance/v1/query")
-		r = requests.post(saf_url, headers=headers, json=payload)
+		payload = self.get_balance_payload(
+			initiator,
+			security_credential,
+			party_a,
+			identifier_type,
+			remarks,
+			queue_timeout_url,
+			result_url,
+		)
+		saf_url = "{}{}".format(self.base_url, BALANCE_URI)
+		r = get_session().post(saf_url, headers=self.get_headers(), json=payload)
 		return r.json()
 
 	def stk_push(
@@ -119,12 +138,83 @@ class MpesaConnector:
 		        errorMessage(str): This is a predefined code that indicates the reason for request failure.
 		"""
 
+		payload = self.get_stk_push_payload(
+			business_shortcode,
+			passcode,
+			amount,
+			callback_url,
+			reference_code,
+			phone_number,
+			description,
+		)
+		saf_url = "{}{}".format(self.base_url, STK_PUSH_URI)
+		r = get_session().post(saf_url, headers=self.get_headers(), json=payload)
+		return r.json()
+
+	def get_headers(self):
+		return {
+			"Authorization": f"Bearer {self.authentication_token}",
+			"Content-Type": "application/json",
+		}
+
+	def parse_access_token(self, response):
+		"""Build the token details from an OAuth response and share them through the token cache."""
+		fetch_time = datetime.datetime.now()
+		token = {
+			"access_token": response["access_token"],
+			"expires_in": fetch_time + datetime.timedelta(seconds=int(response.get("expires_in") or 0)),
+			"fetched_time": fetch_time,
+		}
+		self.authentication_token = token["access_token"]
+
+		if self.setting:
+			save_access_token(
+				token=token["access_token"],
+				expiry_time=token["expires_in"],
+				fetch_time=fetch_time,
+				associated_setting=self.setting,
+				env=self.env,
+			)
+
+		return token
+
+	def get_balance_payload(
+		self,
+		initiator,
+		security_credential,
+		party_a,
+		identifier_type,
+		remarks,
+		queue_timeout_url,
+		result_url,
+	):
+		return {
+			"Initiator": initiator,
+			"SecurityCredential": security_credential,
+			"CommandID": "AccountBalance",
+			"PartyA": party_a,
+			"IdentifierType": identifier_type,
+			"Remarks": remarks,
+			"QueueTimeOutURL": queue_timeout_url,
+			"ResultURL": result_url,
+		}
+
+	def get_stk_push_payload(
+		self,
+		business_shortcode,
+		passcode,
+		amount,
+		callback_url,
+		reference_code,
+		phone_number,
+		description,
+	):
 		time = (
 			str(datetime.datetime.now()).split(".")[0].replace("-", "").replace(" ", "").replace(":", "")
 		)
 		password = f"{str(business_shortcode)}{str(passcode)}{time}"
 		encoded = base64.b64encode(bytes(password, encoding="utf8"))
-		payload = {
+		return {
 			"BusinessShortCode": business_shortcode,
 			"Password": encoded.decode("utf-8"),
 			"Timestamp": time,
@@ -139,11 +229,3 @@ class MpesaConnector:
 			if self.env == "sandbox"
 			else "CustomerBuyGoodsOnline",
 		}
-		headers = {
-			"Authorization": f"Bearer {self.authentication_token}",
-			"Content-Type": "application/json",
-		}
-
-		saf_url = "{}{}".format(self.base_url, "/mpesa/stkpush/v1/processrequest")
-		r = requests.post(saf_url, headers=headers, json=payload)
-		return r.json()
@@ -3,7 +3,11 @@
 
 
 import base64
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from functools import partial
 from json import dumps, loads
+from traceback import format_exception
 from typing import Any
 
 from cryptography.hazmat.backends import default_backend
@@ -15,15 +19,50 @@ import frappe
 from frappe import _, get_single
 from frappe.integrations.utils import create_request_log
 from frappe.model.document import Document
-from frappe.utils import call_hook_method, fmt_money, get_request_site_address
+from frappe.utils import call_hook_method, cint, flt, fmt_money, get_request_site_address
 from frappe.utils.file_manager import get_file_path
 
 from ....utils.doctype_names import PUBLIC_CERTIFICATES_DOCTYPE
+from ....utils.site_config import STK_PUSH_WORKERS
 from ....utils.utils import erpnext_app_import_guard
 from .mpesa_connector import MpesaConnector
+from .mpesa_settings_cache import get_mpesa_settings, invalidate_mpesa_settings
 from .mpesa_custom_fields import create_custom_pos_fields
 
 
+DEFAULT_STK_PUSH_WORKERS = 4
+STK_PAYMENTS_KEY = "mpesa_stk_payments"
+# kept while a customer may still be paying the reference in chunks
+STK_PAYMENTS_TTL = 24 * 60 * 60
+
+# Add a completed STK callback to the running aggregate of its reference, once per
+# checkout id. A missing aggregate is only created when the call carries the seed (the
+# callbacks completed before), otherwise false is returned so the caller can build it.
+# KEYS[1]: aggregate, ARGV: ttl, checkout id, amount, receipt[, "seed", checkout id, amount, receipt, ...]
+ADD_STK_PAYMENT_SCRIPT = """
+local key = KEYS[1]
+local function add(checkout_id, amount, receipt)
+    if redis.call("hsetnx", key, "checkout:" .. checkout_id, amount) == 1 then
+        redis.call("hincrbyfloat", key, "total", amount)
+        local receipts = redis.call("hget", key, "receipts")
+        redis.call("hset", key, "receipts", receipts and (receipts .. ", " .. receipt) or receipt)
+    end
+end
+
+if redis.call("exists", key) == 0 then
+    if ARGV[5] ~= "seed" then
+        return false
+    end
+    for i = 6, #ARGV, 3 do
+        add(ARGV[i], ARGV[i + 1], ARGV[i + 2])
+    end
+end
+add(ARGV[2], ARGV[3], ARGV[4])
+redis.call("expire", key, ARGV[1])
+return {redis.call("hget", key, "total"), redis.call("hget", key, "receipts")}
+"""
+
+
 class MpesaSettings(Document):
     supported_currencies = ["KES"]
 
@@ -64,7 +103,12 @@ class MpesaSettings(Document):
 
     def on_update(self) -> None:
         """On Update Hook"""
-        from ....utils.utils import create_payment_gateway
+        from ....utils.utils import clear_access_tokens, create_payment_gateway
+
+        # credentials or environment may have changed, tokens fetched until the
+        # change is committed would still be made with the old ones
+        frappe.db.after_commit.add(partial(clear_access_tokens, self.name))
+        invalidate_mpesa_settings(self.name)
 
         if "erpnext" in frappe.get_installed_apps():
             create_custom_pos_fields()
@@ -86,20 +130,42 @@ class MpesaSettings(Document):
             "Mpesa-" + self.payment_gateway_name, payment_type="Phone"
         )
 
+    def on_trash(self) -> None:
+        invalidate_mpesa_settings(self.name)
+
     def request_for_payment(self, **kwargs) -> None:
         args = frappe._dict(kwargs)
         request_amounts = self.split_request_amount_according_to_transaction_limit(args)
 
-        for i, amount in enumerate(request_amounts):
-            args.request_amount = amount
-            if frappe.flags.in_test:
-                from .test_mpesa_settings import get_payment_request_response_payload
+        if frappe.flags.in_test:
+            from .test_mpesa_settings import get_payment_request_response_payload
+
+            responses = [
+                get_payment_request_response_payload(amount) for amount in request_amounts
+            ]
+        else:
+            responses = generate_stk_pushes(args, request_amounts)
+
+        # log every chunk's Integration Request before raising the first error, so that
+        # callbacks for pushes that did go out can still be matched
+        errors = []
+        for amount, response in zip(request_amounts, responses):
+            if isinstance(response, Exception):
+                errors.append(response)
+                continue
 
-                response = frappe._dict(get_payment_request_response_payload(amount))
-            else:
-                response = frappe._dict(generate_stk_push(**args))
+            args.request_amount = amount
+            try:
+                self.handle_api_response(
+                    "CheckoutRequestID", args, frappe._dict(response)
+                )
+            except frappe.ValidationError as e:
+                errors.append(e)
 
-            self.handle_api_response("CheckoutRequestID", args, response)
+        if errors:
+            if isinstance(errors[0], frappe.ValidationError):
+                raise errors[0]
+            throw_stk_push_error()
 
     def split_request_amount_according_to_transaction_limit(
         self, args: frappe._dict
@@ -163,50 +229,91 @@ class MpesaSettings(Document):
 def generate_stk_push(**kwargs) -> str | Any:
     """Generate stk push by making a API call to the stk push API."""
     args = frappe._dict(kwargs)
+    response = generate_stk_pushes(args, [args.request_amount])[0]
+    if isinstance(response, Exception):
+        throw_stk_push_error()
+    return response
+
 
+def generate_stk_pushes(args: frappe._dict, request_amounts: list) -> list:
+    """Send one stk push per amount, concurrently, through a single connector and token.
+
+    Responses are returned in the order of `request_amounts`. A push that failed is
+    returned as its exception, so that the Integration Requests of the pushes that did
+    reach the customer's phone can still be created before raising.
+    """
     try:
         callback_url = (
             get_request_site_address(True)
             + "/api/method/payments.payment_gateways.doctype.mpesa_settings.mpesa_settings.verify_transaction"
         )
 
-        mpesa_settings = frappe.get_doc("Mpesa Settings", args.payment_gateway[6:])
-        env = "production" if not mpesa_settings.sandbox else "sandbox"
-        # for sandbox, business shortcode is same as till number
-        business_shortcode = (
-            mpesa_settings.business_shortcode
-            if env == "production"
-            else mpesa_settings.till_number
-        )
+        mpesa_settings = get_mpesa_settings(args.payment_gateway[6:])
 
         connector = MpesaConnector(
-            env=env,
+            env=mpesa_settings.env,
             app_key=mpesa_settings.consumer_key,
-            app_secret=mpesa_settings.get_password("consumer_secret"),
+            app_secret=mpesa_settings.consumer_secret,
+            setting=mpesa_settings.name,
         )
 
-        mobile_number = sanitize_mobile_number(args.sender)
-
-        response = connector.stk_push(
-            business_shortcode=business_shortcode,
-            amount=args.request_amount,
-            passcode=mpesa_settings.get_password("online_passkey"),
+        stk_push_args = dict(
+            business_shortcode=mpesa_settings.shortcode,
+            passcode=mpesa_settings.online_passkey,
             callback_url=callback_url,
             reference_code=mpesa_settings.till_number,
-            phone_number=mobile_number,
+            phone_number=sanitize_mobile_number(args.sender),
             description="POS Payment",
         )
-
-        return response
-
     except Exception:
         frappe.log_error("Mpesa Express Transaction Error")
-        frappe.throw(
-            _(
-                "Issue detected with Mpesa configuration, check the error logs for more details"
-            ),
-            title=_("Mpesa Express Error"),
-        )
+        throw_stk_push_error()
+
+    workers = cint(frappe.conf.get(STK_PUSH_WORKERS)) or DEFAULT_STK_PUSH_WORKERS
+    with ThreadPoolExecutor(max_workers=min(workers, len(request_amounts))) as executor:
+        # each thread runs in a copy of the request context, for frappe.local lookups
+        futures = [
+            executor.submit(
+                copy_context().run,
+                connector.stk_push,
+                amount=amount,
+                **stk_push_args,
+            )
+            for amount in request_amounts
+        ]
+
+    responses = []
+    for future in futures:
+        error = future.exception()
+        if error:
+            # logged from this thread, the database connection is not shared with the workers
+            frappe.log_error(
+                title="Mpesa Express Transaction Error",
+                message="".join(format_exception(type(error), error, error.__traceback__)),
+            )
+        responses.append(error or future.result())
+    return responses
+
+
+def throw_stk_push_error() -> None:
+    frappe.throw(
+        _(
+            "Issue detected with Mpesa configuration, check the error logs for more details"
+        ),
+        title=_("Mpesa Express Error"),
+    )
+
+
+def refresh_access_token(setting: str) -> None:
+    """Fetch a new access token for the Mpesa Settings record ahead of the cached one expiring."""
+    mpesa_settings = get_mpesa_settings(setting)
+    connector = MpesaConnector(
+        env=mpesa_settings.env,
+        app_key=mpesa_settings.consumer_key,
+        app_secret=mpesa_settings.consumer_secret,
+        setting=mpesa_settings.name,
+    )
+    connector.fetch_access_token()
 
 
 def sanitize_mobile_number(number: str) -> str:
@@ -214,6 +321,21 @@ def sanitize_mobile_number(number: str) -> str:
     return "254" + str(number).lstrip("0")
 
 
+def normalize_mobile_number(number: str | None) -> str | None:
+    """Return a Kenyan mobile number in the canonical 2547XXXXXXXX / 2541XXXXXXXX form.
+
+    Accepts the formats found in callbacks and contacts (07.., 7.., +254 7.., 254-7..),
+    returns None for anything that is not a Kenyan mobile number, e.g. a masked MSISDN.
+    """
+    digits = "".join(char for char in str(number or "") if char.isdigit())
+    if not digits.startswith("254"):
+        digits = sanitize_mobile_number(digits)
+
+    if len(digits) != 12 or digits[3] not in "17":
+        return None
+    return digits
+
+
 @frappe.whitelist(allow_guest=True)
 def verify_transaction(**kwargs) -> None:
     """Verify the transaction result received via callback from stk."""
@@ -244,17 +366,14 @@ def verify_transaction(**kwargs) -> None:
                     integration_request.reference_docname,
                 )
 
-                mpesa_receipts, completed_payments = (
-                    get_completed_integration_requests_info(
-                        integration_request.reference_doctype,
-                        integration_request.reference_docname,
-                        checkout_id,
-                    )
+                total_paid, mpesa_receipts = add_stk_payment(
+                    integration_request.reference_doctype,
+                    integration_request.reference_docname,
+                    checkout_id,
+                    amount,
+                    mpesa_receipt,
                 )
 
-                total_paid = amount + sum(completed_payments)
-                mpesa_receipts = ", ".join(mpesa_receipts + [mpesa_receipt])
-
                 if total_paid >= pr.grand_total:
                     pr.run_method("on_payment_authorized", "Completed")
                     success = True
@@ -267,6 +386,11 @@ def verify_transaction(**kwargs) -> None:
                 )
                 integration_request.handle_success(transaction_response)
             except Exception:
+                # this callback may already be counted, rebuild the aggregate next time
+                clear_stk_payments(
+                    integration_request.reference_doctype,
+                    integration_request.reference_docname,
+                )
                 integration_request.handle_failure(transaction_response)
                 frappe.log_error("Mpesa: Failed to verify transaction")
 
@@ -290,9 +414,51 @@ def verify_transaction(**kwargs) -> None:
     )
 
 
-def get_completed_integration_requests_info(
+def add_stk_payment(
+    reference_doctype: str,
+    reference_docname: str,
+    checkout_id: str,
+    amount: float,
+    mpesa_receipt: str,
+) -> tuple[float, str]:
+    """Count a completed STK callback towards its reference, once per checkout id.
+
+    The total paid and the receipts of a reference are kept as a running aggregate in
+    Redis, so a callback does the same work however many chunks were paid before it.
+    The aggregate is seeded from the completed Integration Requests the first time a
+    reference is seen, and dropped if the transaction is rolled back.
+
+    Returns the total paid and the comma separated receipts, this callback included.
+    """
+    cache = frappe.cache()
+    key = cache.make_key(get_stk_payments_key(reference_doctype, reference_docname))
+    args = [STK_PAYMENTS_TTL, checkout_id, flt(amount), mpesa_receipt]
+
+    result = cache.eval(ADD_STK_PAYMENT_SCRIPT, 1, key, *args)
+    if result is None:
+        seed = ["seed"]
+        for payment in get_completed_stk_payments(reference_doctype, reference_docname, checkout_id):
+            seed.extend([payment.checkout_id, flt(payment.amount), payment.mpesa_receipt])
+        result = cache.eval(ADD_STK_PAYMENT_SCRIPT, 1, key, *args, *seed)
+
+    frappe.db.after_rollback.add(partial(clear_stk_payments, reference_doctype, reference_docname))
+
+    total_paid, mpesa_receipts = (frappe.safe_decode(value) for value in result)
+    return flt(total_paid), mpesa_receipts
+
+
+def get_stk_payments_key(reference_doctype: str, reference_docname: str) -> str:
+    return f"{STK_PAYMENTS_KEY}|{reference_doctype}|{reference_docname}"
+
+
+def clear_stk_payments(reference_doctype: str, reference_docname: str) -> None:
+    frappe.cache().delete_value(get_stk_payments_key(reference_doctype, reference_docname))
+
+
+def get_completed_stk_payments(
     reference_doctype: str, reference_docname: str, checkout_id: str
-) -> tuple[list, list]:
+) -> list[frappe._dict]:
+    """Amount and receipt of the other completed STK callbacks of a reference, oldest first."""
     output_of_other_completed_requests = frappe.get_all(
         "Integration Request",
         filters={
@@ -301,35 +467,34 @@ def get_completed_integration_requests_info(
             "reference_docname": reference_docname,
             "status": "Completed",
         },
-        pluck="output",
+        fields=["name", "output"],
+        order_by="creation asc",
     )
 
-    mpesa_receipts, completed_payments = [], []
-
-    for out in output_of_other_completed_requests:
-        out = frappe._dict(loads(out))
+    completed_payments = []
+    for request in output_of_other_completed_requests:
+        out = frappe._dict(loads(request.output))
         item_response = out["CallbackMetadata"]["Item"]
-        completed_amount = fetch_param_value(item_response, "Amount", "Name")
-        completed_mpesa_receipt = fetch_param_value(
-            item_response, "MpesaReceiptNumber", "Name"
+        completed_payments.append(
+            frappe._dict(
+                checkout_id=request.name,
+                amount=fetch_param_value(item_response, "Amount", "Name"),
+                mpesa_receipt=fetch_param_value(item_response, "MpesaReceiptNumber", "Name"),
+            )
         )
-        completed_payments.append(completed_amount)
-        mpesa_receipts.append(completed_mpesa_receipt)
 
-    return mpesa_receipts, completed_payments
+    return completed_payments
 
 
 def get_account_balance(request_payload: dict) -> str | dict | None:
     """Call account balance API to send the request to the Mpesa Servers."""
     try:
-        mpesa_settings = frappe.get_doc(
-            "Mpesa Settings", request_payload.get("reference_docname")
-        )
-        env = "production" if not mpesa_settings.sandbox else "sandbox"
+        mpesa_settings = get_mpesa_settings(request_payload.get("reference_docname"))
         connector = MpesaConnector(
-            env=env,
+            env=mpesa_settings.env,
             app_key=mpesa_settings.consumer_key,
-            app_secret=mpesa_settings.get_password("consumer_secret"),
+            app_secret=mpesa_settings.consumer_secret,
+            setting=mpesa_settings.name,
         )
 
         callback_url = (
@@ -0,0 +1,87 @@
+import time
+from functools import partial
+from typing import NamedTuple
+
+import frappe
+from frappe.utils import cint
+
+from ....utils.metrics import increment_metric
+from ....utils.site_config import SETTINGS_CACHE_TTL
+
+SETTINGS_VERSION_KEY = "mpesa_settings_version"
+DEFAULT_SETTINGS_CACHE_TTL = 300
+
+# (site, Mpesa Settings name) -> (snapshot, version, expires at)
+_snapshots: dict[tuple[str, str], tuple["MpesaSettingsSnapshot", int, float]] = {}
+
+
+class MpesaSettingsSnapshot(NamedTuple):
+    """Immutable subset of an Mpesa Settings record needed to call Daraja."""
+
+    name: str
+    env: str
+    consumer_key: str
+    consumer_secret: str
+    online_passkey: str
+    business_shortcode: str | None
+    till_number: str
+    initiator_name: str | None
+    security_credential: str | None
+
+    @property
+    def shortcode(self) -> str:
+        # for sandbox, business shortcode is same as till number
+        return self.business_shortcode if self.env == "production" else self.till_number
+
+
+def get_mpesa_settings(name: str) -> MpesaSettingsSnapshot:
+    """Return the settings snapshot from the worker's memory, loading it on a miss.
+
+    Entries expire after `mpesa_settings_cache_ttl` seconds and are dropped as soon as the
+    record's version key in Redis moves, which `MpesaSettings.on_update` takes care of.
+    """
+    key = (frappe.local.site, name)
+    version = get_settings_version(name)
+
+    cached = _snapshots.get(key)
+    if cached and cached[1] == version and cached[2] > time.monotonic():
+        increment_metric("settings_cache_hits")
+        return cached[0]
+
+    increment_metric("settings_cache_misses")
+    snapshot = load_mpesa_settings(name)
+    ttl = cint(frappe.conf.get(SETTINGS_CACHE_TTL)) or DEFAULT_SETTINGS_CACHE_TTL
+    _snapshots[key] = (snapshot, version, time.monotonic() + ttl)
+    return snapshot
+
+
+def load_mpesa_settings(name: str) -> MpesaSettingsSnapshot:
+    doc = frappe.get_doc("Mpesa Settings", name)
+    return MpesaSettingsSnapshot(
+        name=doc.name,
+        env="production" if not doc.sandbox else "sandbox",
+        consumer_key=doc.consumer_key,
+        consumer_secret=doc.get_password("consumer_secret"),
+        online_passkey=doc.get_password("online_passkey", raise_exception=False),
+        business_shortcode=doc.business_shortcode,
+        till_number=doc.till_number,
+        initiator_name=doc.initiator_name,
+        security_credential=doc.security_credential,
+    )
+
+
+def get_settings_version(name: str) -> int:
+    cache = frappe.cache()
+    return cint(cache.get(cache.make_key(f"{SETTINGS_VERSION_KEY}|{name}")))
+
+
+def invalidate_mpesa_settings(name: str) -> None:
+    """Bump the record's version once the change is committed, so that every worker reloads
+    its snapshot. Bumped any earlier, a worker could load the old record under the new version.
+    """
+    frappe.db.after_commit.add(partial(bump_settings_version, name))
+
+
+def bump_settings_version(name: str) -> None:
+    cache = frappe.cache()
+    cache.incr(cache.make_key(f"{SETTINGS_VERSION_KEY}|{name}"))
@@ -0,0 +1,103 @@
+# Copyright (c) 2024, Navari Limited and Contributors
+# See license.txt
+
+import asyncio
+import json
+import threading
+from unittest.mock import patch
+
+import httpx
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from frappe_mpsa_payments.frappe_mpsa_payments.doctype.mpesa_settings.async_mpesa_connector import (
+	AsyncMpesaConnector,
+)
+from frappe_mpsa_payments.frappe_mpsa_payments.doctype.mpesa_settings.mpesa_connector import (
+	AUTHENTICATE_URI,
+	STK_PUSH_URI,
+)
+from frappe_mpsa_payments.utils.utils import clear_access_tokens, get_cached_access_token
+
+
+def handle_daraja_request(request):
+	if request.url.raw_path.decode() == AUTHENTICATE_URI:
+		return httpx.Response(200, json={"access_token": "fake-token", "expires_in": "3599"})
+
+	if request.url.path == STK_PUSH_URI:
+		payload = json.loads(request.content)
+		return httpx.Response(
+			200,
+			json={
+				"ResponseCode": "0",
+				"CheckoutRequestID": f"ws_CO_{payload['AccountReference']}",
+				"Authorization": request.headers["Authorization"],
+				"Amount": payload["Amount"],
+			},
+		)
+
+	return httpx.Response(404)
+
+
+def make_connector(setting=None):
+	connector = AsyncMpesaConnector(app_key="key", app_secret="secret", setting=setting)
+	connector.client = httpx.AsyncClient(
+		base_url=connector.base_url, transport=httpx.MockTransport(handle_daraja_request)
+	)
+	return connector
+
+
+class TestAsyncMpesaConnector(FrappeTestCase):
+	def setUp(self):
+		self.setting = f"_Test Async Connector {frappe.generate_hash(length=6)}"
+
+	def tearDown(self):
+		clear_access_tokens(self.setting)
+
+	def test_stk_push(self):
+		async def push():
+			async with make_connector() as connector:
+				return await asyncio.gather(
+					*(
+						connector.stk_push(
+							business_shortcode="174379",
+							passcode="passkey",
+							amount=amount,
+							callback_url="https://example.com/callback",
+							reference_code=f"REF{amount}",
+							phone_number="254708374149",
+							description="Test",
+						)
+						for amount in (100, 200)
+					)
+				)
+
+		responses = asyncio.run(push())
+
+		self.assertEqual([r["CheckoutRequestID"] for r in responses], ["ws_CO_REF100", "ws_CO_REF200"])
+		self.assertEqual([r["Amount"] for r in responses], [100, 200])
+		self.assertTrue(all(r["Authorization"] == "Bearer fake-token" for r in responses))
+
+	def test_authenticate_does_not_block_the_event_loop(self):
+		cache_reads = []
+
+		def read_cache(setting, env):
+			cache_reads.append(threading.current_thread())
+			return get_cached_access_token(setting, env)
+
+		async def authenticate():
+			async with make_connector(self.setting) as connector:
+				return connector.authentication_token, threading.current_thread()
+
+		with patch(
+			"frappe_mpsa_payments.utils.utils.get_cached_access_token", side_effect=read_cache
+		), patch(
+			"frappe_mpsa_payments.frappe_mpsa_payments.doctype.mpesa_settings.mpesa_connector.MpesaConnector.fetch_access_token",
+			return_value={"access_token": "fake-token"},
+		):
+			token, loop_thread = asyncio.run(authenticate())
+
+		self.assertEqual(token, "fake-token")
+		self.assertTrue(cache_reads)
+		self.assertNotIn(loop_thread, cache_reads)
@@ -0,0 +1,86 @@
+# Copyright (c) 2024, Navari Limited and Contributors
+# See license.txt
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from frappe_mpsa_payments.frappe_mpsa_payments.doctype.mpesa_settings.mpesa_connector import (
+	MpesaConnector,
+)
+from frappe_mpsa_payments.utils.utils import clear_access_tokens
+
+
+class FakeOAuthHandler(BaseHTTPRequestHandler):
+	token_requests = 0
+	lock = threading.Lock()
+
+	def do_GET(self):
+		with FakeOAuthHandler.lock:
+			FakeOAuthHandler.token_requests += 1
+
+		# keep the request in flight long enough for every caller to miss the cache
+		time.sleep(0.3)
+		body = json.dumps({"access_token": "fake-token", "expires_in": "3599"}).encode()
+		self.send_response(200)
+		self.send_header("Content-Type", "application/json")
+		self.send_header("Content-Length", str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, *args):
+		pass
+
+
+class TestMpesaConnector(FrappeTestCase):
+	def setUp(self):
+		FakeOAuthHandler.token_requests = 0
+		self.server = ThreadingHTTPServer(("127.0.0.1", 0), FakeOAuthHandler)
+		self.server_url = f"http://127.0.0.1:{self.server.server_port}"
+		threading.Thread(target=self.server.serve_forever, daemon=True).start()
+		self.setting = f"_Test Connector {frappe.generate_hash(length=6)}"
+
+	def tearDown(self):
+		self.server.shutdown()
+		self.server.server_close()
+		clear_access_tokens(self.setting)
+
+	def test_concurrent_callers_share_one_token_request(self):
+		callers = 10
+		site, sites_path = frappe.local.site, frappe.local.sites_path
+		barrier = threading.Barrier(callers)
+		tokens = []
+
+		def authenticate():
+			frappe.init(site=site, sites_path=sites_path)
+			try:
+				barrier.wait()
+				connector = MpesaConnector(
+					env="sandbox",
+					app_key="key",
+					app_secret="secret",
+					sandbox_url=self.server_url,
+					setting=self.setting,
+				)
+				tokens.append(connector.authentication_token)
+			finally:
+				frappe.destroy()
+
+		threads = [threading.Thread(target=authenticate) for _ in range(callers)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+
+		self.assertEqual(FakeOAuthHandler.token_requests, 1)
+		self.assertEqual(tokens, ["fake-token"] * callers)
+
+	def test_connector_without_setting_is_not_cached(self):
+		for _ in range(2):
+			MpesaConnector(env="sandbox", app_key="key", app_secret="secret", sandbox_url=self.server_url)
+
+		self.assertEqual(FakeOAuthHandler.token_requests, 2)
@@ -3,6 +3,7 @@
 
 import unittest
 from json import dumps
+from unittest.mock import patch
 
 import frappe
 
@@ -11,11 +12,15 @@ from erpnext.accounts.doctype.pos_invoice.test_pos_invoice import create_pos_inv
 from erpnext.stock.doctype.item.test_item import make_item
 from erpnext.accounts.doctype.pos_profile.test_pos_profile import make_pos_profile
 
-from frappe_mpsa_payment.doctype.mpesa_settings.mpesa_settings import (
+from frappe_mpsa_payments.frappe_mpsa_payments.doctype.mpesa_settings.mpesa_settings import (
+	add_stk_payment,
+	clear_stk_payments,
+	generate_stk_pushes,
 	process_balance_info,
 	verify_transaction,
 )
-from frappe_mpsa_payment.doctype.mpesa_settings.mpesa_settings import create_mode_of_payment
+from frappe_mpsa_payments.frappe_mpsa_payments.doctype.mpesa_settings.mpesa_settings import create_mode_of_payment
+from frappe_mpsa_payments.frappe_mpsa_payments.doctype.mpesa_settings.mpesa_settings_cache import get_mpesa_settings
 
 
 class TestMpesaSettings(unittest.TestCase):
@@ -50,6 +55,20 @@ class TestMpesaSettings(unittest.TestCase):
 		self.assertTrue(mode_of_payment.name)
 		self.assertEqual(mode_of_payment.type, "Phone")
 
+	def test_settings_snapshot_is_reloaded_after_update(self):
+		mpesa_doc = create_mpesa_settings(payment_gateway_name="_Test")
+		snapshot = get_mpesa_settings(mpesa_doc.name)
+		self.assertEqual(snapshot.consumer_secret, "VI1oS3oBGPJfh3JyvLHw")
+		self.assertEqual(snapshot.shortcode, "174379")
+		self.assertIs(get_mpesa_settings(mpesa_doc.name), snapshot)
+
+		mpesa_doc.till_number = "174380"
+		mpesa_doc.save(ignore_permissions=True)
+		# cached snapshots are only invalidated once the change is committed
+		self.assertIs(get_mpesa_settings(mpesa_doc.name), snapshot)
+		frappe.db.after_commit.run()
+		self.assertEqual(get_mpesa_settings(mpesa_doc.name).shortcode, "174380")
+
 	def test_processing_of_account_balance(self):
 		mpesa_doc = create_mpesa_settings(payment_gateway_name="_Account Balance")
 		mpesa_doc.get_account_balance_info()
@@ -292,6 +311,41 @@ class TestMpesaSettings(unittest.TestCase):
 		pr.delete()
 		pos_invoice.delete()
 
+	def test_stk_payments_are_aggregated_once_per_checkout(self):
+		clear_stk_payments("Payment Request", "_Test STK Aggregate")
+
+		self.assertEqual(add_stk_payment("Payment Request", "_Test STK Aggregate", "ws_CO_1", 500, "RCPT1"), (500, "RCPT1"))
+		self.assertEqual(
+			add_stk_payment("Payment Request", "_Test STK Aggregate", "ws_CO_2", 300, "RCPT2"), (800, "RCPT1, RCPT2")
+		)
+		# a repeated callback is not counted twice
+		self.assertEqual(
+			add_stk_payment("Payment Request", "_Test STK Aggregate", "ws_CO_2", 300, "RCPT2"), (800, "RCPT1, RCPT2")
+		)
+
+		# rebuilt from the completed Integration Requests, of which there are none
+		clear_stk_payments("Payment Request", "_Test STK Aggregate")
+		self.assertEqual(add_stk_payment("Payment Request", "_Test STK Aggregate", "ws_CO_3", 200, "RCPT3"), (200, "RCPT3"))
+
+	def test_failed_stk_push_does_not_discard_the_others(self):
+		args = frappe._dict(payment_gateway="Mpesa-_Test", sender="0712345678")
+		response = get_payment_request_response_payload(500)
+
+		def stk_push(amount, **kwargs):
+			# the pushes run concurrently, fail one by its amount rather than by call order
+			if amount == 300:
+				raise ConnectionError("timed out")
+			return response
+
+		connector = "frappe_mpsa_payments.frappe_mpsa_payments.doctype.mpesa_settings.mpesa_connector.MpesaConnector"
+		with patch(f"{connector}.fetch_access_token", return_value={"access_token": "fake-token"}), patch(
+			f"{connector}.stk_push", side_effect=stk_push
+		):
+			responses = generate_stk_pushes(args, [500, 300])
+
+		self.assertEqual(responses[0], response)
+		self.assertIsInstance(responses[1], ConnectionError)
+
 
 def create_mpesa_settings(payment_gateway_name="Express"):
 	if frappe.db.exists("Mpesa Settings", payment_gateway_name):
@@ -85,6 +85,9 @@ app_license = "agpl-3.0"
 # before_install = "frappe_mpsa_payments.install.before_install"
 # after_install = "frappe_mpsa_payments.install.after_install"
 
+after_install = "frappe_mpsa_payments.install.after_install"
+after_migrate = "frappe_mpsa_payments.install.after_migrate"
+
 # Uninstallation
 # ------------
 
@@ -145,6 +148,26 @@ app_license = "agpl-3.0"
 # 	}
 # }
 
+doc_events = {
+	("Company", "Account", "Mode of Payment"): {
+		"on_update": "frappe_mpsa_payments.frappe_mpsa_payments.api.payment_entry.clear_payment_contexts",
+		"on_trash": "frappe_mpsa_payments.frappe_mpsa_payments.api.payment_entry.clear_payment_contexts",
+	},
+	"Payment Ledger Entry": {
+		"on_submit": "frappe_mpsa_payments.frappe_mpsa_payments.api.outstanding_snapshot.on_payment_ledger_entry_change",
+		"on_cancel": "frappe_mpsa_payments.frappe_mpsa_payments.api.outstanding_snapshot.on_payment_ledger_entry_change",
+	},
+	"Customer": {
+		"on_update": "frappe_mpsa_payments.frappe_mpsa_payments.doctype.mpesa_customer_phone.mpesa_customer_phone.on_customer_update",
+		"on_trash": "frappe_mpsa_payments.frappe_mpsa_payments.doctype.mpesa_customer_phone.mpesa_customer_phone.on_customer_trash",
+		"after_rename": "frappe_mpsa_payments.frappe_mpsa_payments.doctype.mpesa_customer_phone.mpesa_customer_phone.on_customer_rename",
+	},
+	"Contact": {
+		"on_update": "frappe_mpsa_payments.frappe_mpsa_payments.doctype.mpesa_customer_phone.mpesa_customer_phone.on_contact_update",
+		"on_trash": "frappe_mpsa_payments.frappe_mpsa_payments.doctype.mpesa_customer_phone.mpesa_customer_phone.on_contact_trash",
+	},
+}
+
 # Scheduled Tasks
 # ---------------
 
@@ -166,6 +189,16 @@ app_license = "agpl-3.0"
 # 	],
 # }
 
+scheduler_events = {
+	"cron": {
+		"* * * * *": [
+			"frappe_mpsa_payments.frappe_mpsa_payments.api.m_pesa_api.process_c2b_ingest_queue",
+			"frappe_mpsa_payments.frappe_mpsa_payments.api.c2b_matching.match_c2b_payments",
+			"frappe_mpsa_payments.frappe_mpsa_payments.api.m_pesa_api.flush_c2b_payment_notifications",
+		],
+	},
+}
+
 # Testing
 # -------
 
@@ -199,6 +232,8 @@ app_license = "agpl-3.0"
 # before_request = ["frappe_mpsa_payments.utils.before_request"]
 # after_request = ["frappe_mpsa_payments.utils.after_request"]
 
+after_request = ["frappe_mpsa_payments.utils.utils.after_request"]
+
 # Job Events
 # ----------
 # before_job = ["frappe_mpsa_payments.utils.before_job"]
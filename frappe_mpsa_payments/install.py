@@ -0,0 +1,18 @@
+import frappe
+
+# serves the unpaid invoice listing of the POS picker (m_pesa_api.get_draft_pos_invoice)
+SALES_INVOICE_INDEX = "docstatus_status_posting_date_index"
+
+
+def after_install():
+    # fresh installs would otherwise only get the indexes on their next migrate
+    add_indexes()
+
+
+def after_migrate():
+    add_indexes()
+
+
+def add_indexes():
+    if frappe.db.table_exists("Sales Invoice"):
+        frappe.db.add_index("Sales Invoice", ["docstatus", "status", "posting_date"], SALES_INVOICE_INDEX)
@@ -0,0 +1,30 @@
+import frappe
+
+from frappe_mpsa_payments.frappe_mpsa_payments.doctype.mpesa_customer_phone.mpesa_customer_phone import (
+    sync_customer_phones,
+)
+
+
+def execute():
+    """Index the phone numbers of existing customers and their contacts."""
+    for customer in frappe.get_all(
+        "Customer", filters={"mobile_no": ["is", "set"]}, fields=["name", "mobile_no"]
+    ):
+        sync_customer_phones("Customer", customer.name, {customer.name: [customer.mobile_no]})
+
+    contacts = {}
+    for link in frappe.get_all(
+        "Dynamic Link",
+        filters={"parenttype": "Contact", "link_doctype": "Customer"},
+        fields=["parent", "link_name"],
+    ):
+        contacts.setdefault(link.parent, set()).add(link.link_name)
+
+    phones = {}
+    for row in frappe.get_all("Contact Phone", filters={"parenttype": "Contact"}, fields=["parent", "phone"]):
+        if row.parent in contacts:
+            phones.setdefault(row.parent, []).append(row.phone)
+
+    for contact, customers in contacts.items():
+        if contact in phones:
+            sync_customer_phones("Contact", contact, {customer: phones[contact] for customer in customers})
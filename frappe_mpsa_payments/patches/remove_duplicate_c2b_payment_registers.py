@@ -0,0 +1,66 @@
+import frappe
+from frappe import _
+
+# submitted registers are kept over drafts, drafts over cancelled ones
+DOCSTATUS_PRIORITY = {1: 0, 0: 1, 2: 2}
+
+
+def execute():
+    """Resolve registers sharing a Trans ID, so that Trans ID can be made unique.
+
+    For every Trans ID that appears more than once the submitted register is kept, or the
+    oldest draft, or the oldest cancelled one. The other drafts are deleted and the Trans
+    ID of the other cancelled registers is suffixed with their name. Trans IDs with more
+    than one submitted register stop the migration, one of them has to be cancelled first.
+    """
+    if not frappe.db.table_exists("Mpesa C2B Payment Register"):
+        return
+
+    duplicates = frappe.db.sql(
+        """
+        select transid
+        from `tabMpesa C2B Payment Register`
+        where ifnull(transid, '') != ''
+        group by transid
+        having count(*) > 1
+        """,
+        pluck=True,
+    )
+
+    resolved = {}
+    conflicts = []
+    for transid in duplicates:
+        registers = frappe.get_all(
+            "Mpesa C2B Payment Register",
+            filters={"transid": transid},
+            fields=["name", "docstatus", "creation"],
+        )
+        registers.sort(key=lambda d: (DOCSTATUS_PRIORITY[d.docstatus], d.creation))
+
+        submitted = [d.name for d in registers if d.docstatus == 1]
+        if len(submitted) > 1:
+            conflicts.append(f"{transid}: {', '.join(submitted)}")
+        resolved[transid] = registers[1:]
+
+    if conflicts:
+        frappe.throw(
+            _(
+                "Trans ID is becoming unique, but these Trans IDs have more than one submitted Mpesa C2B Payment Register. Cancel the duplicates and run the migration again:<br>{0}"
+            ).format("<br>".join(conflicts)),
+            title=_("Duplicate Mpesa C2B Payment Registers"),
+        )
+
+    for transid, extras in resolved.items():
+        drafts = [d.name for d in extras if d.docstatus == 0]
+        if drafts:
+            frappe.db.delete("Mpesa C2B Payment Register", {"name": ("in", drafts)})
+
+        for d in extras:
+            if d.docstatus == 2:
+                frappe.db.set_value(
+                    "Mpesa C2B Payment Register",
+                    d.name,
+                    "transid",
+                    f"{transid}-{d.name}",
+                    update_modified=False,
+                )
@@ -0,0 +1,12 @@
+import frappe
+
+
+def execute():
+    """Backfill the reversed MSISDN used by the draft payments phone number search."""
+    frappe.db.sql(
+        """
+        update `tabMpesa C2B Payment Register`
+        set msisdn_reversed = reverse(trim(msisdn))
+        where ifnull(msisdn, '') != '' and msisdn_reversed is null
+        """
+    )
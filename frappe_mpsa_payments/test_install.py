@@ -0,0 +1,14 @@
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from frappe_mpsa_payments.install import SALES_INVOICE_INDEX, after_install, after_migrate
+
+
+class TestInstall(FrappeTestCase):
+    def test_sales_invoice_index_is_added(self):
+        for hook in (after_install, after_migrate):
+            if frappe.db.has_index("tabSales Invoice", SALES_INVOICE_INDEX):
+                frappe.db.sql_ddl(f"alter table `tabSales Invoice` drop index `{SALES_INVOICE_INDEX}`")
+
+            hook()
+            self.assertTrue(frappe.db.has_index("tabSales Invoice", SALES_INVOICE_INDEX))
@@ -1,4 +1,3 @@
 from typing import Final
 
 PUBLIC_CERTIFICATES_DOCTYPE: Final[str] = "Mpesa Public Key Certificate"
-ACCESS_TOKENS_DOCTYPE: Final[str] = ""
@@ -0,0 +1,21 @@
+import frappe
+
+METRICS_KEY = "mpesa_metrics"
+
+
+def increment_metric(metric: str, amount: int = 1) -> None:
+    """Increment a site-wide counter kept in the Redis cache."""
+    cache = frappe.cache()
+    cache.hincrby(cache.make_key(METRICS_KEY), metric, amount)
+
+
+@frappe.whitelist()
+def get_metrics() -> dict[str, int]:
+    """Return all M-Pesa counters recorded for this site."""
+    frappe.only_for("System Manager")
+
+    cache = frappe.cache()
+    # RedisWrapper.hgetall unpickles values, counters are plain integers
+    counters = cache.execute_command("HGETALL", cache.make_key(METRICS_KEY)) or {}
+
+    return {frappe.safe_decode(k): int(v) for k, v in counters.items()}
@@ -0,0 +1,17 @@
+from typing import Final
+
+# Keys read from the site's site_config.json (`bench --site <site> set-config <key> <value>`)
+
+C2B_ASYNC_INGEST: Final[str] = "mpesa_c2b_async_ingest"
+C2B_INGEST_BATCH_SIZE: Final[str] = "mpesa_c2b_ingest_batch_size"
+C2B_SEEN_TTL: Final[str] = "mpesa_c2b_seen_ttl"
+C2B_NAMING: Final[str] = "mpesa_c2b_naming"
+HTTP_POOL_SIZE: Final[str] = "mpesa_http_pool_size"
+HTTP_CONNECT_TIMEOUT: Final[str] = "mpesa_http_connect_timeout"
+HTTP_READ_TIMEOUT: Final[str] = "mpesa_http_read_timeout"
+STK_PUSH_WORKERS: Final[str] = "mpesa_stk_push_workers"
+SETTINGS_CACHE_TTL: Final[str] = "mpesa_settings_cache_ttl"
+PAYMENT_CONTEXT_TTL: Final[str] = "mpesa_payment_context_ttl"
+OUTSTANDING_SNAPSHOT_TTL: Final[str] = "mpesa_outstanding_snapshot_ttl"
+C2B_AUTO_MATCH: Final[str] = "mpesa_c2b_auto_match"
+C2B_AUTO_MATCH_BATCH_SIZE: Final[str] = "mpesa_c2b_auto_match_batch_size"
@@ -1,12 +1,11 @@
+import time
 from contextlib import contextmanager
 from datetime import datetime
-from typing import Generator
+from typing import Callable, Generator
 
 import frappe
 from frappe import _
 
-from .doctype_names import ACCESS_TOKENS_DOCTYPE
-
 
 def create_payment_gateway(
     gateway: str, settings: str | None = None, controller: str | None = None
@@ -39,28 +38,128 @@ def erpnext_app_import_guard() -> Generator:
         frappe.throw(msg, title=_("Missing ERPNext App"))
 
 
+ACCESS_TOKEN_KEY = "mpesa_access_token"
+# Tokens are no longer handed out this many seconds before Daraja expires them
+ACCESS_TOKEN_EXPIRY_MARGIN = 60
+# Within this many seconds of the margin a background refresh is scheduled
+ACCESS_TOKEN_REFRESH_WINDOW = 300
+# Seconds a caller may hold the token refresh lock, and how often waiters poll the cache
+ACCESS_TOKEN_LOCK_LEASE = 10
+ACCESS_TOKEN_LOCK_POLL_INTERVAL = 0.1
+# (connect, read) timeouts of token requests, they give up before the lock lease runs out
+ACCESS_TOKEN_REQUEST_TIMEOUT = (3, 6)
+
+# Delete the lock only if it still holds our token
+RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+
+def get_access_token_key(setting: str, env: str) -> str:
+    return f"{ACCESS_TOKEN_KEY}|{setting}|{env}"
+
+
 def save_access_token(
     token: str,
-    expiry_time: str | datetime,
-    fetch_time: str | datetime,
+    expiry_time: datetime,
+    fetch_time: datetime,
     associated_setting: str,
-    doctype: str = ACCESS_TOKENS_DOCTYPE,
+    env: str,
 ) -> bool:
-    doc = frappe.new_doc(doctype)
+    """Share a freshly fetched Daraja access token with all workers through the Redis cache."""
+    ttl = int((expiry_time - datetime.now()).total_seconds()) - ACCESS_TOKEN_EXPIRY_MARGIN
+    if ttl <= 0:
+        return False
 
-    doc.associated_settings = associated_setting
+    frappe.cache().set_value(
+        get_access_token_key(associated_setting, env),
+        {"access_token": token, "expires_in": expiry_time, "fetched_time": fetch_time},
+        expires_in_sec=ttl,
+    )
+    return True
 
-    doc.access_token = token
-    doc.expiry_time = expiry_time
-    doc.token_fetch_time = fetch_time
 
-    try:
-        doc.save(ignore_permissions=True)
-        doc.submit()
+def get_cached_access_token(setting: str, env: str) -> dict[str, str | datetime] | None:
+    """Return the cached token for the Mpesa Settings record, if it is still usable.
 
-        return True
+    Tokens close to expiry are still returned, but a background refresh is scheduled so
+    that callers rarely have to wait on an OAuth round trip.
+    """
+    # expires=True skips the request-local cache, which would otherwise hold on to a miss
+    token = frappe.cache().get_value(get_access_token_key(setting, env), expires=True)
+    if not token:
+        return None
 
-    except Exception:
-        # TODO: Not sure what exception is thrown here. Confirm
-        frappe.throw("Error Encountered")
-        return False
+    remaining = (token["expires_in"] - datetime.now()).total_seconds()
+    if remaining < ACCESS_TOKEN_EXPIRY_MARGIN + ACCESS_TOKEN_REFRESH_WINDOW:
+        frappe.enqueue(
+            "frappe_mpsa_payments.frappe_mpsa_payments.doctype.mpesa_settings.mpesa_settings.refresh_access_token",
+            queue="short",
+            job_id=f"{ACCESS_TOKEN_KEY}::{frappe.local.site}::{setting}::{env}",
+            deduplicate=True,
+            setting=setting,
+        )
+
+    return token
+
+
+def get_access_token(
+    setting: str, env: str, fetch: Callable[[], dict[str, str | datetime]]
+) -> dict[str, str | datetime]:
+    """Return the cached token, calling `fetch` to get a new one on a miss.
+
+    Only one caller across all workers fetches at a time: it holds a short lease on a
+    Redis lock while the others poll the cache for the token it saves. Should the
+    lease run out without a token appearing, the waiting caller fetches one itself.
+    """
+    token = get_cached_access_token(setting, env)
+    if token:
+        return token
+
+    lock_name = f"{get_access_token_key(setting, env)}|lock"
+    lock = acquire_redis_lock(lock_name, ACCESS_TOKEN_LOCK_LEASE)
+    if lock:
+        try:
+            return get_cached_access_token(setting, env) or fetch()
+        finally:
+            release_redis_lock(lock_name, lock)
+
+    deadline = time.monotonic() + ACCESS_TOKEN_LOCK_LEASE
+    while time.monotonic() < deadline:
+        time.sleep(ACCESS_TOKEN_LOCK_POLL_INTERVAL)
+        token = get_cached_access_token(setting, env)
+        if token:
+            return token
+
+    return fetch()
+
+
+def acquire_redis_lock(name: str, lease: int) -> str | None:
+    """Take a cross-process lock (SET NX) that expires after `lease` seconds.
+
+    Returns the token needed to release it, or None if someone else holds the lock.
+    """
+    cache = frappe.cache()
+    token = frappe.generate_hash(length=16)
+    if cache.set(cache.make_key(name), token, nx=True, ex=lease):
+        return token
+
+
+def release_redis_lock(name: str, token: str) -> None:
+    """Release a lock taken with `acquire_redis_lock`, unless its lease already ran out."""
+    cache = frappe.cache()
+    cache.eval(RELEASE_LOCK_SCRIPT, 1, cache.make_key(name), token)
+
+
+def clear_access_tokens(setting: str) -> None:
+    for env in ("sandbox", "production"):
+        frappe.cache().delete_value(get_access_token_key(setting, env))
+
+
+def after_request(response, request) -> None:
+    """Send the ETag set by a whitelisted method, see m_pesa_api.get_c2b_payment_changes."""
+    if frappe.flags.mpesa_etag:
+        response.headers["ETag"] = frappe.flags.mpesa_etag